@@ -4,7 +4,7 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter, SimpleRouter
 
 from app.views import PredictViewSet, SensorViewSet, ComfortViewSet, \
-    IntegrateViewSet
+    IntegrateViewSet, ImageViewSet, MetricsViewSet
 
 if settings.DEBUG:
     router = DefaultRouter()
@@ -15,6 +15,8 @@ router.register("predict", PredictViewSet, basename="predict")
 router.register("sensor", SensorViewSet, basename="sensor")
 router.register("comfort", ComfortViewSet, basename="comfort")
 router.register("integrate", IntegrateViewSet, basename="integrate")
+router.register("image", ImageViewSet, basename="image")
+router.register("metrics", MetricsViewSet, basename="metrics")
 
 urlpatterns = [
     *router.urls,
@@ -1,5 +1,55 @@
 """A module that defines the URL configuration for the app."""
+import gc
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_finished
+
+
+def claim_worker_cpu_slot() -> None:
+    """
+    Apply a CPU slot to a web worker that runs the inference in-process.
+
+    Only the server calls this, from its ``post_fork`` hook, so management
+    commands and the inference pool workers, which claim their own slots,
+    do not hold one.
+    """
+    if settings.CPU_SCHEDULER["slots"] and not settings.INFERENCE_POOL_SIZE:
+        from utils import apply_cpu_slot, set_torch_threads
+        apply_cpu_slot(**settings.CPU_SCHEDULER)
+        set_torch_threads(settings.IMAGE_SEGMENTATION["stage_threads"],
+                          settings.IMAGE_SEGMENTATION["torch_threads"])
+
+
+def start_inference() -> None:
+    """
+    Warm up the models of a web worker.
+
+    Only the server calls this, from its ``post_worker_init`` hook, so
+    management commands such as ``migrate`` never load the models.
+    """
+    if settings.MODEL_WARMUP_ON_STARTUP:
+        from models import get_inference_pool
+        get_inference_pool().warm_up()
+
+
+def write_metrics(**kwargs) -> None:
+    """Save the metrics of the process for the other web workers."""
+    from utils import get_metrics_registry
+    get_metrics_registry().write(settings.METRICS_DIR)
+
+
+def preload_inference() -> None:
+    """
+    Load the models in the server master before it forks the web workers.
+
+    The garbage collected so far is released first, so the heap that the
+    server freezes before forking holds the loaded models and little else.
+    """
+    from models import get_model_registry
+    get_model_registry().preload(settings.MODEL_WARMUP_MODE == "labels")
+    gc.collect()
 
 
 class AppConfig(AppConfig):
@@ -7,3 +57,10 @@ class AppConfig(AppConfig):
 
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        """Save the metrics of the process for the other web workers."""
+        if settings.METRICS_DIR:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            request_finished.connect(write_metrics,
+                                     dispatch_uid='write_metrics')
@@ -0,0 +1 @@
+"""The module contains the management commands of the app."""
@@ -0,0 +1,245 @@
+"""The module defines the benchmark_pipeline management command."""
+import json
+import math
+import platform
+import resource
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from utils import encode_image, get_metrics_registry
+from utils.metrics import STAGE_SECONDS
+
+FIXTURE_IMAGE = "app/tests/test_resources/test_image.jpg"
+# The seed of the synthetic images, so every run benchmarks the same pixels.
+SEED = 1234
+# The conditions of the comfort prediction of every benchmarked image.
+LOCAL_TEMP = 24.0
+LOCAL_HUMID = 55.0
+# Slowdowns below this are timer noise, even when over the tolerance.
+MIN_SLOWDOWN_MS = 1.0
+
+
+class Command(BaseCommand):
+    """Benchmark the segmentation and comfort pipeline on fixed images."""
+
+    help = ("Run the segmentation and the comfort prediction over fixed "
+            "synthetic and fixture images at several resolutions and person "
+            "counts, report the per-stage p50/p95 latency, the throughput "
+            "and the peak RSS as JSON, and fail on a regression against a "
+            "saved baseline.")
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument("--resolutions", type=int, nargs="+",
+                            default=[640, 1280, 1920],
+                            help="The long sides of the benchmarked images.")
+        parser.add_argument("--copies", type=int, nargs="+",
+                            default=[0, 1, 4],
+                            help="The numbers of copies of the fixture image "
+                                 "tiled on every image, which multiply its "
+                                 "persons; 0 benchmarks a synthetic image "
+                                 "without persons.")
+        parser.add_argument("--iterations", type=int, default=10,
+                            help="The timed runs of every image.")
+        parser.add_argument("--warmup", type=int, default=2,
+                            help="The untimed runs of every image.")
+        parser.add_argument("--tier", default=settings.PREDICT_DEFAULT_TIER,
+                            choices=sorted(settings.PREDICT_TIERS),
+                            help="The tier giving the inference size.")
+        parser.add_argument("--output",
+                            help="Write the report to this JSON file, e.g. "
+                                 "to save it as the next baseline.")
+        parser.add_argument("--baseline",
+                            help="Compare the report with this saved one.")
+        parser.add_argument("--tolerance", type=float, default=0.15,
+                            help="The accepted slowdown over the baseline, "
+                                 "as a fraction of its latency.")
+
+    def handle(self, *args, **options):
+        """Benchmark every scenario and compare it with the baseline."""
+        if options["iterations"] < 1:
+            raise CommandError("At least one iteration is required.")
+        segmentation, classifier = self._load_models()
+        imgsz = settings.PREDICT_TIERS[options["tier"]]
+        fixture = self._read_fixture()
+
+        scenarios = {}
+        for resolution in options["resolutions"]:
+            for copies in options["copies"]:
+                name = f"{resolution}px-{copies}x"
+                image_bytes = self._build_image(fixture, resolution, copies)
+                scenarios[name] = self._benchmark(
+                    segmentation, classifier, image_bytes, imgsz,
+                    options["warmup"], options["iterations"])
+                scenarios[name].update(resolution=resolution, copies=copies)
+                self.stdout.write(self._describe(name, scenarios[name]))
+
+        report = {"environment": self._environment(imgsz, options),
+                  "scenarios": scenarios}
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(report, output, indent=2)
+        self.stdout.write(json.dumps(report, indent=2))
+
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline:
+                regressions = self._compare(json.load(baseline), report,
+                                            options["tolerance"])
+            if regressions:
+                raise CommandError("Regressions over the baseline:\n"
+                                   + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS(
+                f"No regression over {options['baseline']} beyond "
+                f"{options['tolerance']:.0%}."))
+
+    def _load_models(self) -> tuple:
+        """
+        Load the segmentation and the classifier in this process.
+
+        The embedding cache is disabled, otherwise every run after the first
+        would skip the SAM encoder.
+        """
+        from models.ComfortClassifier import ComfortClassifier
+        from models.ImageSegmentation import ImageSegmentation
+        segmentation = ImageSegmentation(**{**settings.IMAGE_SEGMENTATION,
+                                            "embedding_cache_size": 0})
+        return segmentation, ComfortClassifier()
+
+    def _read_fixture(self) -> np.ndarray:
+        """Read the fixture image as a BGR array."""
+        import cv2
+        image = cv2.imread(str(settings.BASE_DIR / FIXTURE_IMAGE))
+        if image is None:
+            raise CommandError(f"The fixture {FIXTURE_IMAGE} is missing.")
+        return image
+
+    def _build_image(self, fixture: np.ndarray, resolution: int,
+                     copies: int) -> bytes:
+        """
+        Build the encoded image of a scenario.
+
+        The copies of the fixture are tiled in a square grid over seeded
+        noise, and the grid is scaled to the long side of the resolution.
+        """
+        import cv2
+        rng = np.random.default_rng(SEED)
+        columns = max(1, math.ceil(math.sqrt(copies)))
+        rows = max(1, math.ceil(copies / columns))
+        height, width = fixture.shape[:2]
+        canvas = rng.integers(0, 256, (rows * height, columns * width, 3),
+                              dtype=np.uint8)
+        for index in range(copies):
+            row, column = divmod(index, columns)
+            canvas[row * height:(row + 1) * height,
+                   column * width:(column + 1) * width] = fixture
+
+        scale = resolution / max(canvas.shape[:2])
+        canvas = cv2.resize(canvas, (max(1, round(canvas.shape[1] * scale)),
+                                     max(1, round(canvas.shape[0] * scale))),
+                            interpolation=cv2.INTER_AREA
+                            if scale < 1 else cv2.INTER_LINEAR)
+        # The lossless encoding keeps the pixels identical between runs.
+        return encode_image(canvas, format="png").content
+
+    def _benchmark(self, segmentation, classifier, image_bytes: bytes,
+                   imgsz: int, warmup: int, iterations: int) -> dict:
+        """Run the pipeline on the image and summarize the timed runs."""
+        for _ in range(warmup):
+            self._run(segmentation, classifier, image_bytes, imgsz)
+
+        registry = get_metrics_registry()
+        # Drop the stages recorded before the first timed run.
+        registry.drain()
+        latencies = []
+        stages = {}
+        detections = 0
+        for _ in range(iterations):
+            start = time.perf_counter()
+            labels = self._run(segmentation, classifier, image_bytes, imgsz)
+            latencies.append(time.perf_counter() - start)
+            detections = len(labels)
+            # A stage may run more than once per image, e.g. the SAM decoder
+            # for every person, so its latency is the sum of the run.
+            drained = registry.drain().get(STAGE_SECONDS.name, {})
+            for (stage,), (_, total) in drained.items():
+                stages.setdefault(stage, []).append(total)
+
+        return {
+            "iterations": iterations,
+            "detections": detections,
+            "latency_ms": self._percentiles(latencies),
+            "stages_ms": {stage: self._percentiles(values)
+                          for stage, values in sorted(stages.items())},
+            "throughput_images_per_s": iterations / sum(latencies),
+            "peak_rss_mb": self._peak_rss_mb(),
+        }
+
+    def _run(self, segmentation, classifier, image_bytes: bytes,
+             imgsz: int) -> list:
+        """Segment the image and predict the comfort of its labels."""
+        _, labels = segmentation.segment_image(image_bytes, imgsz)
+        if labels:
+            classifier.predict_comfort_level(labels, LOCAL_TEMP, LOCAL_HUMID)
+        return labels
+
+    def _percentiles(self, seconds: list) -> dict:
+        """Get the p50 and p95 of durations, in milliseconds."""
+        p50, p95 = np.percentile(np.asarray(seconds) * 1000, [50, 95])
+        return {"p50": round(float(p50), 3), "p95": round(float(p95), 3)}
+
+    def _peak_rss_mb(self) -> float:
+        """Get the peak RSS of the process so far, in MiB."""
+        # Linux reports the maximum resident set size in kB.
+        return round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    def _environment(self, imgsz: int, options: dict) -> dict:
+        """Describe what the report was measured with."""
+        return {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "imgsz": imgsz,
+            "iterations": options["iterations"],
+            "warmup": options["warmup"],
+            "image_segmentation": settings.IMAGE_SEGMENTATION,
+        }
+
+    def _describe(self, name: str, scenario: dict) -> str:
+        """Summarize a scenario in one line."""
+        latency = scenario["latency_ms"]
+        return (f"{name}: p50 {latency['p50']:.1f} ms, p95 "
+                f"{latency['p95']:.1f} ms, "
+                f"{scenario['throughput_images_per_s']:.2f} images/s, "
+                f"{scenario['detections']} detections, peak RSS "
+                f"{scenario['peak_rss_mb']:.1f} MiB")
+
+    def _compare(self, baseline: dict, report: dict,
+                 tolerance: float) -> list:
+        """
+        List the latencies slower than the baseline beyond the tolerance.
+
+        Only the scenarios and stages present in both reports are compared.
+        """
+        regressions = []
+        for name, scenario in report["scenarios"].items():
+            previous = baseline.get("scenarios", {}).get(name)
+            if previous is None:
+                continue
+            pairs = [("total", scenario["latency_ms"],
+                      previous["latency_ms"])]
+            pairs += [(stage, values, previous["stages_ms"][stage])
+                      for stage, values in scenario["stages_ms"].items()
+                      if stage in previous.get("stages_ms", {})]
+            for stage, current, before in pairs:
+                for percentile in ("p50", "p95"):
+                    limit = max(before[percentile] * (1 + tolerance),
+                                before[percentile] + MIN_SLOWDOWN_MS)
+                    if current[percentile] > limit:
+                        regressions.append(
+                            f"{name} {stage} {percentile}: "
+                            f"{current[percentile]:.1f} ms over "
+                            f"{before[percentile]:.1f} ms")
+        return regressions
@@ -0,0 +1,79 @@
+"""The module defines the benchmark_startup management command."""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# The libraries only the inference needs, which the startup must not import.
+HEAVY_MODULES = ["torch", "ultralytics", "segment_anything", "supervision",
+                 "cv2", "pandas", "joblib"]
+
+# Set up Django and load every URL configuration, like the first request of
+# a web worker does, then report the time, the memory and the heavy modules.
+STARTUP_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.conf import settings
+from django.urls import get_resolver
+get_resolver(settings.ROOT_URLCONF).url_patterns
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "heavy_modules": [name for name in sys.argv[1:] if name in sys.modules],
+}))
+"""
+
+
+class Command(BaseCommand):
+    """Measure the startup of a web worker in a fresh interpreter."""
+
+    help = ("Set up Django and load the URL configuration in fresh "
+            "interpreters, report the import time and memory, and fail if "
+            "an inference library is imported on the way.")
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument("--runs", type=int, default=3,
+                            help="The number of fresh interpreters to time.")
+        parser.add_argument("--max-seconds", type=float, default=None,
+                            help="Fail if the median startup takes longer.")
+
+    def handle(self, *args, **options):
+        """Time the startup and check that it stays light."""
+        results = [self._measure() for _ in range(max(1, options["runs"]))]
+        for result in results:
+            self.stdout.write(
+                f"Startup in {result['seconds']:.3f}s, "
+                f"max RSS {result['max_rss_kb'] / 1024:.1f} MiB.")
+        median = statistics.median(result["seconds"] for result in results)
+
+        heavy_modules = sorted({name for result in results
+                                for name in result["heavy_modules"]})
+        if heavy_modules:
+            raise CommandError(
+                f"The startup imports {', '.join(heavy_modules)}.")
+        if options["max_seconds"] and median > options["max_seconds"]:
+            raise CommandError(
+                f"The median startup takes {median:.3f}s, the limit is "
+                f"{options['max_seconds']}s.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Median startup in {median:.3f}s without importing "
+            f"{', '.join(HEAVY_MODULES)}."))
+
+    def _measure(self) -> dict:
+        """Run the startup script in a fresh interpreter."""
+        env = dict(os.environ)
+        env.setdefault("DJANGO_SETTINGS_MODULE", "comfywearbackend.settings")
+        completed = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, *HEAVY_MODULES],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(
+                f"The startup failed:\n{completed.stderr.strip()}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
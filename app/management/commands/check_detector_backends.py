@@ -0,0 +1,93 @@
+"""The module defines the check_detector_backends management command."""
+import os
+
+import numpy as np
+import supervision as sv
+from django.core.management.base import BaseCommand, CommandError
+
+from models import load_detector
+from utils import check_and_download_files, decode_image
+
+MODEL_BASE_PATH = "models/weights/"
+DETECTORS = ["best.pt", "yolov9c.pt"]
+FIXTURE_IMAGES = ["app/tests/test_resources/test_image.jpg"]
+
+
+class Command(BaseCommand):
+    """Check that the ONNX detectors match the PyTorch detectors."""
+
+    help = ("Run the YOLO detectors with the torch and the onnx backends "
+            "and check that their detections match within a tolerance.")
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument("images", nargs="*", default=FIXTURE_IMAGES,
+                            help="The images to compare the backends on.")
+        parser.add_argument("--iou", type=float, default=0.9,
+                            help="The minimum IoU of matching boxes.")
+        parser.add_argument("--confidence-tolerance", type=float,
+                            default=0.05,
+                            help="The largest confidence difference of "
+                                 "matching boxes.")
+
+    def handle(self, *args, **options):
+        """Compare the detections of both backends on every image."""
+        check_and_download_files(MODEL_BASE_PATH)
+        images = [decode_image(path) for path in options["images"]]
+        mismatches = 0
+        for weights in DETECTORS:
+            weights_path = os.path.join(MODEL_BASE_PATH, weights)
+            torch_model = load_detector(weights_path, "torch")
+            onnx_model = load_detector(weights_path, "onnx")
+            for path, image in zip(options["images"], images):
+                expected = sv.Detections.from_ultralytics(
+                    torch_model(image, imgsz=480)[0])
+                actual = sv.Detections.from_ultralytics(
+                    onnx_model(image, imgsz=480)[0])
+                errors = self._compare(expected, actual, options["iou"],
+                                       options["confidence_tolerance"])
+                for error in errors:
+                    self.stderr.write(f"{weights} on {path}: {error}")
+                mismatches += len(errors)
+
+        if mismatches:
+            raise CommandError(f"{mismatches} detections do not match.")
+        self.stdout.write(self.style.SUCCESS(
+            "The onnx backend matches the torch backend."))
+
+    def _compare(self, expected: sv.Detections, actual: sv.Detections,
+                 min_iou: float, confidence_tolerance: float) -> list:
+        """
+        Compare the detections of the two backends.
+
+        :param expected: The detections of the torch backend.
+        :type expected: supervision.Detections
+        :param actual: The detections of the onnx backend.
+        :type actual: supervision.Detections
+        :param min_iou: The minimum IoU of matching boxes.
+        :type min_iou: float
+        :param confidence_tolerance: The largest confidence difference.
+        :type confidence_tolerance: float
+        :return: A description of every mismatch.
+        :rtype: list[str]
+        """
+        if len(expected) != len(actual):
+            return [f"expected {len(expected)} detections, "
+                    f"got {len(actual)}"]
+        if len(expected) == 0:
+            return []
+
+        errors = []
+        ious = sv.box_iou_batch(expected.xyxy, actual.xyxy)
+        same_class = expected.class_id[:, None] == actual.class_id[None, :]
+        ious = np.where(same_class, ious, 0)
+        for i, j in enumerate(ious.argmax(axis=1)):
+            if ious[i, j] < min_iou:
+                errors.append(f"box {expected.xyxy[i].tolist()} has no "
+                              f"match (best IoU {ious[i, j]:.3f})")
+            elif abs(expected.confidence[i]
+                     - actual.confidence[j]) > confidence_tolerance:
+                errors.append(f"box {expected.xyxy[i].tolist()} confidence "
+                              f"{expected.confidence[i]:.3f} != "
+                              f"{actual.confidence[j]:.3f}")
+        return errors
@@ -0,0 +1,90 @@
+"""The module defines the check_sam_quantization management command."""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from models import ImageSegmentation
+from utils import decode_image
+
+FIXTURE_IMAGES = ["app/tests/test_resources/test_image.jpg"]
+
+
+class Command(BaseCommand):
+    """Compare the masks of the INT8 SAM encoder with the fp32 encoder."""
+
+    help = ("Segment the persons of fixture images with the fp32 and the "
+            "INT8 quantized SAM encoder and report the mask IoU between "
+            "them and the encoder latency of both.")
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument("images", nargs="*", default=FIXTURE_IMAGES,
+                            help="The images to compare the encoders on.")
+        parser.add_argument("--min-iou", type=float, default=0.9,
+                            help="The minimum mean mask IoU to accept.")
+
+    def handle(self, *args, **options):
+        """Compare the masks of both encoders on every image."""
+        # Without the embedding cache, every image runs through the encoder.
+        segmentations = {
+            "fp32": ImageSegmentation(embedding_cache_size=0),
+            "int8": ImageSegmentation(embedding_cache_size=0,
+                                      quantize_sam=True),
+        }
+        reference = segmentations["fp32"]
+        # SAM is loaded on first use, which must not count as latency.
+        for segmentation in segmentations.values():
+            segmentation.mask_predictor
+
+        ious = []
+        latencies = {name: [] for name in segmentations}
+        for path in options["images"]:
+            image = decode_image(path)
+            boxes = reference._person_detections(
+                reference._detect_persons(image)).xyxy
+            if len(boxes) == 0:
+                self.stderr.write(f"{path}: no person detected, skipped.")
+                continue
+
+            masks = {}
+            for name, segmentation in segmentations.items():
+                start = time.perf_counter()
+                embedding = segmentation._embed_image(image)
+                latencies[name].append(time.perf_counter() - start)
+                masks[name] = segmentation._predict_masks(embedding, boxes)
+            image_ious = self._mask_iou(masks["fp32"], masks["int8"])
+            self.stdout.write(f"{path}: mean mask IoU "
+                              f"{image_ious.mean():.4f} over "
+                              f"{len(image_ious)} persons")
+            ious.extend(image_ious.tolist())
+
+        if not ious:
+            raise CommandError("No person was detected in the images.")
+        for name, values in latencies.items():
+            self.stdout.write(f"{name} encoder: "
+                              f"{np.mean(values) * 1000:.0f} ms per image")
+        mean_iou = float(np.mean(ious))
+        self.stdout.write(f"Mean mask IoU: {mean_iou:.4f}, "
+                          f"minimum: {min(ious):.4f}")
+        if mean_iou < options["min_iou"]:
+            raise CommandError(f"The mean mask IoU {mean_iou:.4f} is below "
+                               f"{options['min_iou']}.")
+        self.stdout.write(self.style.SUCCESS(
+            "The quantized encoder is within the accepted mask IoU."))
+
+    def _mask_iou(self, expected: np.ndarray,
+                  actual: np.ndarray) -> np.ndarray:
+        """
+        Compute the IoU of every pair of masks.
+
+        :param expected: The reference masks, with shape (N, H, W).
+        :type expected: numpy.ndarray
+        :param actual: The masks to compare, with shape (N, H, W).
+        :type actual: numpy.ndarray
+        :return: The IoU of each pair of masks.
+        :rtype: numpy.ndarray
+        """
+        intersection = np.logical_and(expected, actual).sum(axis=(1, 2))
+        union = np.logical_or(expected, actual).sum(axis=(1, 2))
+        return np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
@@ -0,0 +1,108 @@
+"""The module defines the measure_worker_memory management command."""
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+# The fields of /proc/<pid>/smaps_rollup that are reported, in kB.
+MEMORY_FIELDS = ["Rss", "Pss", "Shared_Clean", "Shared_Dirty",
+                 "Private_Clean", "Private_Dirty"]
+
+
+class Command(BaseCommand):
+    """Report the RSS and PSS of a server master and its workers."""
+
+    help = ("Read the RSS and PSS of a server master and of all its "
+            "descendant processes from /proc, to compare the memory of the "
+            "workers with and without MODEL_PRELOAD.")
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument("pid", type=int,
+                            help="The process id of the server master.")
+        parser.add_argument("--json", action="store_true",
+                            help="Print the measurements as JSON.")
+
+    def handle(self, *args, **options):
+        """Measure the master and its workers."""
+        pids = [options["pid"]] + self._descendants(options["pid"])
+        processes = []
+        for pid in pids:
+            try:
+                memory = self._read_memory(pid)
+            except FileNotFoundError:
+                # The process exited while it was measured.
+                continue
+            processes.append({"pid": pid, "name": self._read_name(pid),
+                              **memory})
+        if not processes or processes[0]["pid"] != options["pid"]:
+            raise CommandError(f"No process with the id {options['pid']}.")
+
+        totals = {field: sum(process[field] for process in processes)
+                  for field in ("rss_kb", "pss_kb")}
+        # The PSS counts every shared page once over all the processes, so
+        # the difference to the RSS is the memory saved by the sharing.
+        totals["shared_savings_kb"] = totals["rss_kb"] - totals["pss_kb"]
+        if options["json"]:
+            self.stdout.write(json.dumps({"processes": processes,
+                                          "totals": totals}, indent=2))
+            return
+
+        self.stdout.write(f"{'pid':>8} {'name':<16} {'RSS':>10} {'PSS':>10} "
+                          f"{'shared':>10} {'private':>10}  (MiB)")
+        for process in processes:
+            self.stdout.write(
+                f"{process['pid']:>8} {process['name'][:16]:<16} "
+                f"{process['rss_kb'] / 1024:>10.1f} "
+                f"{process['pss_kb'] / 1024:>10.1f} "
+                f"{process['shared_kb'] / 1024:>10.1f} "
+                f"{process['private_kb'] / 1024:>10.1f}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(processes)} processes: RSS {totals['rss_kb'] / 1024:.1f} "
+            f"MiB, PSS {totals['pss_kb'] / 1024:.1f} MiB, "
+            f"{totals['shared_savings_kb'] / 1024:.1f} MiB shared."))
+
+    def _descendants(self, pid: int) -> list:
+        """Get the ids of the children of the process, recursively."""
+        children = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as stat:
+                    # The name may contain spaces, the fields follow its ")".
+                    fields = stat.read().rsplit(")", 1)[1].split()
+            except (FileNotFoundError, ProcessLookupError, IndexError):
+                continue
+            children.setdefault(int(fields[1]), []).append(int(entry))
+
+        descendants = []
+        pending = list(children.get(pid, []))
+        while pending:
+            child = pending.pop(0)
+            descendants.append(child)
+            pending.extend(children.get(child, []))
+        return descendants
+
+    def _read_memory(self, pid: int) -> dict:
+        """Read the memory of the process from its smaps_rollup."""
+        values = dict.fromkeys(MEMORY_FIELDS, 0)
+        with open(f"/proc/{pid}/smaps_rollup") as smaps:
+            for line in smaps:
+                field, _, value = line.partition(":")
+                if field in values:
+                    values[field] = int(value.split()[0])
+        return {
+            "rss_kb": values["Rss"],
+            "pss_kb": values["Pss"],
+            "shared_kb": values["Shared_Clean"] + values["Shared_Dirty"],
+            "private_kb": values["Private_Clean"] + values["Private_Dirty"],
+        }
+
+    def _read_name(self, pid: int) -> str:
+        """Read the command name of the process."""
+        try:
+            with open(f"/proc/{pid}/comm") as comm:
+                return comm.read().strip()
+        except FileNotFoundError:
+            return ""
@@ -0,0 +1,127 @@
+"""The module defines the warmup_models management command."""
+import os
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+FIXTURE_IMAGE = "app/tests/test_resources/test_image.jpg"
+
+
+class Command(BaseCommand):
+    """Warm up a running server through real predictions."""
+
+    help = ("Send real predictions of a fixture image to a running server, "
+            "so its workers load and warm up their models, and fail unless "
+            "every prediction succeeds. Run it as the readiness check of a "
+            "deployment.")
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument("--url", default="http://127.0.0.1:8000",
+                            help="The base URL of the running server.")
+        parser.add_argument("--secret", default="warmup",
+                            help="The secret of the integrate the warm-up "
+                                 "predictions are saved to.")
+        parser.add_argument("--mode", default=settings.MODEL_WARMUP_MODE,
+                            choices=["full", "labels"],
+                            help="The prediction mode to warm up.")
+        parser.add_argument("--requests", type=int,
+                            default=int(os.environ.get("GUNICORN_WORKERS",
+                                                       1)),
+                            help="The concurrent predictions, at least the "
+                                 "number of server workers so each of them "
+                                 "is likely to get one.")
+        parser.add_argument("--wait", type=float, default=60,
+                            help="The seconds to wait for the server to "
+                                 "accept connections.")
+        parser.add_argument("--timeout", type=float,
+                            default=settings.INFERENCE_TIMEOUT,
+                            help="The seconds to wait for a prediction.")
+
+    def handle(self, *args, **options):
+        """Send the predictions and check their responses."""
+        url = options["url"].rstrip("/") + reverse("predict-list")
+        images = self._build_images(max(1, options["requests"]))
+        deadline = time.monotonic() + options["wait"]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(images)) as executor:
+            results = list(executor.map(
+                lambda image: self._predict(url, image, options, deadline),
+                images))
+        elapsed = time.perf_counter() - start
+
+        failures = [error for error in results if error]
+        if failures:
+            raise CommandError(f"{len(failures)} of {len(results)} warm-up "
+                               "predictions failed:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(results)} warm-up predictions succeeded in "
+            f"{elapsed:.2f}s."))
+
+    def _build_images(self, count: int) -> list:
+        """
+        Encode distinct copies of the fixture image.
+
+        The server caches the predictions by the content of the upload, so
+        every copy gets a different first pixel to run a real inference.
+        """
+        import cv2
+        image = cv2.imread(str(settings.BASE_DIR / FIXTURE_IMAGE))
+        if image is None:
+            raise CommandError(f"The fixture {FIXTURE_IMAGE} is missing.")
+        nonce = uuid.uuid4().int
+        images = []
+        for index in range(count):
+            copy = image.copy()
+            copy[0, 0] = [(nonce >> shift) & 0xFF for shift in (0, 8, 16)]
+            copy[0, 1] = index % 256
+            # PNG is lossless, so the changed pixels survive the encoding.
+            images.append(cv2.imencode(".png", copy)[1].tobytes())
+        return images
+
+    def _predict(self, url: str, image: bytes, options: dict,
+                 deadline: float) -> str:
+        """
+        Send one prediction, retrying until the server accepts connections.
+
+        :return: The error of the prediction, or an empty string.
+        """
+        body, content_type = self._encode_form(
+            {"secret": options["secret"], "mode": options["mode"]}, image)
+        request = urllib.request.Request(
+            url, data=body, headers={"Content-Type": content_type},
+            method="POST")
+        while True:
+            try:
+                with urllib.request.urlopen(request,
+                                            timeout=options["timeout"]):
+                    return ""
+            except urllib.error.HTTPError as e:
+                return f"{url} answered {e.code}: {e.read()[:200]!r}"
+            except TimeoutError:
+                return (f"{url} did not answer within "
+                        f"{options['timeout']} seconds.")
+            except (urllib.error.URLError, ConnectionError) as e:
+                if time.monotonic() >= deadline:
+                    return f"{url} is not reachable: {e}"
+                time.sleep(1)
+
+    def _encode_form(self, fields: dict, image: bytes) -> tuple:
+        """Encode the fields and the image as a multipart form."""
+        boundary = uuid.uuid4().hex
+        parts = [f'--{boundary}\r\nContent-Disposition: form-data; '
+                 f'name="{name}"\r\n\r\n{value}\r\n'.encode()
+                 for name, value in fields.items()]
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; '
+                     f'name="image"; filename="warmup.png"\r\n'
+                     f'Content-Type: image/png\r\n\r\n'.encode()
+                     + image + b"\r\n")
+        parts.append(f"--{boundary}--\r\n".encode())
+        return b"".join(parts), f"multipart/form-data; boundary={boundary}"
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_rename_prediction_predict'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='preview_image',
+            field=models.ImageField(blank=True, null=True, upload_to='detected_images/'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='thumbnail_image',
+            field=models.ImageField(blank=True, null=True, upload_to='detected_images/'),
+        ),
+    ]
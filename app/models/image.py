@@ -15,6 +15,11 @@ class Image(AbstractModel):
 
     :param detected_image: The field for storing the uploaded image.
     :type detected_image: models.ImageField
+    :param preview_image: The field for storing the preview of the image.
+    :type preview_image: models.ImageField
+    :param thumbnail_image: The field for storing the thumbnail of the
+        image.
+    :type thumbnail_image: models.ImageField
     :param integrate: The foreign key to the associated integrate.
     :type integrate: models.ForeignKey
 
@@ -25,6 +30,12 @@ class Image(AbstractModel):
     detected_image = models.ImageField(
         upload_to='detected_images/', null=True, blank=True
     )
+    preview_image = models.ImageField(
+        upload_to='detected_images/', null=True, blank=True
+    )
+    thumbnail_image = models.ImageField(
+        upload_to='detected_images/', null=True, blank=True
+    )
     integrate = models.ForeignKey(
         Integrate, on_delete=models.CASCADE, related_name='images', null=True
     )
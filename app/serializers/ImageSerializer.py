@@ -10,10 +10,43 @@ class ImageSerializer(serializers.ModelSerializer):
 
     Handles the conversion of Image model instances to JSON format and
     vice versa, simplifying the process of transmitting Task data over APIs.
+
+    When the request has a "size" query parameter, only the field of that
+    size variant is returned, so clients showing tiles do not have to pick
+    it out of the full-size URLs.
     """
 
+    # The field of every size variant of the annotated image.
+    SIZES = {
+        'full': 'detected_image',
+        'preview': 'preview_image',
+        'thumbnail': 'thumbnail_image',
+    }
+
     class Meta:
         """Meta definition for Task."""
 
         model = Image
         fields = "__all__"
+
+    def to_representation(self, instance: Image) -> dict:
+        """
+        Convert the Image to its data, keeping the requested size variant.
+
+        :param instance: The Image object.
+        :type instance: app.models.Image
+        :return: The data of the Image.
+        :rtype: dict
+        """
+        data = super().to_representation(instance)
+        request = self.context.get('request')
+        size = request.query_params.get('size') if request else None
+        if size in self.SIZES:
+            field = self.SIZES[size]
+            # Images saved before the derivatives existed only have the
+            # full size.
+            url = data[field] or data['detected_image']
+            for variant in self.SIZES.values():
+                data.pop(variant)
+            data[field] = url
+        return data
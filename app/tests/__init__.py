@@ -4,3 +4,15 @@ from app.tests.test_comfort import ComfortViewSetTestCase  # noqa: F401
 from app.tests.test_sensor import SensorViewSetTestCase  # noqa: F401
 from app.tests.test_predict import PredictViewSetTestCase  # noqa: F401
 from app.tests.test_integrate import IntegrateViewSetTestCase  # noqa: F401
+from app.tests.test_startup import StartupTestCase  # noqa: F401
+from app.tests.test_metrics import MetricsViewSetTestCase  # noqa: F401
+from app.tests.test_benchmark import BenchmarkPipelineTestCase  # noqa: F401
+from app.tests.test_classifier import ComfortClassifierTestCase  # noqa: F401
+from app.tests.test_warmup import WarmupModelsTestCase  # noqa: F401
+from app.tests.test_inference_pool import InferencePoolTestCase  # noqa: F401
+from app.tests.test_detection_batcher import \
+    DetectionBatcherTestCase  # noqa: F401
+from app.tests.test_embedding_cache import EmbeddingCacheTestCase  # noqa: F401
+from app.tests.test_segmentation import ImageSegmentationTestCase  # noqa: F401
+from app.tests.test_cpu_scheduler import CpuSchedulerTestCase  # noqa: F401
+from app.tests.test_model_registry import ModelRegistryTestCase  # noqa: F401
@@ -0,0 +1,95 @@
+"""The module that defines the BenchmarkPipelineTestCase class."""
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+from app.management.commands.benchmark_pipeline import Command
+from utils import time_stage
+
+
+class _FakeSegmentation:
+    """A segmentation recording its stages without running any model."""
+
+    def segment_image(self, image, imgsz: int = 480) -> tuple:
+        """Record a decode and a garment detection stage."""
+        with time_stage("decode"):
+            pass
+        with time_stage("garment_detection"):
+            pass
+        return None, [("Hoodie", "Jeans")]
+
+
+class _FakeClassifier:
+    """A classifier recording its stage without running any model."""
+
+    def predict_comfort_level(self, labels: list, local_temp: float,
+                              local_humid: float) -> list:
+        """Record the classifier stage."""
+        with time_stage("classifier"):
+            return [1] * len(labels)
+
+
+class BenchmarkPipelineTestCase(SimpleTestCase):
+    """This class defines the test suite for the pipeline benchmark."""
+
+    def setUp(self):
+        """Replace the models of the benchmark with the fakes."""
+        patcher = mock.patch.object(
+            Command, "_load_models",
+            return_value=(_FakeSegmentation(), _FakeClassifier()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.report_path = os.path.join(directory.name, "report.json")
+
+    def _benchmark(self, **options) -> dict:
+        """Run the benchmark on two small scenarios and load its report."""
+        call_command("benchmark_pipeline", resolutions=[64], copies=[0, 1],
+                     iterations=3, warmup=1, output=self.report_path,
+                     stdout=io.StringIO(), **options)
+        with open(self.report_path) as report:
+            return json.load(report)
+
+    def test_benchmark_reports_every_scenario(self):
+        """Test the report holds the stages, throughput and RSS."""
+        report = self._benchmark()
+        self.assertEqual(set(report["scenarios"]), {"64px-0x", "64px-1x"})
+        scenario = report["scenarios"]["64px-1x"]
+        self.assertEqual(scenario["iterations"], 3)
+        self.assertEqual(scenario["detections"], 1)
+        self.assertEqual(set(scenario["stages_ms"]),
+                         {"decode", "garment_detection", "classifier"})
+        self.assertLessEqual(scenario["latency_ms"]["p50"],
+                             scenario["latency_ms"]["p95"])
+        self.assertGreater(scenario["throughput_images_per_s"], 0)
+        self.assertGreater(scenario["peak_rss_mb"], 0)
+
+    def test_benchmark_fails_on_a_regression(self):
+        """Test a baseline much faster than the run fails the benchmark."""
+        report = self._benchmark()
+        for scenario in report["scenarios"].values():
+            scenario["latency_ms"] = {"p50": -10.0, "p95": -10.0}
+        baseline_path = self.report_path + ".baseline"
+        with open(baseline_path, "w") as baseline:
+            json.dump(report, baseline)
+
+        with self.assertRaisesMessage(CommandError, "64px-1x total p50"):
+            self._benchmark(baseline=baseline_path)
+
+    def test_benchmark_passes_within_the_tolerance(self):
+        """Test a run within the tolerance of the baseline passes."""
+        report = self._benchmark()
+        for scenario in report["scenarios"].values():
+            scenario["latency_ms"] = {"p50": 1000.0, "p95": 1000.0}
+        baseline_path = self.report_path + ".baseline"
+        with open(baseline_path, "w") as baseline:
+            json.dump(report, baseline)
+
+        self._benchmark(baseline=baseline_path)
@@ -0,0 +1,52 @@
+"""The module that defines the ComfortClassifierTestCase class."""
+import importlib
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
+
+classifier_module = importlib.import_module("models.ComfortClassifier")
+
+
+class ComfortClassifierTestCase(SimpleTestCase):
+    """This class defines the test suite for the comfort classifier."""
+
+    def setUp(self):
+        """Build a classifier on scalers fitted to random features."""
+        rng = np.random.default_rng(0)
+        self.scaler_temp_humid = StandardScaler().fit(
+            np.c_[rng.uniform(10, 35, 50), rng.uniform(20, 90, 50)])
+        self.scaler_other = MinMaxScaler().fit(rng.integers(0, 2, (50, 7)))
+        self.model = mock.Mock()
+        self.model.predict.side_effect = lambda data: np.zeros(len(data))
+        with mock.patch.object(classifier_module,
+                               "check_and_download_files"), \
+                mock.patch.object(classifier_module.ComfortClassifier,
+                                  "load_model",
+                                  side_effect=[self.model,
+                                               self.scaler_temp_humid,
+                                               self.scaler_other]):
+            self.classifier = classifier_module.ComfortClassifier()
+
+    def test_input_data_matches_the_scalers(self):
+        """Test the fused encoding equals scaling each part on its own."""
+        labels = [("short sleeve top", "trousers"), ("vest dress", None),
+                  (None, "shorts"), ("long sleeve outwear", "sling")]
+        # The columns of the labels, after mapping the dresses, vests and
+        # slings to the columns of the dataset.
+        expected_cloth = np.zeros((len(labels), 7))
+        for row, columns in enumerate([(1, 6), (1,), (4,), (2, 5)]):
+            expected_cloth[row, list(columns)] = 1
+        expected = np.concatenate((
+            self.scaler_temp_humid.transform([[24.0, 55.0]] * len(labels)),
+            self.scaler_other.transform(expected_cloth)), axis=1)
+
+        input_data = self.classifier._prepare_input_data(labels, 24.0, 55.0)
+        np.testing.assert_allclose(input_data, expected)
+
+    def test_predict_without_labels(self):
+        """Test an image without clothes skips the classifier."""
+        self.assertEqual(
+            self.classifier.predict_comfort_level([], 24.0, 55.0), [])
+        self.model.predict.assert_not_called()
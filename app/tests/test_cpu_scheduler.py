@@ -0,0 +1,130 @@
+"""The module that defines the CpuSchedulerTestCase class."""
+import fcntl
+import os
+import sys
+import tempfile
+from unittest import mock
+
+from django.apps import apps
+from django.test import SimpleTestCase, override_settings
+
+from app.apps import claim_worker_cpu_slot
+from utils import cpu_scheduler
+
+SCHEDULER = {"slots": 2, "pin": False, "inter_op_threads": 1,
+             "lock_dir": None}
+
+
+class CpuSchedulerTestCase(SimpleTestCase):
+    """This class defines the test suite for the CPU slots."""
+
+    def setUp(self):
+        """Keep the slot of the test process out of reach of the tests."""
+        for name in ("_current_slot", "_slot_lock_file"):
+            patcher = mock.patch.object(cpu_scheduler, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self._release_slot)
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        self.lock_dir = lock_dir.name
+
+    def _release_slot(self):
+        """Close the lock file of the slot claimed by a test."""
+        if cpu_scheduler._slot_lock_file is not None:
+            cpu_scheduler._slot_lock_file.close()
+
+    def _hold_slot(self, index: int):
+        """Lock a slot as if another process held it."""
+        lock_file = open(os.path.join(
+            self.lock_dir, f"comfywear-cpu-slot-{index}.lock"), "a")
+        self.addCleanup(lock_file.close)
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def test_cores_are_split_into_contiguous_groups(self):
+        """Test the groups cover the cores and differ by one core at most."""
+        self.assertEqual(cpu_scheduler.partition_cores(3, list(range(8))),
+                         [[0, 1, 2], [3, 4, 5], [6, 7]])
+        self.assertEqual(cpu_scheduler.partition_cores(2, [5, 4, 7, 6]),
+                         [[4, 5], [6, 7]])
+
+    def test_slots_share_the_cores_when_there_are_fewer(self):
+        """Test every slot gets one core when the cores are too few."""
+        self.assertEqual(cpu_scheduler.partition_cores(3, [0, 1]),
+                         [[0], [1], [0]])
+
+    def test_processes_claim_distinct_slots(self):
+        """Test a slot held by another process is skipped."""
+        self._hold_slot(0)
+        self.assertEqual(cpu_scheduler.claim_cpu_slot(3, self.lock_dir), 1)
+        self.assertIsNotNone(cpu_scheduler._slot_lock_file)
+
+    def test_all_slots_taken_falls_back_to_the_process_id(self):
+        """Test a process still gets a slot when all of them are held."""
+        self._hold_slot(0)
+        self._hold_slot(1)
+        self.assertEqual(cpu_scheduler.claim_cpu_slot(2, self.lock_dir),
+                         os.getpid() % 2)
+        self.assertIsNone(cpu_scheduler._slot_lock_file)
+
+    def test_applied_slot_restricts_the_threads(self):
+        """Test the process runs its threads on the cores of its slot."""
+        self._hold_slot(0)
+        with mock.patch.object(cpu_scheduler, "_affinity",
+                               return_value=list(range(8))), \
+                mock.patch.dict(os.environ), \
+                self.assertLogs("utils.cpu_scheduler") as logs:
+            slot = cpu_scheduler.apply_cpu_slot(2, lock_dir=self.lock_dir)
+            self.assertEqual(os.environ["OMP_NUM_THREADS"], "4")
+            self.assertEqual(os.environ["MKL_NUM_THREADS"], "4")
+        self.assertEqual(slot.index, 1)
+        self.assertEqual(slot.cores, [4, 5, 6, 7])
+        self.assertEqual(cpu_scheduler.available_cores(), [4, 5, 6, 7])
+        self.assertIn("CPU slot 2/2", logs.output[0])
+
+    @override_settings(CPU_SCHEDULER=SCHEDULER, INFERENCE_POOL_SIZE=0,
+                       MODEL_PRELOAD=False, MODEL_WARMUP_ON_STARTUP=False)
+    def test_only_serving_processes_claim_a_slot(self):
+        """Test starting Django claims no slot, and a web worker does."""
+        with mock.patch("utils.apply_cpu_slot") as apply_cpu_slot:
+            apps.get_app_config("app").ready()
+            apply_cpu_slot.assert_not_called()
+            claim_worker_cpu_slot()
+        apply_cpu_slot.assert_called_once_with(**SCHEDULER)
+
+    @override_settings(CPU_SCHEDULER=SCHEDULER, INFERENCE_POOL_SIZE=0,
+                       IMAGE_SEGMENTATION={"stage_threads": 2,
+                                           "torch_threads": None})
+    def test_torch_threads_are_split_within_the_slot(self):
+        """Test a forked worker splits its slot between the stages."""
+        torch = mock.Mock()
+        self._hold_slot(0)
+        with mock.patch.dict(sys.modules, {"torch": torch}), \
+                mock.patch.dict(SCHEDULER, lock_dir=self.lock_dir), \
+                mock.patch.object(cpu_scheduler, "_affinity",
+                                  return_value=list(range(12))), \
+                mock.patch.dict(os.environ), \
+                self.assertLogs("utils.cpu_scheduler"):
+            claim_worker_cpu_slot()
+        # 6 cores in the slot, shared by 2 stages.
+        torch.set_num_threads.assert_called_once_with(3)
+        torch.set_num_interop_threads.assert_called_once_with(1)
+
+    def test_torch_keeps_its_threads_without_slot_or_stages(self):
+        """Test torch is left alone when nothing splits the cores."""
+        torch = mock.Mock()
+        with mock.patch.dict(sys.modules, {"torch": torch}), \
+                mock.patch.object(cpu_scheduler, "_affinity",
+                                  return_value=list(range(8))):
+            self.assertIsNone(cpu_scheduler.set_torch_threads())
+            self.assertEqual(cpu_scheduler.set_torch_threads(3), 2)
+            self.assertEqual(cpu_scheduler.set_torch_threads(3, 5), 5)
+        self.assertEqual(torch.set_num_threads.call_args_list,
+                         [mock.call(2), mock.call(5)])
+
+    @override_settings(CPU_SCHEDULER=SCHEDULER, INFERENCE_POOL_SIZE=2)
+    def test_web_workers_leave_the_slots_to_the_pool(self):
+        """Test a web worker claims no slot when a pool runs the models."""
+        with mock.patch("utils.apply_cpu_slot") as apply_cpu_slot:
+            claim_worker_cpu_slot()
+        apply_cpu_slot.assert_not_called()
@@ -0,0 +1,99 @@
+"""The module that defines the DetectionBatcherTestCase class."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import SimpleTestCase
+
+from models.DetectionBatcher import DetectionBatcher
+
+
+class _FakeModel:
+    """A model recording its calls and detecting the source itself."""
+
+    def __init__(self, error: Exception = None):
+        """Initialize the _FakeModel class."""
+        self.calls = []
+        self.error = error
+
+    def __call__(self, sources, imgsz: int = 480) -> list:
+        """Record the batch, then fail or return a result per source."""
+        self.calls.append((list(sources), imgsz))
+        if self.error is not None:
+            raise self.error
+        return [f"result of {source}" for source in sources]
+
+
+class DetectionBatcherTestCase(SimpleTestCase):
+    """This class defines the test suite for the detection batcher."""
+
+    def _predict_concurrently(self, batcher: DetectionBatcher,
+                              sources: list) -> list:
+        """Send the sources at the same time, one per thread."""
+        barrier = threading.Barrier(len(sources))
+
+        def predict(source):
+            barrier.wait()
+            try:
+                return batcher.predict(source, imgsz=320)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+            return list(executor.map(predict, sources))
+
+    def test_concurrent_requests_share_one_call(self):
+        """Test concurrent requests are merged into one model call."""
+        model = _FakeModel()
+        batcher = DetectionBatcher(model, max_batch_size=4,
+                                   max_wait_ms=5000)
+        sources = ["a.jpg", "b.jpg", "c.jpg", "d.jpg"]
+        start = time.perf_counter()
+        results = self._predict_concurrently(batcher, sources)
+        # A full batch runs without waiting for the end of the window.
+        self.assertLess(time.perf_counter() - start, 2)
+        self.assertEqual(results,
+                         [f"result of {source}" for source in sources])
+        self.assertEqual(len(model.calls), 1)
+        self.assertCountEqual(model.calls[0][0], sources)
+        self.assertEqual(model.calls[0][1], 320)
+
+    def test_lone_request_flushes_after_the_wait(self):
+        """Test a request without company runs once the window is over."""
+        model = _FakeModel()
+        batcher = DetectionBatcher(model, max_batch_size=4, max_wait_ms=50)
+        start = time.perf_counter()
+        result = batcher.predict("a.jpg")
+        elapsed = time.perf_counter() - start
+        self.assertEqual(result, "result of a.jpg")
+        self.assertGreaterEqual(elapsed, 0.05)
+        self.assertLess(elapsed, 2)
+        self.assertEqual(model.calls, [(["a.jpg"], 480)])
+
+    def test_error_reaches_every_request(self):
+        """Test a failed batch raises the error in every waiting request."""
+        error = RuntimeError("The model failed.")
+        model = _FakeModel(error)
+        batcher = DetectionBatcher(model, max_batch_size=3,
+                                   max_wait_ms=5000)
+        results = self._predict_concurrently(batcher,
+                                             ["a.jpg", "b.jpg", "c.jpg"])
+        self.assertEqual(results, [error] * 3)
+        self.assertEqual(len(model.calls), 1)
+
+        # The batcher keeps serving after a failed batch.
+        model.error = None
+        batcher.max_wait = 0.05
+        self.assertEqual(self._predict_concurrently(batcher, ["d.jpg"]),
+                         ["result of d.jpg"])
+
+    def test_grouped_images_run_in_one_call(self):
+        """Test images sent together run at once, without the window."""
+        model = _FakeModel()
+        batcher = DetectionBatcher(model, max_batch_size=4,
+                                   max_wait_ms=5000)
+        start = time.perf_counter()
+        results = batcher.predict_batch(["a.jpg", "b.jpg"], imgsz=320)
+        self.assertLess(time.perf_counter() - start, 2)
+        self.assertEqual(results, ["result of a.jpg", "result of b.jpg"])
+        self.assertEqual(model.calls, [(["a.jpg", "b.jpg"], 320)])
@@ -0,0 +1,127 @@
+"""The module that defines the EmbeddingCacheTestCase class."""
+import os
+import tempfile
+import threading
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from app.tests.test_resources.setup_test import requires_modules
+from utils.metrics import Counter, MetricsRegistry
+
+
+def _embedding(value: int):
+    """Build a small embedding holding the value."""
+    import torch
+    from models.EmbeddingCache import SamEmbedding
+
+    return SamEmbedding(torch.full((1, 4), float(value)), (8, 8), (16, 16))
+
+
+class _FakePredictor:
+    """A SAM predictor counting the images it encodes."""
+
+    def __init__(self):
+        """Initialize the _FakePredictor class."""
+        self.model = mock.Mock()
+        self.model.image_encoder.img_size = 16
+        self.encoded = 0
+
+    def set_image(self, image: np.ndarray) -> None:
+        """Encode the image into an embedding of its mean."""
+        import torch
+
+        self.encoded += 1
+        self.features = torch.full((1, 4), float(image.mean()))
+        self.original_size = image.shape[:2]
+        self.input_size = (16, 16)
+
+
+@requires_modules('torch')
+class EmbeddingCacheTestCase(SimpleTestCase):
+    """This class defines the test suite for the SAM embedding cache."""
+
+    def setUp(self):
+        """Count the lookups of the cache in a registry of their own."""
+        self.lookups = Counter('cache_total', 'Lookups.', ('result',),
+                               registry=MetricsRegistry())
+        patcher = mock.patch('models.EmbeddingCache.EMBEDDING_CACHE',
+                             self.lookups)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        spill_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spill_dir.cleanup)
+        self.spill_dir = spill_dir.name
+
+    def _spilled(self) -> set:
+        """Get the keys of the embeddings in the spill directory."""
+        return {name[:-len('.pt')] for name in os.listdir(self.spill_dir)
+                if name.endswith('.pt')}
+
+    def test_least_recently_used_is_evicted(self):
+        """Test the memory keeps the most recently used embeddings."""
+        from models.EmbeddingCache import EmbeddingCache
+
+        cache = EmbeddingCache(max_entries=2)
+        cache.put('a', _embedding(1))
+        cache.put('b', _embedding(2))
+        cache.get('a')
+        cache.put('c', _embedding(3))
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a').features[0, 0].item(), 1)
+        self.assertEqual(cache.get('c').features[0, 0].item(), 3)
+        self.assertEqual(self.lookups.drain(), {('hit',): 3, ('miss',): 1})
+
+    def test_evicted_embedding_is_reloaded_from_the_spill(self):
+        """Test an evicted embedding is read back from the spill directory."""
+        import torch
+        from models.EmbeddingCache import EmbeddingCache
+
+        cache = EmbeddingCache(max_entries=1, spill_dir=self.spill_dir)
+        cache.put('a', _embedding(1))
+        cache.put('b', _embedding(2))
+        self.assertEqual(self._spilled(), {'a'})
+
+        embedding = cache.get('a')
+        torch.testing.assert_close(embedding.features, _embedding(1).features)
+        self.assertEqual(embedding.original_size, (8, 8))
+        self.assertEqual(embedding.input_size, (16, 16))
+        # Reading it back moved it to memory and spilled the other one.
+        self.assertEqual(self._spilled(), {'a', 'b'})
+        self.assertEqual(cache.get('a').features[0, 0].item(), 1)
+        self.assertEqual(self.lookups.drain(),
+                         {('disk_hit',): 1, ('hit',): 1})
+
+    def test_spill_directory_is_trimmed(self):
+        """Test the spill directory keeps the most recent embeddings."""
+        from models.EmbeddingCache import EmbeddingCache
+
+        cache = EmbeddingCache(max_entries=1, spill_dir=self.spill_dir,
+                               max_spill_entries=2)
+        for index, key in enumerate('abcde'):
+            cache.put(key, _embedding(index))
+        self.assertEqual(self._spilled(), {'c', 'd'})
+        self.assertIsNone(EmbeddingCache(max_entries=1,
+                                         spill_dir=self.spill_dir).get('a'))
+
+    @requires_modules('ultralytics', 'segment_anything')
+    def test_cached_embedding_skips_the_encoder(self):
+        """Test the segmentation encodes an image once and counts it."""
+        from models.EmbeddingCache import EmbeddingCache
+        from models.ImageSegmentation import ImageSegmentation
+
+        segmentation = ImageSegmentation.__new__(ImageSegmentation)
+        segmentation.embedding_cache = EmbeddingCache(max_entries=1)
+        segmentation.quantize_sam = False
+        segmentation._sam_lock = threading.Lock()
+        segmentation._mask_predictor = _FakePredictor()
+        first = np.full((8, 8, 3), 10, dtype=np.uint8)
+        second = np.full((8, 8, 3), 20, dtype=np.uint8)
+
+        for image in (first, first, second, first):
+            embedding = segmentation._embed_image(image)
+            self.assertEqual(embedding.features[0, 0].item(), image.mean())
+        self.assertEqual(segmentation._mask_predictor.encoded, 3)
+        self.assertEqual(self.lookups.drain(), {('hit',): 1, ('miss',): 3})
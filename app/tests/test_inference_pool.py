@@ -0,0 +1,87 @@
+"""The module that defines the InferencePoolTestCase class."""
+import importlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from models import InferenceTimeoutError
+
+pool_module = importlib.import_module("models.InferencePool")
+
+
+def _sleep_then_get_pid(seconds: float) -> int:
+    """Sleep, then return the process id of the worker."""
+    time.sleep(seconds)
+    return os.getpid()
+
+
+class InferencePoolTestCase(SimpleTestCase):
+    """This class defines the test suite for the inference worker pool."""
+
+    def _start_pool(self, **options) -> None:
+        """Start a pool whose workers load no model."""
+        patcher = mock.patch.object(pool_module, "_initialize_worker",
+                                    self._initialize_worker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = pool_module.InferencePool(**options)
+        self.addCleanup(self.pool.shutdown)
+
+    @staticmethod
+    def _initialize_worker(labels_only, cpu_scheduler, started_jobs):
+        """Keep the queue of the started jobs, without loading models."""
+        pool_module._started_jobs = started_jobs
+
+    def test_timeout_recycles_the_worker(self):
+        """Test a job after a timed out one does not queue behind it."""
+        self._start_pool(size=1, timeout=1.0)
+        worker = self.pool._run(os.getpid)
+        with self.assertRaises(InferenceTimeoutError):
+            self.pool._run(time.sleep, 30)
+
+        start = time.perf_counter()
+        self.assertEqual(self.pool._run(abs, -3), 3)
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertNotEqual(self.pool._run(os.getpid), worker)
+
+    def test_waiting_for_a_worker_does_not_count(self):
+        """Test the timeout starts when a worker starts the job."""
+        self._start_pool(size=1, timeout=2.0, queue_timeout=10.0)
+        with ThreadPoolExecutor(max_workers=2) as requests:
+            busy = requests.submit(self.pool._run, time.sleep, 1.5)
+            time.sleep(0.3)
+            # Waits about 1.2 seconds, then runs 1.5 seconds.
+            queued = requests.submit(self.pool._run, time.sleep, 1.5)
+            busy.result()
+            queued.result()
+
+    def test_timeout_only_stops_the_worker_that_overran(self):
+        """Test the jobs of the other workers survive a timeout."""
+        self._start_pool(size=2, timeout=1.5)
+        with ThreadPoolExecutor(max_workers=2) as requests:
+            slow = requests.submit(self.pool._run, time.sleep, 30)
+            time.sleep(0.5)
+            # Still running when the slow job is stopped.
+            other = requests.submit(self.pool._run, _sleep_then_get_pid,
+                                    1.2)
+            with self.assertRaises(InferenceTimeoutError):
+                slow.result()
+            self.assertNotEqual(other.result(), os.getpid())
+
+    def test_saturated_pool_gives_up_a_job(self):
+        """Test a job is given up when no worker gets free in time."""
+        self._start_pool(size=1, timeout=10.0, queue_timeout=0.3)
+        with ThreadPoolExecutor(max_workers=1) as requests:
+            busy = requests.submit(self.pool._run, time.sleep, 1.5)
+            time.sleep(0.2)
+            start = time.perf_counter()
+            with self.assertRaisesMessage(InferenceTimeoutError,
+                                          'No inference worker'):
+                self.pool._run(abs, -3)
+            self.assertLess(time.perf_counter() - start, 1)
+            busy.result()
+        # The worker skipped the given up job and serves the next ones.
+        self.assertEqual(self.pool._run(abs, -3), 3)
@@ -0,0 +1,115 @@
+"""The module that defines the MetricsViewSetTestCase class."""
+import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from rest_framework import status
+
+from app.tests import BaseTestCase
+from utils.metrics import IMAGES, Counter, Histogram, MetricsRegistry
+
+
+class MetricsViewSetTestCase(BaseTestCase):
+    """This class defines the test suite for the MetricsViewSet."""
+
+    @override_settings(PREDICT_DEFER_RENDERING=False)
+    def test_get_metrics_after_prediction(self):
+        """Test the stages of a prediction are exposed to Prometheus."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool:
+            pool = get_inference_pool.return_value
+            pool.segment_image.return_value = (
+                np.zeros((8, 8, 3), dtype=np.uint8),
+                [('short sleeve top', None)])
+            with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                    as image_file:
+                data = {
+                    'secret': self.secret,
+                    'image': SimpleUploadedFile(image_file.name,
+                                                image_file.read()),
+                }
+                self.client.post(self.predict_url, data, format='multipart')
+
+        response = self.client.get(self.metrics_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        content = response.content.decode()
+        self.assertIn('# TYPE comfywear_stage_seconds histogram', content)
+        for stage in ('encoding', 'db_write'):
+            self.assertIn(f'comfywear_stage_seconds_count{{stage="{stage}"}}',
+                          content)
+        self.assertIn('# TYPE comfywear_sam_boxes_total counter', content)
+
+    def test_merge_drained_metrics(self):
+        """Test the metrics drained in a worker add up in another process."""
+        worker, server = MetricsRegistry(), MetricsRegistry()
+        for registry in (worker, server):
+            Histogram('stage_seconds', 'Stage seconds.', ('stage',),
+                      buckets=(0.1, 1.0), registry=registry)
+            Counter('boxes_total', 'Boxes.', registry=registry)
+        worker._metrics['stage_seconds'].observe(0.05, stage='sam')
+        worker._metrics['stage_seconds'].observe(2.0, stage='sam')
+        worker._metrics['boxes_total'].inc(3)
+        server.merge(worker.drain())
+        worker._metrics['boxes_total'].inc(2)
+        server.merge(worker.drain())
+        self.assertEqual(worker.drain(), {})
+
+        content = server.render()
+        self.assertIn('stage_seconds_bucket{stage="sam",le="0.1"} 1',
+                      content)
+        self.assertIn('stage_seconds_bucket{stage="sam",le="+Inf"} 2',
+                      content)
+        self.assertIn('stage_seconds_sum{stage="sam"} 2.05', content)
+        self.assertIn('boxes_total 5', content)
+
+    def _worker_registry(self) -> MetricsRegistry:
+        """Build the registry of a web worker with a few metrics."""
+        registry = MetricsRegistry()
+        Histogram('stage_seconds', 'Stage seconds.', ('stage',),
+                  buckets=(0.1, 1.0), registry=registry)
+        Counter('boxes_total', 'Boxes.', registry=registry)
+        return registry
+
+    def test_render_the_metrics_of_every_worker(self):
+        """Test the totals saved by the workers add up."""
+        first, second = self._worker_registry(), self._worker_registry()
+        first._metrics['stage_seconds'].observe(0.05, stage='sam')
+        first._metrics['boxes_total'].inc(3)
+        second._metrics['stage_seconds'].observe(2.0, stage='sam')
+        second._metrics['boxes_total'].inc(2)
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            first.write(metrics_dir)
+            # Saving the totals again replaces the file of the worker.
+            first._metrics['boxes_total'].inc(1)
+            first.write(metrics_dir)
+            second.write(metrics_dir)
+            self.assertEqual(len(os.listdir(metrics_dir)), 2)
+            content = first.render_directory(metrics_dir)
+
+        self.assertIn('stage_seconds_bucket{stage="sam",le="0.1"} 1',
+                      content)
+        self.assertIn('stage_seconds_count{stage="sam"} 2', content)
+        self.assertIn('boxes_total 6', content)
+        # Rendering the sum leaves the totals of the worker untouched.
+        self.assertIn('boxes_total 4', first.render())
+
+    def test_get_metrics_of_every_worker(self):
+        """Test the endpoint reports the metrics saved by other workers."""
+        other = MetricsRegistry()
+        Counter(IMAGES.name, IMAGES.documentation, registry=other).inc(5)
+        images = IMAGES.collect().get((), 0)
+        with tempfile.TemporaryDirectory() as metrics_dir, \
+                self.settings(METRICS_DIR=metrics_dir):
+            other.write(metrics_dir)
+            response = self.client.get(self.metrics_url)
+            self.assertEqual(len(os.listdir(metrics_dir)), 2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(f'{IMAGES.name} {images + 5}',
+                      response.content.decode())
@@ -0,0 +1,42 @@
+"""The module that defines the ModelRegistryTestCase class."""
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from models.ModelRegistry import ModelRegistry
+
+
+class ModelRegistryTestCase(SimpleTestCase):
+    """This class defines the test suite for the model registry warm-up."""
+
+    def setUp(self):
+        """Build a registry whose models record the dummy inferences."""
+        self.registry = ModelRegistry()
+        self.segmentation = mock.Mock(cascade=False)
+        self.registry._segmentation = self.segmentation
+        self.registry._classifier = mock.Mock()
+
+    def test_full_warm_up_follows_a_labels_warm_up(self):
+        """Test a labels-only warm-up leaves the full models to warm up."""
+        self.registry.warm_up(labels_only=True)
+        self.segmentation.segment_image.assert_not_called()
+        self.registry.warm_up()
+        self.registry.warm_up()
+        self.registry.warm_up(labels_only=True)
+        self.assertEqual(self.segmentation.detect_labels.call_count, 1)
+        self.assertEqual(self.segmentation.segment_image.call_count, 1)
+        self.assertTrue(self.registry.is_warmed_up)
+
+    def test_concurrent_warm_ups_run_once(self):
+        """Test a second caller waits for the warm-up in progress."""
+        self.segmentation.segment_image.side_effect = \
+            lambda image: time.sleep(0.2)
+        threads = [threading.Thread(target=self.registry.warm_up)
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.segmentation.segment_image.call_count, 1)
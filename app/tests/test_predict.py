@@ -1,14 +1,48 @@
 """This module defines the test suite for the PredictViewSet."""
+import io
+import os
+import zipfile
+from unittest import mock
+
+import numpy as np
+from concurrent.futures import Future
+
 from rest_framework import status
+from django.conf import settings
+from django.core.cache import caches
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.test import override_settings
 
 from app.tests import BaseTestCase
-from app.models import Predict
+from app.tests.test_resources.setup_test import requires_modules
+from app.models import Predict, Image, Sensor
+from app.views import PredictViewSet
+from utils import ImageTooLargeError, decode_image
 
 
 class PredictViewSetTestCase(BaseTestCase):
     """This class defines the test suite for the PredictViewSet."""
 
+    def _segmentation(self):
+        """Get a segmentation with a single detected item."""
+        import supervision as sv
+        from models import Segmentation
+
+        detections = sv.Detections(xyxy=np.array([[10.0, 10.0, 50.0, 50.0]]),
+                                   class_id=np.array([0]),
+                                   confidence=np.array([0.9]))
+        return Segmentation([('short sleeve top', None)],
+                            ['short sleeve top'], detections,
+                            sv.Detections.empty(),
+                            np.zeros((64, 64, 3), dtype=np.uint8))
+
+    def _media_path(self, name: str) -> str:
+        """Get the path of a stored file in the media directory."""
+        return os.path.join(settings.MEDIA_ROOT, name)
+
+    @requires_modules('torch', 'ultralytics', 'segment_anything')
+    @override_settings(PREDICT_DEFER_RENDERING=False)
     def test_create_prediction_with_valid_data(self):
         """Test create a prediction object with valid data."""
         with open('app/tests/test_resources/test_image.jpg', 'rb') \
@@ -23,6 +57,7 @@ class PredictViewSetTestCase(BaseTestCase):
             self.assertEqual(response.status_code, status.HTTP_201_CREATED)
             self.assertEqual(Predict.objects.count(), 12)
 
+    @requires_modules('torch', 'ultralytics', 'segment_anything')
     def test_create_prediction_with_invalid_secret(self):
         """Test when creating a prediction object with an invalid secret."""
         with open('app/tests/test_resources/test_image.jpg', 'rb') \
@@ -61,3 +96,493 @@ class PredictViewSetTestCase(BaseTestCase):
             self.assertEqual(response.status_code,
                              status.HTTP_400_BAD_REQUEST)
             self.assertIn('error', response.data)
+
+    @requires_modules('torch', 'ultralytics', 'segment_anything')
+    def test_create_prediction_with_undecodable_image(self):
+        """Test when the image has a valid header but cannot be decoded."""
+        data = {
+            'secret': self.secret,
+            'image': SimpleUploadedFile('broken.png',
+                                        b'\x89PNG\r\n\x1a\n' + b'0' * 64),
+        }
+        response = self.client.post(self.predict_url, data,
+                                    format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('error', response.data)
+        self.assertEqual(Predict.objects.count(), 0)
+
+    @override_settings(PREDICT_DEFER_RENDERING=False)
+    def test_create_prediction_with_same_image_reuses_result(self):
+        """Test posting the same image twice runs the inference once."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool:
+            pool = get_inference_pool.return_value
+            pool.segment_image.return_value = (
+                np.zeros((8, 8, 3), dtype=np.uint8),
+                [('short sleeve top', None)])
+            for _ in range(2):
+                with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                        as image_file:
+                    data = {
+                        'secret': self.secret,
+                        'image': SimpleUploadedFile(image_file.name,
+                                                    image_file.read()),
+                    }
+                    response = self.client.post(self.predict_url, data,
+                                                format='multipart')
+                self.assertEqual(response.status_code,
+                                 status.HTTP_201_CREATED)
+            self.assertEqual(pool.segment_image.call_count, 1)
+            self.assertEqual(Predict.objects.count(), 2)
+
+    @override_settings(PREDICT_DEFER_RENDERING=False,
+                       ANNOTATED_IMAGE_ENCODING={'format': 'jpeg',
+                                                 'quality': 80,
+                                                 'max_side': 100},
+                       ANNOTATED_IMAGE_PREVIEW_SIDE=60,
+                       ANNOTATED_IMAGE_THUMBNAIL_SIDE=20)
+    def test_create_prediction_encodes_annotated_image(self):
+        """Test the annotated image is stored in the configured encoding."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool:
+            pool = get_inference_pool.return_value
+            pool.segment_image.return_value = (
+                np.zeros((200, 400, 3), dtype=np.uint8),
+                [('short sleeve top', None)])
+            with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                    as image_file:
+                data = {
+                    'secret': self.secret,
+                    'image': SimpleUploadedFile(image_file.name,
+                                                image_file.read()),
+                }
+                response = self.client.post(self.predict_url, data,
+                                            format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        detected_image = Image.objects.get().detected_image
+        self.assertTrue(detected_image.name.endswith('.jpg'))
+        with detected_image.open('rb') as image_file:
+            content = image_file.read()
+        self.assertTrue(content.startswith(b'\xff\xd8'))
+        self.assertEqual(decode_image(content).shape, (50, 100, 3))
+        for field, shape in (('preview_image', (30, 60, 3)),
+                             ('thumbnail_image', (10, 20, 3))):
+            with getattr(Image.objects.get(), field).open('rb') as image_file:
+                self.assertEqual(decode_image(image_file.read()).shape, shape)
+
+        image_url = response.data['image']['url']
+        response = self.client.get(image_url, {'size': 'thumbnail'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('_thumbnail', response.data['thumbnail_image'])
+        self.assertNotIn('detected_image', response.data)
+        self.assertNotIn('preview_image', response.data)
+        response = self.client.get(image_url, {'size': 'huge'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_prediction_with_labels_mode(self):
+        """Test the labels mode only detects the labels."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool:
+            pool = get_inference_pool.return_value
+            pool.detect_labels.return_value = [('short sleeve top', None),
+                                               (None, 'shorts')]
+            with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                    as image_file:
+                data = {
+                    'secret': self.secret,
+                    'mode': 'labels',
+                    'image': SimpleUploadedFile(image_file.name,
+                                                image_file.read()),
+                }
+                response = self.client.post(self.predict_url, data,
+                                            format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            pool.segment_image.assert_not_called()
+            self.assertEqual(Predict.objects.count(), 2)
+            self.assertEqual(Image.objects.count(), 0)
+
+    def test_create_prediction_with_invalid_mode(self):
+        """Test when creating a prediction object with an invalid mode."""
+        with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                as image_file:
+            data = {
+                'secret': self.secret,
+                'mode': 'invalid',
+                'image': SimpleUploadedFile(image_file.name,
+                                            image_file.read()),
+            }
+            response = self.client.post(self.predict_url, data,
+                                        format='multipart')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('error', response.data)
+
+    @override_settings(PREDICT_DEFER_RENDERING=True)
+    def test_create_prediction_with_deferred_rendering(self):
+        """Test the annotated image is attached to its placeholder later."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        pending = []
+
+        def submit(function, *args):
+            future = Future()
+            pending.append((future, function, args))
+            return future
+
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool, \
+                mock.patch('app.views.PredictViewSet._render_executor') \
+                as render_executor:
+            render_executor.submit.side_effect = submit
+            pool = get_inference_pool.return_value
+            pool.detect.return_value = self._segmentation()
+            with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                    as image_file:
+                data = {
+                    'secret': self.secret,
+                    'image': SimpleUploadedFile(image_file.name,
+                                                image_file.read()),
+                }
+                response = self.client.post(self.predict_url, data,
+                                            format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            pool.segment_image.assert_not_called()
+            image_url = response.data['image']['url']
+            self.assertEqual(self.client.get(image_url).status_code,
+                             status.HTTP_202_ACCEPTED)
+
+            future, function, args = pending.pop()
+            future.set_result(function(*args))
+            response = self.client.get(image_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.data['detected_image'])
+            self.assertEqual(Image.objects.count(), 1)
+
+    def test_create_prediction_with_tier(self):
+        """Test the tier sets the inference size of the detectors."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool:
+            pool = get_inference_pool.return_value
+            pool.detect_labels.return_value = [('short sleeve top', None)]
+            with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                    as image_file:
+                image_bytes = image_file.read()
+                data = {
+                    'secret': self.secret,
+                    'mode': 'labels',
+                    'tier': 'fast',
+                    'image': SimpleUploadedFile(image_file.name,
+                                                image_bytes),
+                }
+                response = self.client.post(self.predict_url, data,
+                                            format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            pool.detect_labels.assert_called_once_with(image_bytes, 320)
+
+    def test_create_prediction_with_invalid_tier(self):
+        """Test when creating a prediction object with an invalid tier."""
+        with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                as image_file:
+            data = {
+                'secret': self.secret,
+                'tier': 'invalid',
+                'image': SimpleUploadedFile(image_file.name,
+                                            image_file.read()),
+            }
+            response = self.client.post(self.predict_url, data,
+                                        format='multipart')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('error', response.data)
+
+    def test_create_prediction_with_too_large_image(self):
+        """Test when the image has more pixels than allowed."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool:
+            pool = get_inference_pool.return_value
+            pool.detect_labels.side_effect = ImageTooLargeError(
+                'The image has too many pixels.')
+            with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                    as image_file:
+                data = {
+                    'secret': self.secret,
+                    'mode': 'labels',
+                    'image': SimpleUploadedFile(image_file.name,
+                                                image_file.read()),
+                }
+                response = self.client.post(self.predict_url, data,
+                                            format='multipart')
+            self.assertEqual(response.status_code,
+                             status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            self.assertEqual(Predict.objects.count(), 0)
+
+    @override_settings(PREDICT_DEFER_RENDERING=True)
+    def test_create_prediction_stream(self):
+        """Test the stream sends an event after every stage."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+
+        def submit(function, *args):
+            future = Future()
+            future.set_result(function(*args))
+            return future
+
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool, \
+                mock.patch('app.views.PredictViewSet._render_executor') \
+                as render_executor:
+            render_executor.submit.side_effect = submit
+            pool = get_inference_pool.return_value
+            pool.detect.return_value = self._segmentation()
+            with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                    as image_file:
+                data = {
+                    'secret': self.secret,
+                    'image': SimpleUploadedFile(image_file.name,
+                                                image_file.read()),
+                }
+                response = self.client.post(self.predict_url + 'stream/',
+                                            data, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            content = b''.join(response.streaming_content).decode()
+        events = [line[len('event: '):] for line in content.splitlines()
+                  if line.startswith('event: ')]
+        self.assertEqual(events, ['accepted', 'detections', 'labels',
+                                  'image', 'image', 'done'])
+        self.assertIn('"detected_image": "http://testserver/', content)
+        self.assertEqual(Predict.objects.count(), 1)
+
+    def test_create_prediction_stream_with_invalid_mode(self):
+        """Test the stream rejects an invalid mode before streaming."""
+        with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                as image_file:
+            data = {
+                'secret': self.secret,
+                'mode': 'invalid',
+                'image': SimpleUploadedFile(image_file.name,
+                                            image_file.read()),
+            }
+            response = self.client.post(self.predict_url + 'stream/', data,
+                                        format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.content.startswith(b'event: error\n'))
+
+    def test_create_prediction_sequence(self):
+        """Test a frame burst gives one result per dressed person."""
+        from models import Track
+
+        Sensor.objects.create(local_temp=25.0, local_humid=60.0,
+                              integrate=self.integrate)
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool:
+            pool = get_inference_pool.return_value
+            pool.track_sequence.return_value = [
+                Track(1, ('short sleeve top', 'shorts'),
+                      ['short sleeve top', 'shorts'], 0, 5,
+                      [10.0, 10.0, 50.0, 90.0], 1200),
+                Track(2, ('long sleeve top', None), ['long sleeve top'], 5,
+                      5, [60.0, 10.0, 90.0, 90.0], 800),
+                Track(3, (None, None), [], 1, 2, [0.0, 0.0, 5.0, 9.0], 40),
+            ]
+            pool.predict_comfort_level.return_value = ['1', '0']
+            with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                    as image_file:
+                image_bytes = image_file.read()
+            data = {
+                'secret': self.secret,
+                'frames': [SimpleUploadedFile(f'frame_{index}.jpg',
+                                              image_bytes)
+                           for index in range(3)],
+                'frame_rate': '12.5',
+            }
+            response = self.client.post(self.predict_url + 'sequence/',
+                                        data, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            frames = pool.track_sequence.call_args[0][0]
+            self.assertEqual(frames, [image_bytes] * 3)
+            self.assertEqual(pool.track_sequence.call_args[0][4], 12.5)
+            labels = pool.predict_comfort_level.call_args[0][0]
+            self.assertEqual(len(labels), 2)
+        tracks = response.data['tracks']
+        self.assertEqual([track['track_id'] for track in tracks], [1, 2])
+        self.assertEqual(tracks[0]['upper'], 'short sleeve top')
+        self.assertEqual(tracks[1]['lower'], None)
+        self.assertEqual([track['comfort_level'] for track in tracks],
+                         ['1', '0'])
+        self.assertEqual(Predict.objects.count(), 2)
+
+    def test_create_prediction_sequence_with_missing_frames(self):
+        """Test the sequence endpoint without a video or frames."""
+        response = self.client.post(self.predict_url + 'sequence/',
+                                    {'secret': self.secret},
+                                    format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Missing required data')
+
+    def test_create_prediction_sequence_with_invalid_frame_rate(self):
+        """Test the sequence endpoint with a frame rate that is not valid."""
+        response = self.client.post(self.predict_url + 'sequence/',
+                                    {'secret': self.secret,
+                                     'frame_rate': '0'},
+                                    format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.data['error'].startswith(
+            'Invalid frame rate'))
+
+    @override_settings(PREDICT_DEFER_RENDERING=False)
+    def test_create_prediction_batch(self):
+        """Test a batch of images gives one result per image."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        depth = len(connection.savepoint_ids)
+        wait_for_encoding = PredictViewSet._wait_for_encoding
+
+        def wait(view, annotated_image):
+            # The batch opens no transaction while its images are encoded.
+            self.assertEqual(len(connection.savepoint_ids), depth)
+            return wait_for_encoding(view, annotated_image)
+
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool, \
+                mock.patch.object(PredictViewSet, '_wait_for_encoding',
+                                  autospec=True, side_effect=wait):
+            pool = get_inference_pool.return_value
+            pool.segment_image.return_value = (
+                np.zeros((8, 8, 3), dtype=np.uint8),
+                [('short sleeve top', None), (None, 'shorts')])
+            with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                    as image_file:
+                image_bytes = image_file.read()
+            data = {
+                'secret': self.secret,
+                'images': [
+                    SimpleUploadedFile('first.jpg', image_bytes),
+                    SimpleUploadedFile('second.jpg', image_bytes + b'\0'),
+                    SimpleUploadedFile('invalid.txt', b'not an image'),
+                ],
+            }
+            response = self.client.post(self.predict_url + 'batch/', data,
+                                        format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        results = response.data['results']
+        self.assertEqual([result['name'] for result in results],
+                         ['first.jpg', 'second.jpg', 'invalid.txt'])
+        self.assertEqual(results[0]['labels'],
+                         [{'upper': 'short sleeve top', 'lower': None},
+                          {'upper': None, 'lower': 'shorts'}])
+        self.assertEqual(results[2]['status'], status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Predict.objects.count(), 4)
+        self.assertEqual(Image.objects.count(), 2)
+
+    @override_settings(PREDICT_DEFER_RENDERING=True)
+    def test_create_prediction_batch_with_deferred_rendering(self):
+        """Test the images of a batch are attached once it is committed."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        rendering = Future()
+        with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                as image_file:
+            image_bytes = image_file.read()
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool, \
+                mock.patch('app.views.PredictViewSet._render_executor') \
+                as render_executor, \
+                self.captureOnCommitCallbacks(execute=True):
+            render_executor.submit.return_value = rendering
+            get_inference_pool.return_value.detect.return_value = \
+                self._segmentation()
+            data = {'secret': self.secret,
+                    'images': [SimpleUploadedFile('first.jpg', image_bytes)]}
+            response = self.client.post(self.predict_url + 'batch/', data,
+                                        format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = Image.objects.get()
+        self.assertFalse(image.detected_image)
+
+        rendering.set_result({'detected_image': 'detected_images/a.webp'})
+        image.refresh_from_db()
+        self.assertEqual(image.detected_image.name, 'detected_images/a.webp')
+
+    def test_create_prediction_batch_with_archive(self):
+        """Test a zip archive of images is predicted image by image."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        with open('app/tests/test_resources/test_image.jpg', 'rb') \
+                as image_file:
+            image_bytes = image_file.read()
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('photos/first.jpg', image_bytes)
+            zip_file.writestr('photos/notes.txt', 'not an image')
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool:
+            pool = get_inference_pool.return_value
+            pool.detect_labels.return_value = [('short sleeve top', None)]
+            data = {
+                'secret': self.secret,
+                'mode': 'labels',
+                'archive': SimpleUploadedFile('photos.zip',
+                                              archive.getvalue()),
+            }
+            response = self.client.post(self.predict_url + 'batch/', data,
+                                        format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result['name'] for result
+                          in response.data['results']], ['first.jpg'])
+        self.assertEqual(Predict.objects.count(), 1)
+
+    def test_excess_images_are_deleted_with_their_derivatives(self):
+        """Test the oldest images are pruned with all of their files."""
+        view = PredictViewSet()
+        image_names = []
+        for index in range(12):
+            names = view._store_annotated_image(
+                np.zeros((40, 40, 3), dtype=np.uint8))
+            for name in names.values():
+                os.utime(self._media_path(name), (index, index))
+            image_names.append(names)
+        self.assertEqual(image_names[1]['preview_image'],
+                         image_names[1]['detected_image'].replace(
+                             '.', '_preview.'))
+
+        view._delete_excess_images('detected_images')
+        stored = set(os.listdir(os.path.join(settings.MEDIA_ROOT,
+                                             'detected_images')))
+        kept = {os.path.basename(name) for names in image_names[5:]
+                for name in names.values()}
+        self.assertEqual(stored, kept)
+
+    def test_cached_result_needs_every_image_file(self):
+        """Test a result whose preview was pruned is computed again."""
+        caches['predictions'].clear()
+        self.addCleanup(caches['predictions'].clear)
+        view = PredictViewSet()
+        names = view._store_annotated_image(
+            np.zeros((40, 40, 3), dtype=np.uint8))
+        result = ([('short sleeve top', None)], names)
+        caches['predictions'].set('key', result)
+        self.assertEqual(view._get_cached_result('key'), result)
+
+        os.remove(self._media_path(names['preview_image']))
+        self.assertIsNone(view._get_cached_result('key'))
+
+    def test_failed_attachment_deletes_the_placeholder(self):
+        """Test a placeholder whose update fails does not stay pending."""
+        image = Image.objects.create(integrate=self.integrate)
+        future = Future()
+        future.set_result({'detected_image': 'detected_images/a.webp'})
+        with mock.patch('django.db.models.QuerySet.update',
+                        side_effect=DatabaseError('The database is locked.')):
+            PredictViewSet()._attach_annotated_image(image.pk, future)
+        self.assertFalse(Image.objects.filter(pk=image.pk).exists())
@@ -1,14 +1,31 @@
 """This module defines the test suite for the IntegrationViewSet."""
+import tempfile
+from importlib.util import find_spec
+from unittest import skipUnless
+
 from rest_framework.test import APIClient, APITestCase
 
 from app.models import Integrate
 
 
+def requires_modules(*names: str):
+    """Skip a test unless all the given modules are installed."""
+    missing = [name for name in names if find_spec(name) is None]
+    return skipUnless(not missing, f"{', '.join(missing)} not installed")
+
+
 class BaseTestCase(APITestCase):
     """This class defines the base test suite."""
 
     def setUp(self):
         """Define the test client and other test variables."""
+        # The images stored by the tests go to a directory of their own.
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
         self.secret = 'test_secret'
         self.integrate = Integrate.objects.create(secret=self.secret)
 
@@ -16,6 +33,7 @@ class BaseTestCase(APITestCase):
         self.sensor_url = "/app/api/sensor/"
         self.predict_url = "/app/api/predict/"
         self.integrate_url = "/app/api/integrate/"
+        self.metrics_url = "/app/api/metrics/"
         self.comfort_level_distribution_url = "/app/api/integrate/" \
                                               "comfort-level-distribution/"
         self.comfort_level_details_url = "/app/api/integrate/" \
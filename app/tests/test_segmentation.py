@@ -0,0 +1,197 @@
+"""The module that defines the ImageSegmentationTestCase class."""
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from app.tests.test_resources.setup_test import requires_modules
+from models.DetectionBatcher import DetectionBatcher
+
+
+class _FakeYOLO:
+    """A YOLO model exporting slowly next to its weights, like ultralytics."""
+
+    def __init__(self, path: str):
+        """Load the weights, or check an exported model is complete."""
+        self.path = path
+        with open(path) as model:
+            self.content = model.read()
+
+    def export(self, **options) -> str:
+        """Write the exported model in two halves."""
+        exported_path = os.path.splitext(self.path)[0] + '.onnx'
+        with open(exported_path, 'w') as exported:
+            exported.write('onnx of ')
+            exported.flush()
+            time.sleep(0.05)
+            exported.write(self.content)
+        return exported_path
+
+
+class _FakeResult:
+    """A YOLO result holding the detections it stands for."""
+
+    names = {0: 'short sleeve top', 1: 'trousers'}
+
+    def __init__(self, detections):
+        """Initialize the _FakeResult class."""
+        self.detections = detections
+
+
+class _FakeGarmentModel:
+    """A garment detector finding one item in the corner of every image."""
+
+    def __init__(self):
+        """Initialize the _FakeGarmentModel class."""
+        self.calls = []
+
+    def __call__(self, sources, imgsz: int = 480) -> list:
+        """Record the call and detect an item per source."""
+        import supervision as sv
+
+        self.calls.append(([source.shape for source in sources], imgsz))
+        return [_FakeResult(sv.Detections(
+            xyxy=np.array([[1.0, 2.0, 11.0, 12.0]]),
+            confidence=np.array([0.9 - 0.1 * index]),
+            class_id=np.array([index % 2])))
+            for index in range(len(sources))]
+
+
+def _from_ultralytics(result: _FakeResult):
+    """Convert a fake result like supervision converts a YOLO one."""
+    import supervision as sv
+
+    detections = result.detections
+    return sv.Detections(xyxy=detections.xyxy.copy(),
+                         confidence=detections.confidence.copy(),
+                         class_id=detections.class_id.copy())
+
+
+@requires_modules('torch', 'ultralytics', 'segment_anything')
+class ImageSegmentationTestCase(SimpleTestCase):
+    """This class defines the test suite for the image segmentation."""
+
+    def setUp(self):
+        """Convert the fake YOLO results of the detectors."""
+        import supervision as sv
+
+        patcher = mock.patch.object(sv.Detections, 'from_ultralytics',
+                                    side_effect=_from_ultralytics)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _cascade(self, persons: np.ndarray):
+        """Build a cascade whose person detector finds the given boxes."""
+        import supervision as sv
+        from models.ImageSegmentation import ImageSegmentation
+
+        segmentation = ImageSegmentation.__new__(ImageSegmentation)
+        segmentation.cascade_padding = 0.1
+        segmentation.stage_executor = None
+        self.garment_model = _FakeGarmentModel()
+        segmentation.detector = DetectionBatcher(self.garment_model)
+        segmentation._detect_persons = lambda image, imgsz: _FakeResult(
+            sv.Detections(xyxy=persons.astype(float),
+                          confidence=np.ones(len(persons)),
+                          class_id=np.zeros(len(persons), dtype=int)))
+        self.embedded = []
+        segmentation._embed_image = self.embedded.append
+
+        def predict_masks(embedding, boxes):
+            # A mask filling every box, in the coordinates of the SAM crop.
+            masks = np.zeros((len(boxes), *self.embedded[0].shape[:2]),
+                             dtype=bool)
+            for mask, (x0, y0, x1, y1) in zip(masks, boxes.astype(int)):
+                mask[y0:y1, x0:x1] = True
+            return masks
+
+        segmentation._predict_masks = predict_masks
+        return segmentation
+
+    def test_padded_boxes_stay_within_the_image(self):
+        """Test the padding is clipped at the edges of the image."""
+        segmentation = self._cascade(np.empty((0, 4)))
+        boxes = np.array([[2.0, 5.0, 42.0, 85.0],
+                          [160.0, 30.0, 198.0, 99.0],
+                          [80.0, 40.0, 100.0, 60.0]])
+        padded = segmentation._pad_boxes(boxes, (100, 200, 3))
+        np.testing.assert_array_equal(padded, [[0, 0, 46, 93],
+                                               [156, 23, 200, 100],
+                                               [78, 38, 102, 62]])
+        self.assertTrue(np.issubdtype(padded.dtype, np.integer))
+
+    def test_crop_detections_are_mapped_to_the_frame(self):
+        """Test the boxes and masks of a crop move to its position."""
+        import supervision as sv
+
+        segmentation = self._cascade(np.empty((0, 4)))
+        mask = np.zeros((1, 40, 20), dtype=bool)
+        mask[0, :5, :5] = True
+        detections = sv.Detections(xyxy=np.array([[0.0, 0.0, 5.0, 5.0]]),
+                                   mask=mask, class_id=np.array([0]))
+
+        detections = segmentation._to_frame(
+            detections, np.array([180, 60, 200, 100]), (100, 200, 3))
+        np.testing.assert_array_equal(detections.xyxy,
+                                      [[180, 60, 185, 65]])
+        self.assertEqual(detections.mask.shape, (1, 100, 200))
+        self.assertTrue(detections.mask[0, 60:65, 180:185].all())
+        self.assertEqual(detections.mask.sum(), 25)
+
+    def test_cascade_detects_the_crops_in_one_call(self):
+        """Test the crops near the edges go to the detector as one batch."""
+        persons = np.array([[20, 5, 60, 85], [160, 30, 198, 99]])
+        segmentation = self._cascade(persons)
+        image = np.zeros((100, 200, 3), dtype=np.uint8)
+
+        result = segmentation._detect_cascade(image, imgsz=320)
+        self.assertEqual(self.garment_model.calls,
+                         [([(93, 48, 3), (77, 44, 3)], 320)])
+        # SAM encodes the crop covering both padded persons.
+        self.assertEqual([crop.shape for crop in self.embedded],
+                         [(100, 184, 3)])
+        self.assertIs(result.image, image)
+        self.assertCountEqual(result.label_names,
+                              ['short sleeve top', 'trousers'])
+        self.assertCountEqual(result.detections.xyxy.tolist(),
+                              [[17, 2, 27, 12], [157, 25, 167, 35]])
+        masks = result.person_detections.mask
+        self.assertEqual(masks.shape, (2, 100, 200))
+        for mask, (x0, y0, x1, y1) in zip(masks, persons):
+            self.assertTrue(mask[y0:y1, x0:x1].all())
+            self.assertEqual(mask.sum(), (x1 - x0) * (y1 - y0))
+
+    def test_cascade_without_persons_runs_nothing_else(self):
+        """Test an image without persons skips the garments and SAM."""
+        segmentation = self._cascade(np.empty((0, 4)))
+        result = segmentation._detect_cascade(
+            np.zeros((100, 200, 3), dtype=np.uint8))
+        self.assertEqual(result.labels, [])
+        self.assertEqual(len(result.detections), 0)
+        self.assertEqual(self.garment_model.calls, [])
+        self.assertEqual(self.embedded, [])
+
+    def test_concurrent_onnx_exports_load_complete_files(self):
+        """Test workers exporting at the same time load a whole model."""
+        from models.ImageSegmentation import load_detector
+
+        with tempfile.TemporaryDirectory() as weights_dir, \
+                mock.patch('models.ImageSegmentation.YOLO', _FakeYOLO):
+            weights_path = os.path.join(weights_dir, 'best.pt')
+            with open(weights_path, 'w') as weights:
+                weights.write('weights')
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                models = list(executor.map(
+                    lambda _: load_detector(weights_path, 'onnx'), range(3)))
+
+            for model in models:
+                self.assertEqual(model.path,
+                                 os.path.join(weights_dir, 'best.onnx'))
+                self.assertEqual(model.content, 'onnx of weights')
+            # The private export directories are removed.
+            self.assertEqual(sorted(os.listdir(weights_dir)),
+                             ['best.onnx', 'best.pt'])
@@ -0,0 +1,15 @@
+"""The module that defines the StartupTestCase class."""
+import io
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+
+class StartupTestCase(SimpleTestCase):
+    """This class defines the test suite for the startup of a web worker."""
+
+    def test_startup_does_not_import_inference_libraries(self):
+        """Test loading the URL configuration imports no model library."""
+        stdout = io.StringIO()
+        call_command('benchmark_startup', runs=1, stdout=stdout)
+        self.assertIn('Median startup', stdout.getvalue())
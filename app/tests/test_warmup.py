@@ -0,0 +1,48 @@
+"""The module that defines the WarmupModelsTestCase class."""
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import LiveServerTestCase
+
+from app.models import Predict
+from utils import ImageDecodeError
+
+
+class WarmupModelsTestCase(LiveServerTestCase):
+    """This class defines the test suite for the warm-up readiness check."""
+
+    def test_warmup_sends_distinct_predictions(self):
+        """Test every warm-up request runs its own inference."""
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool:
+            pool = get_inference_pool.return_value
+            pool.detect_labels.return_value = [('short sleeve top', None)]
+            stdout = io.StringIO()
+            call_command('warmup_models', url=self.live_server_url,
+                         mode='labels', requests=2, wait=0, stdout=stdout)
+        self.assertIn('2 warm-up predictions succeeded', stdout.getvalue())
+        images = [call.args[0] for call in
+                  pool.detect_labels.call_args_list]
+        self.assertEqual(len(images), 2)
+        self.assertNotEqual(images[0], images[1])
+        self.assertEqual(Predict.objects.count(), 2)
+
+    def test_warmup_fails_on_an_error_response(self):
+        """Test a failed prediction fails the readiness check."""
+        with mock.patch('app.views.PredictViewSet.get_inference_pool') \
+                as get_inference_pool:
+            get_inference_pool.return_value.detect_labels.side_effect = \
+                ImageDecodeError('The image cannot be decoded.')
+            with self.assertRaisesMessage(CommandError,
+                                          '1 of 1 warm-up predictions'):
+                call_command('warmup_models', url=self.live_server_url,
+                             mode='labels', requests=1, wait=0,
+                             stdout=io.StringIO())
+
+    def test_warmup_fails_without_a_server(self):
+        """Test an unreachable server fails the readiness check."""
+        with self.assertRaisesMessage(CommandError, 'is not reachable'):
+            call_command('warmup_models', url='http://127.0.0.1:9',
+                         requests=1, wait=0, stdout=io.StringIO())
@@ -0,0 +1,40 @@
+"""A module that defines the ImageViewSet class."""
+from django.core.exceptions import ValidationError
+from rest_framework import status, viewsets
+from rest_framework.response import Response
+
+from app.serializers import ImageSerializer
+from app.models import Image
+
+
+class ImageViewSet(viewsets.ViewSet):
+    """ViewSet for handling Image-related operations."""
+
+    def retrieve(self, request, pk=None):
+        """
+        Retrieve a specific Image object.
+
+        While the annotated image is still being rendered, the Image is
+        returned with a 202 status and an empty detected_image. The "size"
+        query parameter picks the size variant of the annotated image.
+
+        :param request: The HTTP request.
+        :type request: rest_framework.request.Request
+        :param pk: The primary key of the Image object.
+        :type pk: str
+        :return: The HTTP response with the Image object.
+        :rtype: rest_framework.response.Response
+        """
+        size = request.query_params.get('size')
+        if size is not None and size not in ImageSerializer.SIZES:
+            return Response({'error': 'Invalid size, expected one of '
+                                      + ', '.join(ImageSerializer.SIZES)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            image = Image.objects.get(pk=pk)
+        except (Image.DoesNotExist, ValidationError):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        serializer = ImageSerializer(image, context={'request': request})
+        if not image.detected_image:
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        return Response(serializer.data)
@@ -0,0 +1,33 @@
+"""A module that defines the MetricsViewSet class."""
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework import viewsets
+
+from utils import get_metrics_registry
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    """ViewSet exposing the inference metrics to Prometheus."""
+
+    def list(self, request) -> HttpResponse:
+        """
+        Get the metrics in the Prometheus text exposition format.
+
+        The metrics are those of the process serving the request, including
+        the jobs it sent to the inference pool. With METRICS_DIR, they are
+        the sum of the metrics saved there by every web worker.
+
+        :param request: The HTTP request.
+        :type request: rest_framework.request.Request
+        :return: The metrics of the process, or of all the web workers.
+        :rtype: django.http.HttpResponse
+        """
+        registry = get_metrics_registry()
+        if settings.METRICS_DIR:
+            registry.write(settings.METRICS_DIR)
+            content = registry.render_directory(settings.METRICS_DIR)
+        else:
+            content = registry.render()
+        return HttpResponse(content,
+                            content_type='text/plain; version=0.0.4; '
+                                         'charset=utf-8')
@@ -1,21 +1,100 @@
 """The module defines the PredictViewSet class."""
+import functools
+import hashlib
+import json
+import logging
 import os
 import imghdr
+import threading
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor, \
+    TimeoutError as FutureTimeoutError
 
-import cv2
 import numpy as np
 from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
 from rest_framework import status, viewsets
+from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.renderers import BaseRenderer
 from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
 from app.models import Integrate, Predict, Image, Sensor
 from app.serializers import PredictSerializer, ImageSerializer, \
     SensorSerializer, ComfortSerializer
-from models import ImageSegmentation, ComfortClassifier
+from models import get_inference_pool, InferenceTimeoutError
+from utils import ImageDecodeError, ImageTooLargeError, SingleFlight, \
+    encode_image, time_stage
+
+logger = logging.getLogger(__name__)
+
+PREDICT_MODES = ('full', 'labels')
+VALID_EXTENSIONS = ('jpeg', 'jpg', 'png', 'gif', 'bmp', 'webp')
+PREDICT_ERRORS = (ImageDecodeError, InferenceTimeoutError)
+# The suffixes of the derivatives stored next to an annotated image.
+DERIVATIVE_SUFFIXES = {'preview_image': '_preview',
+                       'thumbnail_image': '_thumbnail'}
+
+_result_flights = SingleFlight()
+_render_executor = ThreadPoolExecutor(
+    max_workers=settings.PREDICT_RENDER_THREADS,
+    thread_name_prefix='predict-render')
+_annotator = None
+_annotator_lock = threading.Lock()
+
+
+def _get_annotator():
+    """
+    Get the annotator shared by the render threads.
+
+    The annotator is created on first use, so supervision is only imported
+    by the first rendering and not when the URL configuration is loaded.
+
+    :return: The shared annotator.
+    :rtype: models.SegmentationAnnotator
+    """
+    global _annotator
+    if _annotator is None:
+        with _annotator_lock:
+            if _annotator is None:
+                from models.SegmentationAnnotator import \
+                    SegmentationAnnotator
+                _annotator = SegmentationAnnotator()
+    return _annotator
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Renderer of Server-Sent Events, used for the errors of a stream."""
+
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    @staticmethod
+    def encode(event: str, data) -> str:
+        """
+        Encode a Server-Sent Event.
+
+        :param event: The name of the event.
+        :type event: str
+        :param data: The JSON serializable data of the event.
+        :type data: dict
+        :return: The encoded event.
+        :rtype: str
+        """
+        return (f"event: {event}\n"
+                f"data: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n")
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render the data of a response as a single error event."""
+        return self.encode('error', data).encode(self.charset)
 
 
 class PredictViewSet(viewsets.ViewSet):
@@ -32,31 +111,564 @@ class PredictViewSet(viewsets.ViewSet):
         :return: Response with created Predict or error.
         :rtype: rest_framework.response.Response
         """
+        arguments, error_response = self._parse_request(request)
+        if error_response is not None:
+            return error_response
+        try:
+            response_data = self._predict(*arguments, request)
+        except PREDICT_ERRORS as e:
+            return Response({'error': str(e)},
+                            status=self._error_status(e))
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'],
+            renderer_classes=[EventStreamRenderer])
+    def stream(self, request) -> StreamingHttpResponse:
+        """
+        Create a new Predict object and stream the progress as it happens.
+
+        The response is a stream of Server-Sent Events: "accepted" once the
+        upload is read, "detections" once the inference is done, "labels"
+        once the predictions are saved, "image" with the URL of the
+        annotated image, "comfort" with the comfort levels, and finally
+        "done" with the same data as :meth:`create`. When the annotated
+        image is rendered later, a second "image" event is sent before
+        "done" once it is stored. A failure ends the stream with an "error"
+        event.
+
+        :param request: The HTTP request with Predict data.
+        :type request: rest_framework.request.Request
+        :return: The event stream, or the error response if the request is
+            invalid.
+        :rtype: django.http.StreamingHttpResponse
+        """
+        arguments, error_response = self._parse_request(request)
+        if error_response is not None:
+            return error_response
+        response = StreamingHttpResponse(
+            self._stream_events(*arguments, request),
+            content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request) -> Response:
+        """
+        Create Predict objects for many images of one integrate.
+
+        The request carries several "images" files or an "archive" zip
+        file of images, and the same optional mode and tier as
+        :meth:`create`. The images are predicted concurrently and all the
+        Predict and Image rows are written in one transaction. One result is
+        returned per image; an image that cannot be predicted gets an error
+        instead of failing the whole batch.
+
+        :param request: The HTTP request with the batch data.
+        :type request: rest_framework.request.Request
+        :return: Response with the result of every image or error.
+        :rtype: rest_framework.response.Response
+        """
+        secret = request.data.get('secret')
+        mode = request.data.get('mode', 'full')
+        tier = request.data.get('tier', settings.PREDICT_DEFAULT_TIER)
+
+        if mode not in PREDICT_MODES:
+            return Response({'error': 'Invalid mode, expected one of '
+                                      + ', '.join(PREDICT_MODES)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if tier not in settings.PREDICT_TIERS:
+            return Response({'error': 'Invalid tier, expected one of '
+                                      + ', '.join(settings.PREDICT_TIERS)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        size = request.query_params.get('size')
+        if size is not None and size not in ImageSerializer.SIZES:
+            return Response({'error': 'Invalid size, expected one of '
+                                      + ', '.join(ImageSerializer.SIZES)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            images = self._read_batch_images(request)
+        except zipfile.BadZipFile as e:
+            return Response({'error': str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not secret or not images:
+            return Response({'error': 'Missing required data'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(images) > settings.PREDICT_BATCH_MAX_IMAGES:
+            return Response({'error': 'Too many images, the limit is '
+                             f'{settings.PREDICT_BATCH_MAX_IMAGES}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        response_data = self._predict_batch(secret, images, mode, tier,
+                                            request)
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+    def _read_batch_images(self, request: Request) -> list:
+        """
+        Read the images of a batch request.
+
+        The entries of an archive that are not images, such as directories
+        or metadata files, are skipped.
+
+        :param request: The HTTP request with the batch data.
+        :type request: rest_framework.request.Request
+        :return: The name and the content of every image, or None as the
+            content of an uploaded file that is not a valid image.
+        :rtype: list[tuple(str, bytes)]
+        :raises zipfile.BadZipFile: If the archive is not a zip file, or is
+            larger than PREDICT_BATCH_MAX_ARCHIVE_BYTES once uncompressed.
+        """
+        archive = request.FILES.get('archive')
+        if archive is None:
+            return [(image_file.name, image_file.read()
+                     if self._isvalid(image_file) else None)
+                    for image_file in request.FILES.getlist('images')]
+
+        images = []
+        max_bytes = settings.PREDICT_BATCH_MAX_ARCHIVE_BYTES
+        with zipfile.ZipFile(archive) as zip_file:
+            for info in zip_file.infolist():
+                if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                    continue
+                max_bytes -= info.file_size
+                if max_bytes < 0:
+                    raise zipfile.BadZipFile('The archive is too large.')
+                image_bytes = zip_file.read(info)
+                if imghdr.what(None, h=image_bytes) in VALID_EXTENSIONS:
+                    images.append((os.path.basename(info.filename),
+                                   image_bytes))
+        return images
+
+    def _predict_batch(self, secret: str, images: list, mode: str = 'full',
+                       tier: str = 'balanced', request: Request = None
+                       ) -> dict:
+        """
+        Predict the images of a batch and save the results together.
+
+        The images are sent to the inference pool at the same time, so the
+        detection batcher and the inference workers process them together.
+        The transaction is only opened once every image is predicted and
+        encoded, so it does not hold the write lock of the database while
+        the batch runs.
+
+        :param secret: The secret key for the integrate.
+        :type secret: str
+        :param images: The name and the content of every image.
+        :type images: list[tuple(str, bytes)]
+        :param mode: The prediction mode, "full" or "labels".
+        :type mode: str
+        :param tier: The tier of PREDICT_TIERS giving the inference size.
+        :type tier: str
+        :param request: The HTTP request.
+        :type request: rest_framework.request.Request
+        :return: The response data.
+        :rtype: dict
+        """
+        integrate = self._get_or_create_integrate(secret)
+        if settings.PREDICT_SAVE_UPLOADS:
+            for name, image_bytes in images:
+                if image_bytes is not None:
+                    self._save_image(name, image_bytes)
+        with ThreadPoolExecutor(
+                max_workers=settings.PREDICT_BATCH_THREADS,
+                thread_name_prefix='predict-batch') as executor:
+            futures = [executor.submit(self._get_prediction_result,
+                                       image_bytes, mode, tier)
+                       if image_bytes is not None else None
+                       for _, image_bytes in images]
+
+        results = []
+        predictions = []
+        image_rows = []
+        rendering = []
+        for (name, _), future in zip(images, futures):
+            result = {'name': name}
+            results.append(result)
+            if future is None:
+                result.update(error='Not a valid image',
+                              status=status.HTTP_400_BAD_REQUEST)
+                continue
+            try:
+                labels, annotated_image = future.result()
+            except PREDICT_ERRORS as e:
+                result.update(error=str(e), status=self._error_status(e))
+                continue
+            result['labels'] = labels
+            predictions.extend(
+                Predict(predicted_upper=upper, predicted_lower=lower,
+                        integrate=integrate)
+                for upper, lower in labels)
+            annotated_image = self._wait_for_encoding(annotated_image)
+            if annotated_image:
+                image = self._build_annotated_image(annotated_image,
+                                                    integrate)
+                image_rows.append(image)
+                if isinstance(annotated_image, Future):
+                    rendering.append((image, annotated_image))
+                result['image'] = {
+                    'id': str(image.id),
+                    'url': request.build_absolute_uri(
+                        reverse('image-detail', args=[image.id])),
+                }
+
+        with transaction.atomic(), time_stage('db_write'):
+            Predict.objects.bulk_create(predictions)
+            Image.objects.bulk_create(image_rows)
+            for image, annotated_image in rendering:
+                # The file is attached once the placeholder is committed.
+                transaction.on_commit(functools.partial(
+                    annotated_image.add_done_callback, functools.partial(
+                        self._attach_annotated_image, image.pk)))
+
+        self._add_batch_comfort_levels(results, integrate)
+        for result in results:
+            if 'labels' in result:
+                result['labels'] = [{'upper': upper, 'lower': lower}
+                                    for upper, lower in result['labels']]
+        if settings.PREDICT_SAVE_UPLOADS:
+            self._delete_excess_images('uploads')
+        self._delete_excess_images('detected_images')
+        return {'results': results}
+
+    def _build_annotated_image(self, annotated_image,
+                               integrate: Integrate) -> Image:
+        """
+        Build the unsaved Image of an annotated image of a batch.
+
+        When the image is still being rendered, the Image has no file yet;
+        the caller attaches it once the Image is committed.
+
+        :param annotated_image: The storage names of the annotated image and
+            its derivatives, or a future of the names.
+        :type annotated_image: dict or concurrent.futures.Future
+        :param integrate: The Integration object.
+        :type integrate: app.models.Integrate
+        :return: The unsaved Image object.
+        :rtype: app.models.Image
+        """
+        if not isinstance(annotated_image, Future):
+            return Image(**annotated_image, integrate=integrate)
+        return Image(integrate=integrate)
+
+    def _add_batch_comfort_levels(self, results: list,
+                                  integrate: Integrate) -> None:
+        """
+        Predict the comfort levels of all the images of a batch at once.
+
+        :param results: The results of the images, updated in place.
+        :type results: list[dict]
+        :param integrate: The Integration object.
+        :type integrate: app.models.Integrate
+        """
+        local_temp, local_humid = self._get_sensor_data(integrate)
+        predicted = [result for result in results if result.get('labels')]
+        if not (local_temp and local_humid and predicted):
+            return
+        labels = [label for result in predicted for label in result['labels']]
+        comfort_levels = self._predict_comfort_level(labels, local_temp,
+                                                     local_humid, integrate)
+        start = 0
+        for result in predicted:
+            end = start + len(result['labels'])
+            result['comfort_level'] = comfort_levels[start:end]
+            start = end
+
+    @action(detail=False, methods=['post'])
+    def sequence(self, request) -> Response:
+        """
+        Create Predict objects for the persons of a video or a frame burst.
+
+        The request carries either a "video" file or several "frames"
+        image files, with their optional "frame_rate". One result is
+        returned per tracked person wearing a detected garment, with its
+        clothing labels and, when the integrate has sensor data, its
+        comfort level.
+
+        :param request: The HTTP request with the sequence data.
+        :type request: rest_framework.request.Request
+        :return: Response with the tracked persons or error.
+        :rtype: rest_framework.response.Response
+        """
+        secret = request.data.get('secret')
+        video = request.FILES.get('video')
+        frames = request.FILES.getlist('frames')
+        tier = request.data.get('tier', settings.PREDICT_DEFAULT_TIER)
+        frame_rate = request.data.get('frame_rate',
+                                      settings.PREDICT_SEQUENCE_FRAME_RATE)
+
+        if tier not in settings.PREDICT_TIERS:
+            return Response({'error': 'Invalid tier, expected one of '
+                                      + ', '.join(settings.PREDICT_TIERS)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            frame_rate = float(frame_rate)
+        except (TypeError, ValueError):
+            frame_rate = 0
+        if not frame_rate > 0:
+            return Response({'error': 'Invalid frame rate, expected a '
+                                      'positive number'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not secret or not (video or frames) \
+                or not all(self._isvalid(frame) for frame in frames):
+            return Response({'error': 'Missing required data'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(frames) > settings.PREDICT_SEQUENCE_MAX_FRAMES:
+            return Response({'error': 'Too many frames, the limit is '
+                             f'{settings.PREDICT_SEQUENCE_MAX_FRAMES}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        source = video.read() if video else [frame.read()
+                                             for frame in frames]
+        try:
+            response_data = self._predict_sequence(secret, source, tier,
+                                                   frame_rate)
+        except PREDICT_ERRORS as e:
+            return Response({'error': str(e)},
+                            status=self._error_status(e))
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+    def _predict_sequence(self, secret: str, source,
+                          tier: str = 'balanced',
+                          frame_rate: float = 30.0) -> dict:
+        """
+        Track the persons of a sequence and save their clothing labels.
+
+        The tracks without any garment are left out: they get no Predict
+        object and no comfort level.
+
+        :param secret: The secret key for the integrate.
+        :type secret: str
+        :param source: The encoded video, or the encoded frames.
+        :type source: bytes or list[bytes]
+        :param tier: The tier of PREDICT_TIERS giving the inference size.
+        :type tier: str
+        :param frame_rate: The frame rate of the frames, unused for a video.
+        :type frame_rate: float
+        :return: The response data.
+        :rtype: dict
+        :raises utils.ImageDecodeError: If a frame cannot be decoded.
+        :raises models.InferenceTimeoutError: If the inference pool does not
+            answer in time.
+        """
+        integrate = self._get_or_create_integrate(secret)
+        tracks = get_inference_pool().track_sequence(
+            source, settings.PREDICT_TIERS[tier],
+            settings.PREDICT_SEQUENCE_KEYFRAME_INTERVAL,
+            settings.PREDICT_SEQUENCE_MAX_FRAMES, frame_rate)
+        tracks = [track for track in tracks if any(track.label)]
+        labels = [track.label for track in tracks]
+        self._save_predictions(labels, integrate)
+
+        track_data = []
+        for track in tracks:
+            data = track._asdict()
+            upper, lower = data.pop('label')
+            data.update(upper=upper, lower=lower)
+            track_data.append(data)
+
+        local_temp, local_humid = self._get_sensor_data(integrate)
+        if tracks and local_temp and local_humid:
+            comfort_levels = self._predict_comfort_level(labels,
+                                                         local_temp,
+                                                         local_humid,
+                                                         integrate)
+            for data, comfort_level in zip(track_data, comfort_levels):
+                data['comfort_level'] = comfort_level
+        return {'tracks': track_data}
+
+    def _parse_request(self, request: Request) -> tuple:
+        """
+        Get the prediction arguments of the request.
+
+        :param request: The HTTP request with Predict data.
+        :type request: rest_framework.request.Request
+        :return: The secret, the image file, the mode and the tier, and the
+            error response if the request is invalid, otherwise None.
+        :rtype: tuple(tuple, rest_framework.response.Response)
+        """
         secret = request.data.get('secret')
         image_file = request.data.get('image')
+        mode = request.data.get('mode', 'full')
+        tier = request.data.get('tier', settings.PREDICT_DEFAULT_TIER)
+
+        if mode not in PREDICT_MODES:
+            return None, Response({'error': 'Invalid mode, expected one of '
+                                            + ', '.join(PREDICT_MODES)},
+                                  status=status.HTTP_400_BAD_REQUEST)
+        if tier not in settings.PREDICT_TIERS:
+            return None, Response({'error': 'Invalid tier, expected one of '
+                                            + ', '.join(
+                                                settings.PREDICT_TIERS)},
+                                  status=status.HTTP_400_BAD_REQUEST)
+        size = request.query_params.get('size')
+        if size is not None and size not in ImageSerializer.SIZES:
+            return None, Response({'error': 'Invalid size, expected one of '
+                                            + ', '.join(
+                                                ImageSerializer.SIZES)},
+                                  status=status.HTTP_400_BAD_REQUEST)
+        if not secret or not self._isvalid(image_file):
+            return None, Response({'error': 'Missing required data'},
+                                  status=status.HTTP_400_BAD_REQUEST)
+        return (secret, image_file, mode, tier), None
+
+    def _error_status(self, error: Exception) -> int:
+        """
+        Get the HTTP status of a prediction error.
 
-        if secret and self._isvalid(image_file):
-            integrate = self._get_or_create_integrate(secret)
-            image_path = self._save_image(image_file)
-            annotated_image, labels = self._segment_image(image_path)
-            self._save_predictions(labels, integrate)
-            self._save_annotated_image(annotated_image, request, integrate)
-            response_data = self._get_response_data(integrate, request)
-
-            local_temp, local_humid = self._get_sensor_data(integrate)
-            if local_temp and local_humid:
-                comfort_levels = self._predict_comfort_level(labels,
-                                                             local_temp,
-                                                             local_humid,
-                                                             integrate)
-                response_data['comfort_level'] = comfort_levels
+        :param error: One of the PREDICT_ERRORS.
+        :type error: Exception
+        :return: The HTTP status code.
+        :rtype: int
+        """
+        if isinstance(error, ImageTooLargeError):
+            return status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        if isinstance(error, InferenceTimeoutError):
+            return status.HTTP_503_SERVICE_UNAVAILABLE
+        return status.HTTP_400_BAD_REQUEST
+
+    def _predict(self, secret: str, image_file: ContentFile,
+                 mode: str = 'full', tier: str = 'balanced',
+                 request: Request = None) -> dict:
+        """
+        Run the prediction pipeline for the uploaded image.
+
+        In the "labels" mode only the clothing labels are detected, and no
+        annotated image is produced. When the rendering is deferred, the
+        response is sent as soon as the detection is done and the annotated
+        image is attached to the returned image placeholder later.
+
+        :param secret: The secret key for the integrate.
+        :type secret: str
+        :param image_file: The uploaded image file.
+        :type image_file: django.core.files.uploadedfile.InMemoryUploadedFile
+        :param mode: The prediction mode, "full" or "labels".
+        :type mode: str
+        :param tier: The tier of PREDICT_TIERS giving the inference size.
+        :type tier: str
+        :param request: The HTTP request.
+        :type request: rest_framework.request.Request
+        :return: The response data.
+        :rtype: dict
+        :raises utils.ImageTooLargeError: If the image has more pixels than
+            allowed.
+        :raises utils.ImageDecodeError: If the image cannot be decoded.
+        :raises models.InferenceTimeoutError: If the inference pool does not
+            answer in time.
+        """
+        for _, data in self._predict_events(secret, image_file, mode, tier,
+                                            request):
+            pass
+        return data
+
+    def _predict_events(self, secret: str, image_file: ContentFile,
+                        mode: str = 'full', tier: str = 'balanced',
+                        request: Request = None):
+        """
+        Run the prediction pipeline, yielding an event after every stage.
+
+        :param secret: The secret key for the integrate.
+        :type secret: str
+        :param image_file: The uploaded image file.
+        :type image_file: django.core.files.uploadedfile.InMemoryUploadedFile
+        :param mode: The prediction mode, "full" or "labels".
+        :type mode: str
+        :param tier: The tier of PREDICT_TIERS giving the inference size.
+        :type tier: str
+        :param request: The HTTP request.
+        :type request: rest_framework.request.Request
+        :return: The name and data of every event, the response data being
+            the data of the last, "done" event. While the annotated image
+            is rendered, a "rendering" event carries the future of its
+            storage names.
+        :rtype: Iterator[tuple(str, dict)]
+        """
+        integrate = self._get_or_create_integrate(secret)
+        image_bytes = image_file.read()
+        if settings.PREDICT_SAVE_UPLOADS:
+            self._save_image(image_file.name, image_bytes)
+        yield 'accepted', {'mode': mode, 'tier': tier,
+                           'size': len(image_bytes)}
 
+        labels, annotated_image = self._get_prediction_result(image_bytes,
+                                                              mode, tier)
+        yield 'detections', {'count': len(labels)}
+        self._save_predictions(labels, integrate)
+        yield 'labels', {'labels': [{'upper': upper, 'lower': lower}
+                                    for upper, lower in labels]}
+
+        image_data = None
+        annotated_image = self._wait_for_encoding(annotated_image)
+        if annotated_image:
+            image = self._save_annotated_image(annotated_image, integrate)
+            image_data = {
+                'id': str(image.id),
+                'url': request.build_absolute_uri(
+                    reverse('image-detail', args=[image.id])),
+            }
+            yield 'image', dict(image_data, ready=not isinstance(
+                annotated_image, Future))
+        response_data = self._get_response_data(integrate, request)
+        if image_data is not None:
+            response_data['image'] = image_data
+
+        local_temp, local_humid = self._get_sensor_data(integrate)
+        if local_temp and local_humid:
+            comfort_levels = self._predict_comfort_level(labels,
+                                                         local_temp,
+                                                         local_humid,
+                                                         integrate)
+            response_data['comfort_level'] = comfort_levels
+            yield 'comfort', {'comfort_level': comfort_levels}
+
+        if settings.PREDICT_SAVE_UPLOADS:
             self._delete_excess_images('uploads')
-            self._delete_excess_images('detected_images')
+        self._delete_excess_images('detected_images')
+        if isinstance(annotated_image, Future):
+            yield 'rendering', annotated_image
+        yield 'done', response_data
 
-            return Response(response_data, status=status.HTTP_201_CREATED)
-        return Response({'error': 'Missing required data'},
-                        status=status.HTTP_400_BAD_REQUEST)
+    def _stream_events(self, secret: str, image_file: ContentFile,
+                       mode: str = 'full', tier: str = 'balanced',
+                       request: Request = None):
+        """
+        Encode the events of the prediction pipeline as Server-Sent Events.
+
+        :param secret: The secret key for the integrate.
+        :type secret: str
+        :param image_file: The uploaded image file.
+        :type image_file: django.core.files.uploadedfile.InMemoryUploadedFile
+        :param mode: The prediction mode, "full" or "labels".
+        :type mode: str
+        :param tier: The tier of PREDICT_TIERS giving the inference size.
+        :type tier: str
+        :param request: The HTTP request.
+        :type request: rest_framework.request.Request
+        :return: The encoded events.
+        :rtype: Iterator[str]
+        """
+        image_data = None
+        try:
+            for event, data in self._predict_events(secret, image_file, mode,
+                                                    tier, request):
+                if event == 'image':
+                    image_data = data
+                if event == 'rendering':
+                    image_names = data.result(
+                        timeout=settings.INFERENCE_TIMEOUT)
+                    event, data = 'image', dict(
+                        image_data, ready=True,
+                        **self._image_urls(image_names, request))
+                yield EventStreamRenderer.encode(event, data)
+        except PREDICT_ERRORS as e:
+            yield EventStreamRenderer.encode('error', {
+                'error': str(e), 'status': self._error_status(e)})
+        except FutureTimeoutError:
+            yield EventStreamRenderer.encode('error', {
+                'error': 'The annotated image was not rendered in time.',
+                'status': status.HTTP_503_SERVICE_UNAVAILABLE})
+        except Exception:
+            logger.exception("The prediction stream failed.")
+            yield EventStreamRenderer.encode('error', {
+                'error': 'The prediction failed.',
+                'status': status.HTTP_500_INTERNAL_SERVER_ERROR})
 
     def _get_or_create_integrate(self, secret: str) -> Integrate:
         """
@@ -72,30 +684,206 @@ class PredictViewSet(viewsets.ViewSet):
             integrate = Integrate.objects.create(secret=secret)
         return integrate
 
-    def _save_image(self, image_file: ContentFile) -> str:
+    def _save_image(self, name: str, image_bytes: bytes) -> str:
         """
         Save the uploaded image file.
 
-        :param image_file: The uploaded image file.
-        :type image_file: django.core.files.uploadedfile.InMemoryUploadedFile
+        :param name: The name of the uploaded image file.
+        :type name: str
+        :param image_bytes: The content of the uploaded image file.
+        :type image_bytes: bytes
         :return: The path of the saved image.
         :rtype: str
         """
-        image_path = default_storage.save('uploads/' + image_file.name,
-                                          ContentFile(image_file.read()))
+        image_path = default_storage.save('uploads/' + name,
+                                          ContentFile(image_bytes))
         return "media/" + image_path
 
-    def _segment_image(self, image_path: str) -> tuple:
+    def _get_prediction_result(self, image_bytes: bytes,
+                               mode: str = 'full',
+                               tier: str = 'balanced') -> tuple:
+        """
+        Get the labels and the annotated image of the uploaded image.
+
+        The results are cached by the SHA-256 of the upload, the model
+        version, the segmentation options, the mode and the tier, and
+        identical
+        uploads that are processed at the same time share a single
+        inference.
+
+        :param image_bytes: The encoded image to segment.
+        :type image_bytes: bytes
+        :param mode: The prediction mode, "full" or "labels".
+        :type mode: str
+        :param tier: The tier of PREDICT_TIERS giving the inference size.
+        :type tier: str
+        :return: The labels and the storage names of the annotated image and
+            its derivatives, which are None in the "labels" mode, or a
+            future of the names while the image is still being rendered or
+            encoded.
+        :rtype: tuple(list, dict or concurrent.futures.Future)
+        """
+        key = self._result_key(image_bytes, mode, tier)
+        result = self._get_cached_result(key)
+        if result is None:
+            result = _result_flights.do(
+                key, lambda: self._compute_result(key, image_bytes, mode,
+                                                  tier))
+        return result
+
+    def _result_key(self, image_bytes: bytes, mode: str = 'full',
+                    tier: str = 'balanced') -> str:
+        """
+        Get the result cache key of the uploaded image.
+
+        :param image_bytes: The encoded image.
+        :type image_bytes: bytes
+        :param mode: The prediction mode, "full" or "labels".
+        :type mode: str
+        :param tier: The tier of PREDICT_TIERS giving the inference size.
+        :type tier: str
+        :return: The cache key.
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        digest.update(repr(sorted(settings.IMAGE_SEGMENTATION.items()))
+                      .encode())
+        digest.update(image_bytes)
+        imgsz = settings.PREDICT_TIERS[tier]
+        return (f"predict:{settings.PREDICT_MODEL_VERSION}:{mode}:{imgsz}:"
+                f"{digest.hexdigest()}")
+
+    def _get_cached_result(self, key: str):
+        """
+        Get a cached result whose annotated image files all still exist.
+
+        :param key: The cache key.
+        :type key: str
+        :return: The labels and the annotated image names, or None.
+        :rtype: tuple(list, dict)
+        """
+        result = caches['predictions'].get(key)
+        if result is None or result[1] is None:
+            return result
+        # Results cached before the derivatives existed hold a single name.
+        if isinstance(result[1], dict) and \
+                all(default_storage.exists(name)
+                    for name in result[1].values()):
+            return result
+        return None
+
+    def _compute_result(self, key: str, image_bytes: bytes,
+                        mode: str = 'full', tier: str = 'balanced') -> tuple:
+        """
+        Segment the image and cache the labels and the annotated image.
+
+        The annotated image is encoded on a render thread, so the encoding
+        overlaps the saving of the predictions, and the result is only
+        cached once the image is stored. When the rendering is deferred,
+        the annotated image is also rendered on that thread.
+
+        :param key: The cache key.
+        :type key: str
+        :param image_bytes: The encoded image to segment.
+        :type image_bytes: bytes
+        :param mode: The prediction mode, "full" or "labels".
+        :type mode: str
+        :param tier: The tier of PREDICT_TIERS giving the inference size.
+        :type tier: str
+        :return: The labels and the storage names of the annotated image and
+            its derivatives, or a future of the names while the image is
+            being rendered or encoded.
+        :rtype: tuple(list, dict or concurrent.futures.Future)
+        """
+        result = self._get_cached_result(key)
+        if result is not None:
+            return result
+        imgsz = settings.PREDICT_TIERS[tier]
+        if mode == 'labels':
+            result = (get_inference_pool().detect_labels(image_bytes, imgsz),
+                      None)
+        elif settings.PREDICT_DEFER_RENDERING:
+            segmentation = get_inference_pool().detect(image_bytes, imgsz)
+            future = _render_executor.submit(self._render_annotated_image,
+                                             key, segmentation)
+            return segmentation.labels, future
+        else:
+            annotated_image, labels = self._segment_image(image_bytes, imgsz)
+            future = _render_executor.submit(self._encode_annotated_image,
+                                             key, labels, annotated_image)
+            return labels, future
+        caches['predictions'].set(key, result)
+        return result
+
+    def _render_annotated_image(self, key: str, segmentation) -> dict:
+        """
+        Render, store and cache the annotated image of a segmentation.
+
+        The segmentation carries the image decoded by the inference: the
+        same array when the inference runs in-process, or a copy sent back
+        by the inference worker. The upload is not decoded again.
+
+        :param key: The cache key.
+        :type key: str
+        :param segmentation: The segmentation of the image.
+        :type segmentation: models.Segmentation
+        :return: The storage names of the annotated image and its
+            derivatives, by Image field.
+        :rtype: dict
+        """
+        annotated_image = _get_annotator().annotate(segmentation.image,
+                                                    segmentation)
+        return self._encode_annotated_image(key, segmentation.labels,
+                                            annotated_image)
+
+    def _encode_annotated_image(self, key: str, labels: list,
+                                annotated_image: np.ndarray) -> dict:
+        """
+        Encode, store and cache an annotated image and its derivatives.
+
+        :param key: The cache key.
+        :type key: str
+        :param labels: The labels of the image.
+        :type labels: list[tuple]
+        :param annotated_image: The annotated image.
+        :type annotated_image: numpy.ndarray
+        :return: The storage names of the annotated image and its
+            derivatives, by Image field.
+        :rtype: dict
+        """
+        image_names = self._store_annotated_image(annotated_image)
+        caches['predictions'].set(key, (labels, image_names))
+        return image_names
+
+    def _wait_for_encoding(self, annotated_image):
+        """
+        Wait for the annotated image when its rendering is not deferred.
+
+        :param annotated_image: The storage names of the annotated image and
+            its derivatives, or a future of the names.
+        :type annotated_image: dict or concurrent.futures.Future
+        :return: The storage names, or the future of the names if the
+            rendering is deferred.
+        :rtype: dict or concurrent.futures.Future
+        """
+        if isinstance(annotated_image, Future) and \
+                not settings.PREDICT_DEFER_RENDERING:
+            return annotated_image.result()
+        return annotated_image
+
+    def _segment_image(self, image_bytes: bytes, imgsz: int = 480) -> tuple:
         """
         Segment the image using the ImageSegmentation model.
 
-        :param image_path: The path of the image to segment.
-        :type image_path: str
+        :param image_bytes: The encoded image to segment.
+        :type image_bytes: bytes
+        :param imgsz: The inference size of the detectors.
+        :type imgsz: int
         :return: The annotated image and labels.
         :rtype: tuple(numpy.ndarray, list)
         """
-        segmentation = ImageSegmentation()
-        annotated_image, labels = segmentation.segment_image(image_path)
+        annotated_image, labels = get_inference_pool().segment_image(
+            image_bytes, imgsz)
         return annotated_image, labels
 
     def _save_predictions(self, labels: list,
@@ -108,49 +896,154 @@ class PredictViewSet(viewsets.ViewSet):
         :param integrate: The Integration object.
         :type integrate: app.models.Integrate
         """
-        for upper, lower in labels:
-            prediction_serializer = PredictSerializer(
-                data={'predicted_upper': upper, 'predicted_lower': lower})
-            if prediction_serializer.is_valid():
-                prediction_serializer.save(integrate=integrate)
+        with time_stage('db_write'):
+            for upper, lower in labels:
+                prediction_serializer = PredictSerializer(
+                    data={'predicted_upper': upper,
+                          'predicted_lower': lower})
+                if prediction_serializer.is_valid():
+                    prediction_serializer.save(integrate=integrate)
 
-    def _save_annotated_image(self, annotated_image: np.ndarray,
-                              request: Request,
-                              integrate: Integrate) -> None:
+    def _store_annotated_image(self, annotated_image: np.ndarray) -> dict:
         """
-        Save the annotated image.
+        Encode the annotated image and its derivatives and store their files.
+
+        The format, quality and size of the files are set by
+        ANNOTATED_IMAGE_ENCODING, and their extension matches the format.
+        The preview and the thumbnail are reduced to the long sides of
+        ANNOTATED_IMAGE_PREVIEW_SIDE and ANNOTATED_IMAGE_THUMBNAIL_SIDE and
+        are named after the stored full-size image, with a suffix, so the
+        files of an image are pruned together.
 
         :param annotated_image: The annotated image.
         :type annotated_image: numpy.ndarray
-        :param request: The HTTP request.
+        :return: The storage names of the annotated image and its
+            derivatives, by Image field.
+        :rtype: dict
+        """
+        encoding = settings.ANNOTATED_IMAGE_ENCODING
+        variants = (
+            ('detected_image', encoding['max_side']),
+            ('preview_image', settings.ANNOTATED_IMAGE_PREVIEW_SIDE),
+            ('thumbnail_image', settings.ANNOTATED_IMAGE_THUMBNAIL_SIDE),
+        )
+        image_names = {}
+        base_name = None
+        for field_name, max_side in variants:
+            with time_stage('encoding'):
+                encoded = encode_image(annotated_image, encoding['format'],
+                                       encoding['quality'], max_side)
+            if base_name is None:
+                name = Image._meta.get_field(field_name).generate_filename(
+                    None, f'segmented_image{encoded.extension}')
+            else:
+                name = (f'{base_name}{DERIVATIVE_SUFFIXES[field_name]}'
+                        f'{encoded.extension}')
+            image_names[field_name] = default_storage.save(
+                name, ContentFile(encoded.content))
+            if base_name is None:
+                base_name = os.path.splitext(image_names[field_name])[0]
+        return image_names
+
+    def _image_urls(self, image_names: dict, request: Request) -> dict:
+        """
+        Get the URLs of the stored annotated image and its derivatives.
+
+        :param image_names: The storage names, by Image field.
+        :type image_names: dict
+        :param request: The HTTP request, whose "size" query parameter
+            picks a single size variant.
         :type request: rest_framework.request.Request
+        :return: The absolute URLs, by Image field.
+        :rtype: dict
+        """
+        size = request.query_params.get('size')
+        fields = [ImageSerializer.SIZES[size]] if size else image_names
+        return {field: request.build_absolute_uri(
+                    default_storage.url(image_names[field]))
+                for field in fields}
+
+    def _save_annotated_image(self, annotated_image,
+                              integrate: Integrate) -> Image:
+        """
+        Save the annotated image of the integrate.
+
+        If the image is still being rendered, an Image without a file is
+        saved and the file is attached once the rendering finishes.
+
+        :param annotated_image: The storage names of the annotated image and
+            its derivatives, or a future of the names.
+        :type annotated_image: dict or concurrent.futures.Future
         :param integrate: The Integration object.
         :type integrate: app.models.Integrate
+        :return: The saved Image object.
+        :rtype: app.models.Image
         """
-        _, frame = cv2.imencode('.png', annotated_image)
-        img_file = ContentFile(frame.tobytes())
-        img_file.name = 'segmented_image.jpg'
-        image_serializer = ImageSerializer(data={'detected_image': img_file},
-                                           context={'request': request})
-        if image_serializer.is_valid():
-            image_serializer.save(integrate=integrate)
-        else:
-            raise Exception(image_serializer.errors)
+        with time_stage('db_write'):
+            if not isinstance(annotated_image, Future):
+                return Image.objects.create(**annotated_image,
+                                            integrate=integrate)
+            image = Image.objects.create(integrate=integrate)
+        annotated_image.add_done_callback(
+            lambda future: self._attach_annotated_image(image.pk, future))
+        return image
+
+    def _attach_annotated_image(self, image_id, future: Future) -> None:
+        """
+        Attach a rendered annotated image to its Image placeholder.
+
+        The placeholder is deleted if the rendering or the update failed,
+        so clients polling it get a 404 instead of waiting forever.
+
+        :param image_id: The primary key of the Image placeholder.
+        :type image_id: uuid.UUID
+        :param future: The finished future of the storage names of the
+            annotated image and its derivatives.
+        :type future: concurrent.futures.Future
+        """
+        try:
+            Image.objects.filter(pk=image_id).update(**future.result())
+        except Exception:
+            logger.exception("Attaching the annotated image %s failed.",
+                             image_id)
+            try:
+                Image.objects.filter(pk=image_id).delete()
+            except Exception:
+                logger.exception("Deleting the Image placeholder %s failed.",
+                                 image_id)
+        finally:
+            if threading.current_thread().name.startswith('predict-render'):
+                connection.close()
 
     def _delete_excess_images(self, folder: str) -> None:
         """
         Delete excess images from the specified folder.
 
+        An annotated image and its derivatives count as one image and are
+        deleted together. The oldest images are deleted first, so the image
+        just stored is kept.
+
         :param folder: The folder name.
         :type folder: str
         """
         media_folder = os.path.join(settings.MEDIA_ROOT, folder)
-        images = list(os.listdir(media_folder))
+        if not os.path.isdir(media_folder):
+            return
+        images = {}
+        for file_name in os.listdir(media_folder):
+            base_name = os.path.splitext(file_name)[0]
+            for suffix in DERIVATIVE_SUFFIXES.values():
+                if base_name.endswith(suffix):
+                    base_name = base_name[:-len(suffix)]
+                    break
+            images.setdefault(base_name, []).append(file_name)
         if len(images) > 10:
-            images_to_delete = images[:5]
-            for image in images_to_delete:
-                image_path = os.path.join(media_folder, image)
-                os.remove(image_path)
+            images = sorted(images.values(), key=lambda file_names: max(
+                os.path.getmtime(os.path.join(media_folder, file_name))
+                for file_name in file_names))
+            for file_names in images[:5]:
+                for file_name in file_names:
+                    os.remove(os.path.join(media_folder, file_name))
 
     def _predict_comfort_level(self, labels: list,
                                local_temp: float,
@@ -170,10 +1063,8 @@ class PredictViewSet(viewsets.ViewSet):
         :return: The predicted comfort levels.
         :rtype: list
         """
-        comfort_classifier = ComfortClassifier()
-        comfort_levels = comfort_classifier.predict_comfort_level(labels,
-                                                                  local_temp,
-                                                                  local_humid)
+        comfort_levels = get_inference_pool().predict_comfort_level(
+            labels, local_temp, local_humid)
         comfort_data = []
         for comfort in comfort_levels:
             comfort_serializer = ComfortSerializer(data={'comfort': comfort})
@@ -230,8 +1121,7 @@ class PredictViewSet(viewsets.ViewSet):
         :return: True if the file is a valid image, False otherwise.
         :rtype: bool
         """
-        valid_extensions = ['jpeg', 'jpg', 'png', 'gif', 'bmp', 'webp']
         if not file:
             return False
         image_type = imghdr.what(file)
-        return image_type in valid_extensions
+        return image_type in VALID_EXTENSIONS
@@ -2,3 +2,5 @@ from app.views.PredictViewSet import PredictViewSet  # noqa F401
 from app.views.SensorViewSet import SensorViewSet  # noqa F401
 from app.views.ComfortViewSet import ComfortViewSet  # noqa F401
 from app.views.IntegrateViewSet import IntegrateViewSet  # noqa F401
+from app.views.ImageViewSet import ImageViewSet  # noqa F401
+from app.views.MetricsViewSet import MetricsViewSet  # noqa F401
@@ -160,6 +160,185 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
 ]
 CORS_ALLOW_ALL_ORIGINS = True
+
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Labels and annotated images of predicted uploads, keyed by the
+    # SHA-256 of the upload, PREDICT_MODEL_VERSION and IMAGE_SEGMENTATION.
+    "predictions": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "predictions",
+        "TIMEOUT": int(os.environ.get("PREDICT_CACHE_TTL", 3600)),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(
+                os.environ.get("PREDICT_CACHE_MAX_ENTRIES", 256)),
+        },
+    },
+}
+
+# Predict
+# Part of the prediction cache keys; change it whenever the model weights
+# change so that cached predictions are not reused.
+PREDICT_MODEL_VERSION = os.environ.get("PREDICT_MODEL_VERSION", "1")
+# Keep a copy of every uploaded image in MEDIA_ROOT/uploads. The image is
+# decoded in memory, so this is only needed for debugging.
+PREDICT_SAVE_UPLOADS = os.environ.get("PREDICT_SAVE_UPLOADS",
+                                      "False") == "True"
+# Respond as soon as the detection is done and render the annotated image on
+# a background thread; the response carries the URL of the pending image
+# instead of the image, so clients have to opt in.
+PREDICT_DEFER_RENDERING = os.environ.get("PREDICT_DEFER_RENDERING",
+                                         "False") == "True"
+# The number of threads rendering the deferred annotated images.
+PREDICT_RENDER_THREADS = int(os.environ.get("PREDICT_RENDER_THREADS", 2))
+# Inference size of the detectors for each tier a request can ask for.
+PREDICT_TIERS = {
+    "fast": int(os.environ.get("PREDICT_TIER_FAST_IMGSZ", 320)),
+    "balanced": int(os.environ.get("PREDICT_TIER_BALANCED_IMGSZ", 480)),
+    "accurate": int(os.environ.get("PREDICT_TIER_ACCURATE_IMGSZ", 640)),
+}
+PREDICT_DEFAULT_TIER = os.environ.get("PREDICT_DEFAULT_TIER", "balanced")
+# The sequence endpoint tracks the persons on every frame and only runs the
+# garment detector on every n-th frame. Videos are cut after the maximum
+# number of frames; longer bursts of frames are rejected. Bursts of frames
+# are taken at the default frame rate unless the request gives theirs.
+PREDICT_SEQUENCE_KEYFRAME_INTERVAL = int(
+    os.environ.get("PREDICT_SEQUENCE_KEYFRAME_INTERVAL", 5))
+PREDICT_SEQUENCE_FRAME_RATE = float(
+    os.environ.get("PREDICT_SEQUENCE_FRAME_RATE", 30))
+PREDICT_SEQUENCE_MAX_FRAMES = int(
+    os.environ.get("PREDICT_SEQUENCE_MAX_FRAMES", 300))
+# The batch endpoint predicts this many images at the same time, and accepts
+# up to the maximum number of images, or zip archives up to the maximum
+# uncompressed size.
+PREDICT_BATCH_THREADS = int(os.environ.get("PREDICT_BATCH_THREADS", 4))
+PREDICT_BATCH_MAX_IMAGES = int(os.environ.get("PREDICT_BATCH_MAX_IMAGES", 32))
+PREDICT_BATCH_MAX_ARCHIVE_BYTES = int(
+    os.environ.get("PREDICT_BATCH_MAX_ARCHIVE_BYTES", 200 * 1024 * 1024))
+# Options passed to utils.encode_image for the annotated images. The format
+# is "webp", "jpeg" or "png"; the quality (0-100) applies to WebP and JPEG,
+# and images with a longer side than "max_side" are reduced (0 keeps the
+# size of the decoded upload).
+ANNOTATED_IMAGE_ENCODING = {
+    "format": os.environ.get("ANNOTATED_IMAGE_FORMAT", "webp"),
+    "quality": int(os.environ.get("ANNOTATED_IMAGE_QUALITY", 80)),
+    "max_side": int(os.environ.get("ANNOTATED_IMAGE_MAX_SIDE", 1280)) or None,
+}
+# The long sides of the preview and the thumbnail stored with every annotated
+# image, which clients pick with the "size" query parameter.
+ANNOTATED_IMAGE_PREVIEW_SIDE = int(
+    os.environ.get("ANNOTATED_IMAGE_PREVIEW_SIDE", 640))
+ANNOTATED_IMAGE_THUMBNAIL_SIDE = int(
+    os.environ.get("ANNOTATED_IMAGE_THUMBNAIL_SIDE", 200))
+
+# Inference
+# Load the models and run a dummy inference when a gunicorn worker starts, so
+# the first request does not pay for loading the weights. Management commands
+# and the development server never warm up.
+MODEL_WARMUP_ON_STARTUP = os.environ.get(
+    "MODEL_WARMUP_ON_STARTUP", "True") == "True"
+# "full" warms up every model; "labels" only warms up the models used by
+# labels-only predictions, so workers that only serve them never load the
+# person detector and SAM.
+MODEL_WARMUP_MODE = os.environ.get("MODEL_WARMUP_MODE", "full")
+# Load the models in the master of a preloading server (see gunicorn.conf.py)
+# before it forks the web workers, so the workers share the pages of the
+# weights. The CPU slot and the warm-up then run in every worker after the
+# fork.
+MODEL_PRELOAD = os.environ.get("MODEL_PRELOAD", "False") == "True"
+# Number of long-lived inference worker processes. With 0 the inference runs
+# inside the request thread.
+INFERENCE_POOL_SIZE = int(os.environ.get("INFERENCE_POOL_SIZE", 0))
+# Seconds a request waits for an inference job before giving up.
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", 60))
+# Seconds an inference job waits for a free worker before it is given up.
+# The inference timeout only counts once a worker runs the job.
+INFERENCE_QUEUE_TIMEOUT = float(os.environ.get("INFERENCE_QUEUE_TIMEOUT",
+                                               INFERENCE_TIMEOUT))
+INFERENCE_POOL_START_METHOD = os.environ.get("INFERENCE_POOL_START_METHOD",
+                                             "fork")
+# The messages of the helpers, such as the CPU slot of every inference
+# process, go to the console next to the server logs.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "utils": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+# Options passed to utils.apply_cpu_slot. The CPU cores of the host are split
+# into "slots" groups and every inference process (each inference worker, or
+# each web worker when the inference runs in-process) runs its torch and
+# OpenMP threads on one group, so the processes do not oversubscribe the
+# cores. Set "slots" to the number of such processes on the host: every web
+# worker starts a pool of its own, so GUNICORN_WORKERS * INFERENCE_POOL_SIZE
+# with a pool, otherwise GUNICORN_WORKERS; 0 disables it.
+CPU_SCHEDULER = {
+    "slots": int(os.environ.get("INFERENCE_CPU_SLOTS", 0)),
+    # Pin every process to the cores of its slot.
+    "pin": os.environ.get("INFERENCE_CPU_PIN", "False") == "True",
+    "inter_op_threads": int(os.environ.get("INFERENCE_INTEROP_THREADS", 1)),
+    # Where the processes hold the lock files of their slots.
+    "lock_dir": os.environ.get("INFERENCE_CPU_LOCK_DIR"),
+}
+# Options passed to models.ImageSegmentation.
+IMAGE_SEGMENTATION = {
+    # Concurrent detections collected within the wait window, up to the
+    # batch size, run through the YOLO models as one batch. A longer window
+    # gives bigger batches at the cost of latency; 1 disables batching.
+    "detection_batch_size": int(os.environ.get("DETECTION_BATCH_SIZE", 1)),
+    "detection_batch_wait_ms": float(
+        os.environ.get("DETECTION_BATCH_WAIT_MS", 10)),
+    # The garment detector, the person detector and the SAM image encoder
+    # run concurrently on this many threads; 1 runs them one after another.
+    # The torch threads are split between the stages for the whole process,
+    # including the paths that run a single stage, so the overlap is opt-in.
+    "stage_threads": int(os.environ.get("SEGMENTATION_STAGE_THREADS", 1)),
+    # Intra-op threads of torch. By default the CPU cores are split evenly
+    # between the concurrent stages.
+    "torch_threads": int(os.environ.get("SEGMENTATION_TORCH_THREADS", 0))
+    or None,
+    # SAM image embeddings cached in memory, keyed by the image content. The
+    # embeddings evicted from memory are kept in the cache directory when
+    # one is set, which the inference workers of a host can share.
+    "embedding_cache_size": int(
+        os.environ.get("SAM_EMBEDDING_CACHE_SIZE", 16)),
+    "embedding_cache_dir": os.environ.get("SAM_EMBEDDING_CACHE_DIR"),
+    "embedding_cache_disk_size": int(
+        os.environ.get("SAM_EMBEDDING_CACHE_DISK_SIZE", 256)),
+    # Backend of the YOLO detectors: "torch", or "onnx" to export them once
+    # to models/weights/*.onnx and run them with ONNX Runtime.
+    "detector_backend": os.environ.get("INFERENCE_BACKEND", "torch"),
+    # Quantize the linear layers of the SAM image encoder to INT8 when it is
+    # loaded: faster and smaller, with slightly less accurate masks.
+    "quantize_sam": os.environ.get("SAM_QUANTIZE", "False") == "True",
+    # Images at least twice this long on their long side are decoded at
+    # 1/2, 1/4 or 1/8 of their size, keeping at least this long side. SAM
+    # resizes its input to 1024 anyway; 0 decodes at full size.
+    "decode_max_side": int(os.environ.get("IMAGE_DECODE_MAX_SIDE", 1024))
+    or None,
+    # Images with more pixels are rejected before being decoded.
+    "max_pixels": int(os.environ.get("IMAGE_MAX_PIXELS", 40_000_000))
+    or None,
+    # Run the person detector first: without any person nothing else runs,
+    # otherwise the garment detector runs on a crop around every person and
+    # SAM on a single crop around all of them. The crops are padded by this
+    # fraction of the person box size.
+    "cascade": os.environ.get("SEGMENTATION_CASCADE", "False") == "True",
+    "cascade_padding": float(os.environ.get("CASCADE_PADDING", 0.1)),
+}
+# A directory shared by the web workers of a host, where every worker saves
+# its metrics so the metrics endpoint reports the sum of all of them. Without
+# it, every worker only reports its own metrics.
+METRICS_DIR = os.environ.get("METRICS_DIR") or None
 SPECTACULAR_SETTINGS = {
     "TITLE": "ComfyWearBackend API",
     "DESCRIPTION": "Documentation of API endpoints of ComfyWearBackend",
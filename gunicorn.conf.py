@@ -0,0 +1,57 @@
+"""
+Gunicorn configuration of the backend.
+
+Run the server from the repository root with ``gunicorn``, which reads this
+file. With ``MODEL_PRELOAD=True`` the master loads the application and the
+models before forking the workers. The heap is frozen with ``gc.freeze()``
+right before every fork, so the garbage collector of a worker never writes
+to the reference counts and headers of the objects it inherited, and the
+pages of the weights stay shared between the workers instead of being
+copied on write.
+"""
+import gc
+import os
+
+wsgi_app = "comfywearbackend.wsgi:application"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+# Predictions of large images and sequences take longer than the default.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+preload_app = os.environ.get("MODEL_PRELOAD", "False") == "True"
+
+
+def on_starting(server):
+    """Remove the metrics saved by the workers of a previous server."""
+    metrics_dir = os.environ.get("METRICS_DIR")
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for file_name in os.listdir(metrics_dir):
+            os.remove(os.path.join(metrics_dir, file_name))
+
+
+def when_ready(server):
+    """Load the models in the master once the application is loaded."""
+    if preload_app:
+        from app.apps import preload_inference
+        preload_inference()
+
+
+def pre_fork(server, worker):
+    """Move the heap of the master out of reach of the collector."""
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """Apply the CPU slot of the new worker."""
+    # Without preloading, the worker loads the application after this hook.
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                          "comfywearbackend.settings")
+    from app.apps import claim_worker_cpu_slot
+    claim_worker_cpu_slot()
+
+
+def post_worker_init(worker):
+    """Warm up the models of the worker once it loaded the application."""
+    from app.apps import start_inference
+    start_inference()
@@ -1,11 +1,31 @@
 """The module containing the classifier for inference the comfort level."""
+import csv
 import os
 from typing import List, Tuple
 import joblib
-import pandas as pd
 import numpy as np
 
 from utils import check_and_download_files
+from utils.metrics import time_stage
+
+# The labels of the detector without a column in the dataset, mapped to the
+# columns of the upper and of the lower body closest to them.
+UPPER_MAPPING = {
+    "long sleeve dress": "long sleeve top",
+    "short sleeve dress": "short sleeve top",
+    "sling": "long sleeve top",
+    "sling dress": "short sleeve top",
+    "vest": "short sleeve top",
+    "vest dress": "short sleeve top"
+}
+LOWER_MAPPING = {
+    "long sleeve dress": "skirt",
+    "short sleeve dress": "skirt",
+    "sling": "skirt",
+    "sling dress": "skirt",
+    "vest": "skirt",
+    "vest dress": "skirt"
+}
 
 
 class ComfortClassifier:
@@ -14,7 +34,10 @@ class ComfortClassifier:
         self.model_base_path = "models/weights/"
         check_and_download_files(self.model_base_path)
         self.resource_path = "models/model_resources/data.csv"
-        self.columns = pd.read_csv(self.resource_path).columns[:-1]
+        # The features of the dataset, without the comfort level: the
+        # clothing columns, then the local temperature and humidity.
+        with open(self.resource_path, newline="") as resource:
+            self.columns = next(csv.reader(resource))[:-1]
         self.classifier = self.load_model(os.path.join(self.model_base_path,
                                                        "gb_model.pkl"))
         self.scaler_temp_humid = self.load_model(os.path.join(
@@ -22,6 +45,13 @@ class ComfortClassifier:
         self.scaler_other = self.load_model(os.path.join(self.model_base_path,
                                                          "scaler_other.pkl"))
 
+        # The classifier takes the temperature and the humidity first, then
+        # the clothing columns.
+        self.n_features = len(self.columns)
+        self.upper_index = self._build_label_index(UPPER_MAPPING)
+        self.lower_index = self._build_label_index(LOWER_MAPPING)
+        self.feature_scale, self.feature_offset = self._fuse_scalers()
+
     def load_model(self, path):
         """
         Load a joblib model file with error handling for compatibility issues.
@@ -50,20 +80,22 @@ class ComfortClassifier:
         :return: The predicted comfort levels.
         :rtype: list
         """
-        input_data: list = self._prepare_input_data(labels, local_temp,
-                                                    local_humid)
-        input_df: pd.DataFrame = pd.DataFrame(input_data)
-        print("Input data:")
-        print(input_df)
-        comfort_levels: np.ndarray = self.classifier.predict(input_df)
-        print("Comfort levels:")
-        print(comfort_levels)
+        if not labels:
+            return []
+        with time_stage("classifier"):
+            input_data: np.ndarray = self._prepare_input_data(
+                labels, local_temp, local_humid)
+            comfort_levels: np.ndarray = self.classifier.predict(input_data)
         return comfort_levels.tolist()
 
     def _prepare_input_data(self, labels: List[Tuple], local_temp: float,
-                            local_humid: float) -> list:
+                            local_humid: float) -> np.ndarray:
         """
-        Prepare the input data for comfort level prediction.
+        Prepare the scaled input data for comfort level prediction.
+
+        The clothing columns are one-hot encoded by indexing the rows and
+        columns of all the labels at once, and the features are scaled
+        with the affine transform of both scalers.
 
         :param labels: A list of tuples containing the upper and lower labels.
         :type labels: list[tuple]
@@ -71,60 +103,66 @@ class ComfortClassifier:
         :type local_temp: float
         :param local_humid: The local humidity.
         :type local_humid: float
-        :return: The prepared input data.
-        :rtype: list
+        :return: The prepared input data, a row per label tuple.
+        :rtype: numpy.ndarray
         """
-        input_cloth: list = []
-        input_temp_humid: list = []
-        for upper_label, lower_label in labels:
-            row_cloth: list = [0] * (len(self.columns) - 2)
-            row_temp_humid: list = [0] * 2
+        rows: list = []
+        columns: list = []
+        for row, (upper_label, lower_label) in enumerate(labels):
             if upper_label:
-                upper_label = self._map_input(upper_label)
-                row_cloth[self.columns.get_loc(upper_label)] = 1
+                rows.append(row)
+                columns.append(self.upper_index[upper_label])
             if lower_label:
-                lower_label = self._map_input(lower_label, False)
-                row_cloth[self.columns.get_loc(lower_label)] = 1
+                rows.append(row)
+                columns.append(self.lower_index[lower_label])
 
-            row_temp_humid[0] = local_temp
-            row_temp_humid[1] = local_humid
-            input_cloth.append(row_cloth)
-            input_temp_humid.append(row_temp_humid)
+        input_data = np.zeros((len(labels), self.n_features))
+        input_data[:, 0] = local_temp
+        input_data[:, 1] = local_humid
+        input_data[rows, columns] = 1
+        input_data *= self.feature_scale
+        input_data += self.feature_offset
+        return input_data
 
-        X_temp_humid = self.scaler_temp_humid.transform(input_temp_humid)
-        X_other = self.scaler_other.transform(input_cloth)
+    def _build_label_index(self, mapping: dict) -> dict:
+        """
+        Map every label to the index of its feature.
 
-        return np.concatenate((X_temp_humid, X_other), axis=1)
+        :param mapping: The labels without a column, mapped to the column
+            taking their place.
+        :type mapping: dict
+        :return: The feature index of every label with a column.
+        :rtype: dict
+        """
+        clothing_columns = self.columns[:-2]
+        index = {column: position + 2
+                 for position, column in enumerate(clothing_columns)}
+        index.update({label: index[column] for label, column in mapping.items()
+                      if column in index})
+        return index
 
-    def _map_input(self, label: str, is_upper=True) -> str:
+    def _fuse_scalers(self) -> tuple:
         """
-        Map the input label to the corresponding label in the dataset.
-
-        :param label: The input label.
-        :type label: str
-        :param is_upper: A flag indicating whether the label is for the upper or lower body.
-        :type is_upper: bool
-        :return: The mapped label.
-        :rtype: str
+        Fuse both scalers into one affine transform of the features.
+
+        The scalers scale every feature on its own, so the transform of a
+        row of zeros gives the offsets and the transform of a row of ones
+        gives the offsets plus the scales.
+
+        :return: The scale and the offset of every feature.
+        :rtype: tuple[numpy.ndarray, numpy.ndarray]
+        :raises ValueError: If a scaler does not scale the features on their
+            own.
         """
-        upper_mapping = {
-            "long sleeve dress": "long sleeve top",
-            "short sleeve dress": "short sleeve top",
-            "sling": "long sleeve top",
-            "sling dress": "short sleeve top",
-            "vest": "short sleeve top",
-            "vest dress": "short sleeve top"
-        }
-
-        lower_mapping = {
-            "long sleeve dress": "skirt",
-            "short sleeve dress": "skirt",
-            "sling": "skirt",
-            "sling dress": "skirt",
-            "vest": "skirt",
-            "vest dress": "skirt"
-        }
-
-        if is_upper:
-            return upper_mapping.get(label, label)
-        return lower_mapping.get(label, label)
\ No newline at end of file
+        def transform(value: float) -> np.ndarray:
+            return np.concatenate((
+                self.scaler_temp_humid.transform(np.full((1, 2), value)),
+                self.scaler_other.transform(
+                    np.full((1, self.n_features - 2), value))), axis=1)[0]
+
+        offset = transform(0.0)
+        scale = transform(1.0) - offset
+        if not np.allclose(transform(3.0), offset + 3.0 * scale):
+            raise ValueError("The scalers of the comfort classifier are not "
+                             "affine and cannot be fused.")
+        return scale, offset
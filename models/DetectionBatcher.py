@@ -0,0 +1,142 @@
+"""The module containing the micro-batching stage of the YOLO detectors."""
+import queue
+import threading
+import time
+
+
+class _PendingDetection:
+    """A detection request waiting for its batch to be run."""
+
+    def __init__(self, source, imgsz: int):
+        """Initialize the _PendingDetection class."""
+        self.source = source
+        self.imgsz = imgsz
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DetectionBatcher:
+    """
+    Collect concurrent detection requests and run them as one batch.
+
+    Requests that arrive within ``max_wait_ms`` of the first request of a
+    batch, up to ``max_batch_size`` images, are sent through the YOLO model
+    in a single call and every caller receives its own result. A larger
+    window gives bigger batches and better throughput under load at the
+    cost of up to ``max_wait_ms`` of extra latency per request. With a batch
+    size of 1 the model is called directly.
+    """
+
+    def __init__(self, model, max_batch_size: int = 1,
+                 max_wait_ms: float = 0.0):
+        """
+        Initialize the DetectionBatcher class.
+
+        :param model: The YOLO model to run.
+        :type model: ultralytics.YOLO
+        :param max_batch_size: The maximum number of images in a batch.
+        :type max_batch_size: int
+        :param max_wait_ms: The longest time to wait for a batch to fill up.
+        :type max_wait_ms: float
+        """
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def predict(self, source, imgsz: int = 480):
+        """
+        Detect the objects in a single image.
+
+        :param source: The path of the image, or the image itself.
+        :type source: str or numpy.ndarray
+        :param imgsz: The inference size of the model.
+        :type imgsz: int
+        :return: The YOLO result of the image.
+        :rtype: YOLO.Results
+        """
+        if self.max_batch_size == 1:
+            with self._lock:
+                return self.model(source, imgsz=imgsz)[0]
+
+        self._ensure_worker()
+        pending = _PendingDetection(source, imgsz)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def predict_batch(self, sources: list, imgsz: int = 480) -> list:
+        """
+        Detect the objects in images that are already grouped together.
+
+        The images are sent through the model in a single call, without
+        waiting for other requests.
+
+        :param sources: The images.
+        :type sources: list[numpy.ndarray]
+        :param imgsz: The inference size of the model.
+        :type imgsz: int
+        :return: The YOLO result of every image, in the same order.
+        :rtype: list[YOLO.Results]
+        """
+        with self._lock:
+            return list(self.model(list(sources), imgsz=imgsz))
+
+    def _ensure_worker(self) -> None:
+        """Start the batching thread if it is not running yet."""
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(
+                        target=self._run, name="detection-batcher",
+                        daemon=True)
+                    self._worker.start()
+
+    def _run(self) -> None:
+        """Collect the queued requests into batches forever."""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: list) -> None:
+        """
+        Run the model once per group of compatible requests in the batch.
+
+        The requests are grouped by inference size and by source type,
+        because a single YOLO call takes one ``imgsz`` and cannot mix paths
+        with arrays.
+
+        :param batch: The pending requests.
+        :type batch: list[_PendingDetection]
+        """
+        groups = {}
+        for pending in batch:
+            key = (pending.imgsz, isinstance(pending.source, str))
+            groups.setdefault(key, []).append(pending)
+
+        for (imgsz, _), group in groups.items():
+            try:
+                with self._lock:
+                    results = self.model([p.source for p in group],
+                                         imgsz=imgsz)
+                for pending, result in zip(group, results):
+                    pending.result = result
+            except Exception as e:
+                for pending in group:
+                    pending.error = e
+            for pending in group:
+                pending.done.set()
@@ -0,0 +1,151 @@
+"""The module containing the cache of SAM image embeddings."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import torch
+
+from utils.metrics import EMBEDDING_CACHE
+
+SamEmbedding = namedtuple("SamEmbedding",
+                          ["features", "original_size", "input_size"])
+
+
+class EmbeddingCache:
+    """
+    A bounded LRU cache of SAM image embeddings.
+
+    The embeddings are keyed by a hash of the decoded pixels and the input
+    size of the image encoder, so re-uploading an identical frame skips the
+    encoder. When a spill directory is given, the embeddings evicted from
+    memory are written there and looked up on a memory miss. The directory
+    can be shared by the inference workers of a host. Every lookup counts
+    its result in the ``comfywear_embedding_cache_total`` metric.
+    """
+
+    def __init__(self, max_entries: int = 16, spill_dir: str = None,
+                 max_spill_entries: int = 256):
+        """
+        Initialize the EmbeddingCache class.
+
+        :param max_entries: The number of embeddings kept in memory.
+        :type max_entries: int
+        :param spill_dir: The directory for evicted embeddings, or None to
+            drop them.
+        :type spill_dir: str
+        :param max_spill_entries: The number of embeddings kept on disk.
+        :type max_spill_entries: int
+        """
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self.max_spill_entries = max_spill_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @staticmethod
+    def key(image: np.ndarray, imgsz: int, variant: str = "") -> str:
+        """
+        Compute the cache key of an image.
+
+        :param image: The decoded image.
+        :type image: numpy.ndarray
+        :param imgsz: The input size of the image encoder.
+        :type imgsz: int
+        :param variant: Anything else the embedding depends on.
+        :type variant: str
+        :return: The cache key.
+        :rtype: str
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{image.shape}|{image.dtype}|{imgsz}|{variant}"
+                      .encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """
+        Get a cached embedding.
+
+        :param key: The cache key.
+        :type key: str
+        :return: The cached embedding, or None on a miss.
+        :rtype: SamEmbedding
+        """
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+        if embedding is not None:
+            EMBEDDING_CACHE.inc(result="hit")
+            return embedding
+
+        embedding = self._load(key)
+        if embedding is None:
+            EMBEDDING_CACHE.inc(result="miss")
+            return None
+        EMBEDDING_CACHE.inc(result="disk_hit")
+        self.put(key, embedding)
+        return embedding
+
+    def put(self, key: str, embedding) -> None:
+        """
+        Cache an embedding, evicting the least recently used ones.
+
+        :param key: The cache key.
+        :type key: str
+        :param embedding: The embedding to cache.
+        :type embedding: SamEmbedding
+        """
+        evicted = []
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False))
+        for evicted_key, evicted_embedding in evicted:
+            self._spill(evicted_key, evicted_embedding)
+
+    def _path(self, key: str) -> str:
+        """Get the spill file path of a key."""
+        return os.path.join(self.spill_dir, f"{key}.pt")
+
+    def _load(self, key: str):
+        """Load a spilled embedding, or return None if there is none."""
+        if not self.spill_dir:
+            return None
+        try:
+            return SamEmbedding(**torch.load(self._path(key)))
+        except (FileNotFoundError, EOFError, RuntimeError):
+            return None
+
+    def _spill(self, key: str, embedding) -> None:
+        """Write an evicted embedding to the spill directory."""
+        if not self.spill_dir:
+            return
+        path = self._path(key)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        torch.save(embedding._asdict(), temporary_path)
+        os.replace(temporary_path, path)
+        self._trim_spill_dir()
+
+    def _trim_spill_dir(self) -> None:
+        """Delete the oldest spilled embeddings above the disk limit."""
+        spilled = []
+        for entry in os.scandir(self.spill_dir):
+            if entry.name.endswith(".pt"):
+                try:
+                    spilled.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+        if len(spilled) <= self.max_spill_entries:
+            return
+        spilled.sort()
+        for _, path in spilled[:len(spilled) - self.max_spill_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
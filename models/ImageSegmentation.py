@@ -1,13 +1,89 @@
 """The module containing the image segmentation class."""
 import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 import cv2
 import supervision as sv
+import torch
 from segment_anything import sam_model_registry, SamPredictor
 from ultralytics import YOLO
 
-from utils import check_and_download_files
+from models.DetectionBatcher import DetectionBatcher
+from models.EmbeddingCache import EmbeddingCache, SamEmbedding
+from models.SegmentationAnnotator import Segmentation, SegmentationAnnotator
+from models.SequenceTracking import SequenceTracker
+from utils import VideoKeyframes, check_and_download_files, decode_image, \
+    set_torch_threads
+from utils.metrics import DETECTIONS, IMAGES, SAM_BOXES, time_stage
+
+
+def load_detector(weights_path: str, backend: str = "torch") -> YOLO:
+    """
+    Load a YOLO model with the given backend.
+
+    For the ONNX backend the model is exported once to an ``.onnx`` file next
+    to its weights, with a dynamic batch and input size, and run through
+    ONNX Runtime with its graph optimizations enabled.
+
+    :param weights_path: The path of the PyTorch weights.
+    :type weights_path: str
+    :param backend: Either "torch" or "onnx".
+    :type backend: str
+    :return: The loaded model.
+    :rtype: ultralytics.YOLO
+    """
+    if backend == "torch":
+        return YOLO(weights_path)
+    if backend != "onnx":
+        raise ValueError(f"Unknown detector backend: {backend}")
+
+    onnx_path = os.path.splitext(weights_path)[0] + ".onnx"
+    if not os.path.exists(onnx_path):
+        # Ultralytics exports next to the weights it loads, so each process
+        # exports from its own copy of the weights and renames the result
+        # into place. Workers starting together never load a half-written
+        # file, and the rename within the directory is atomic.
+        export_dir = tempfile.mkdtemp(
+            prefix=".onnx-export-", dir=os.path.dirname(weights_path) or ".")
+        try:
+            weights_copy = shutil.copy(weights_path, export_dir)
+            exported_path = YOLO(weights_copy).export(
+                format="onnx", imgsz=480, dynamic=True, simplify=True)
+            os.replace(exported_path, onnx_path)
+        finally:
+            shutil.rmtree(export_dir, ignore_errors=True)
+    return YOLO(onnx_path)
+
+
+def load_sam(checkpoint_path: str, model_type: str = "vit_b",
+             device: str = "cpu", quantize: bool = False):
+    """
+    Load a SAM model.
+
+    When ``quantize`` is set, the linear layers of the image encoder are
+    dynamically quantized to INT8, which makes the encoder faster and
+    smaller on CPU at the cost of a small drop in mask quality.
+
+    :param checkpoint_path: The path of the SAM checkpoint.
+    :type checkpoint_path: str
+    :param model_type: The SAM model type of the checkpoint.
+    :type model_type: str
+    :param device: The device to load the model on.
+    :type device: str
+    :param quantize: Whether to quantize the image encoder.
+    :type quantize: bool
+    :return: The loaded model.
+    :rtype: segment_anything.modeling.Sam
+    """
+    sam = sam_model_registry[model_type](checkpoint=checkpoint_path).to(device)
+    if quantize:
+        sam.image_encoder = torch.ao.quantization.quantize_dynamic(
+            sam.image_encoder, {torch.nn.Linear}, dtype=torch.qint8)
+    return sam
 
 
 class ImageSegmentation:
@@ -15,88 +91,562 @@ class ImageSegmentation:
     The ImageSegmentation class is responsible for segmenting the image.
     The class uses the YOLO model to detect the clothing items in the image.
     The detected clothing items are then segmented using the SAM model.
+
+    A single instance is shared by all request threads (see
+    :class:`models.ModelRegistry`), so every model call is guarded by a lock
+    owned by that model. Concurrent calls to the YOLO models can be
+    micro-batched by setting ``detection_batch_size`` above 1.
+
+    The garment detector, the person detector and the SAM image encoder only
+    depend on the input image, so they run as concurrent stages on a thread
+    pool and are joined for the mask prediction and the annotation. The
+    embeddings of the encoder are cached, so identical frames skip it.
+
+    The person detector and SAM are only loaded when they are first used, so
+    a process that only calls :meth:`detect_labels` never loads them.
     """
 
-    def __init__(self):
-        """Initialize the ImageSegmentation class."""
+    def __init__(self, detection_batch_size: int = 1,
+                 detection_batch_wait_ms: float = 0.0,
+                 stage_threads: int = 1, torch_threads: int = None,
+                 embedding_cache_size: int = 16,
+                 embedding_cache_dir: str = None,
+                 embedding_cache_disk_size: int = 256,
+                 detector_backend: str = "torch",
+                 quantize_sam: bool = False,
+                 decode_max_side: int = None, max_pixels: int = None,
+                 cascade: bool = False, cascade_padding: float = 0.1):
+        """
+        Initialize the ImageSegmentation class.
+
+        :param detection_batch_size: The maximum number of concurrent images
+            run through each YOLO model as one batch.
+        :type detection_batch_size: int
+        :param detection_batch_wait_ms: The longest time a detection waits
+            for its batch to fill up.
+        :type detection_batch_wait_ms: float
+        :param stage_threads: The number of segmentation stages run at the
+            same time, 1 to run them one after another. The torch threads
+            are divided between them for every inference of the process,
+            also the labels-only, cascade, sequence and classifier paths
+            that run one stage at a time.
+        :type stage_threads: int
+        :param torch_threads: The intra-op threads used by torch. Defaults to
+            the CPU cores of the process, or of its slot when the cores are
+            partitioned, divided by the stage threads, so the concurrent
+            stages do not oversubscribe the cores.
+        :type torch_threads: int
+        :param embedding_cache_size: The number of SAM embeddings cached in
+            memory, 0 to disable the cache.
+        :type embedding_cache_size: int
+        :param embedding_cache_dir: The directory where embeddings evicted
+            from memory are kept, or None to drop them.
+        :type embedding_cache_dir: str
+        :param embedding_cache_disk_size: The number of SAM embeddings kept
+            in the cache directory.
+        :type embedding_cache_disk_size: int
+        :param detector_backend: The backend running the YOLO models, either
+            "torch" or "onnx" for ONNX Runtime.
+        :type detector_backend: str
+        :param quantize_sam: Whether to quantize the SAM image encoder to
+            INT8.
+        :type quantize_sam: bool
+        :param decode_max_side: The smallest long side large images are
+            decoded at, or None to decode them at full size.
+        :type decode_max_side: int
+        :param max_pixels: The largest number of pixels of an accepted
+            image, or None for no limit.
+        :type max_pixels: int
+        :param cascade: Whether to run the person detector first and the
+            garment detector and SAM only on the regions of the persons.
+        :type cascade: bool
+        :param cascade_padding: The padding added around each person box in
+            the cascade, as a fraction of the box size.
+        :type cascade_padding: float
+        """
+        set_torch_threads(stage_threads, torch_threads)
         self.model_base_path = "models/weights/"
         check_and_download_files(self.model_base_path)
-        self.model = YOLO(os.path.join(self.model_base_path, "best.pt"))
-        self.pp_model = YOLO(os.path.join(self.model_base_path, "yolov9c.pt"))
+        self.detector_backend = detector_backend
+        self.detection_batch_size = detection_batch_size
+        self.detection_batch_wait_ms = detection_batch_wait_ms
+        self.model = load_detector(
+            os.path.join(self.model_base_path, "best.pt"), detector_backend)
         self.device = "cpu"
         self.checkpoint_path = os.path.join(self.model_base_path,
                                             "sam_vit_b_01ec64.pth")
         self.model_type = "vit_b"
-        self.sam = sam_model_registry[self.model_type](
-            checkpoint=self.checkpoint_path).to(self.device)
-        self.mask_predictor = SamPredictor(self.sam)
-        self.box_annotator = sv.BoundingBoxAnnotator(
-            color=sv.Color.YELLOW,
-            color_lookup=sv.ColorLookup.INDEX)
-        self.mask_annotator = sv.MaskAnnotator(
-            color_lookup=sv.ColorLookup.INDEX)
-        self.label_annotator = sv.LabelAnnotator(
-            text_position=sv.Position.CENTER,
-            color_lookup=sv.ColorLookup.INDEX)
-        self.corner_annotator = sv.BoxCornerAnnotator(color=sv.Color.GREEN)
-
-
-    def segment_image(self, image_path: str) -> tuple:
+        self.quantize_sam = quantize_sam
+        self.decode_max_side = decode_max_side
+        self.max_pixels = max_pixels
+        self.cascade = cascade
+        self.cascade_padding = cascade_padding
+        self._load_lock = threading.Lock()
+        self._pp_detector = None
+        self._mask_predictor = None
+        self.annotator = SegmentationAnnotator()
+        self.detector = DetectionBatcher(self.model, detection_batch_size,
+                                         detection_batch_wait_ms)
+        self._sam_lock = threading.Lock()
+        self.embedding_cache = None
+        if embedding_cache_size > 0:
+            self.embedding_cache = EmbeddingCache(embedding_cache_size,
+                                                  embedding_cache_dir,
+                                                  embedding_cache_disk_size)
+        self.stage_executor = None
+        if stage_threads > 1:
+            self.stage_executor = ThreadPoolExecutor(
+                max_workers=stage_threads,
+                thread_name_prefix="segmentation-stage")
+
+    @property
+    def pp_detector(self) -> DetectionBatcher:
+        """Get the person detector, loading it on first use."""
+        if self._pp_detector is None:
+            with self._load_lock:
+                if self._pp_detector is None:
+                    pp_model = load_detector(
+                        os.path.join(self.model_base_path, "yolov9c.pt"),
+                        self.detector_backend)
+                    self._pp_detector = DetectionBatcher(
+                        pp_model, self.detection_batch_size,
+                        self.detection_batch_wait_ms)
+        return self._pp_detector
+
+    @property
+    def pp_model(self) -> YOLO:
+        """Get the person detection model, loading it on first use."""
+        return self.pp_detector.model
+
+    @property
+    def mask_predictor(self) -> SamPredictor:
+        """Get the SAM predictor, loading SAM on first use."""
+        if self._mask_predictor is None:
+            with self._load_lock:
+                if self._mask_predictor is None:
+                    sam = load_sam(self.checkpoint_path, self.model_type,
+                                   self.device, self.quantize_sam)
+                    self._mask_predictor = SamPredictor(sam)
+        return self._mask_predictor
+
+    @property
+    def sam(self):
+        """Get the SAM model, loading it on first use."""
+        return self.mask_predictor.model
+
+    def decode(self, image) -> np.ndarray:
+        """
+        Decode the image within the pixel budget of the segmentation.
+
+        :param image: The encoded image bytes, the path of the image or the
+            image itself as a BGR array.
+        :type image: bytes or str or numpy.ndarray
+        :return: The decoded image.
+        :rtype: numpy.ndarray
+        :raises utils.ImageTooLargeError: If the image has more pixels than
+            allowed.
+        """
+        if isinstance(image, np.ndarray):
+            return image
+        with time_stage("decode"):
+            return decode_image(image, self.decode_max_side, self.max_pixels)
+
+    def detect_labels(self, image, imgsz: int = 480) -> list:
+        """
+        Detect the clothing labels of the image without segmenting it.
+
+        Only the garment detector runs: the person detector, SAM and the
+        annotators are skipped.
+
+        :param image: The encoded image bytes, the path of the image or the
+            image itself as a BGR array.
+        :type image: bytes or str or numpy.ndarray
+        :param imgsz: The inference size of the garment detector.
+        :type imgsz: int
+        :return: The upper and lower labels of every detected item.
+        :rtype: list[tuple]
+        """
+        image = self.decode(image)
+        result = self._detect_garments(image, imgsz)
+        detections = sv.Detections.from_ultralytics(result).with_nms(
+            threshold=0.1)
+        labels: list = self._extract_labels(result, detections)
+        IMAGES.inc()
+        DETECTIONS.inc(len(labels))
+        return [self._determine_type(label) for label in labels]
+
+    def segment_image(self, image, imgsz: int = 480) -> tuple:
         """
         Segment the image using the YOLO model.
 
-        :param image_path: The path of the image to segment.
-        :type image_path: str
+        The image is decoded once and the same array is used by both
+        detectors, SAM and the annotators.
+
+        :param image: The encoded image bytes, the path of the image or the
+            image itself as a BGR array.
+        :type image: bytes or str or numpy.ndarray
+        :param imgsz: The inference size of the detectors.
+        :type imgsz: int
         :return: The annotated image and labels.
         :rtype: tuple(numpy.ndarray, list)
         """
-        results = self.model(image_path, imgsz=480)
-        pp_results = self.pp_model(image_path, imgsz=480)
-        annotated_image = None
-        all_labels = []
-
-        for i, pr in enumerate(pp_results):
-            annotated_image = cv2.imread(image_path)
-            self.mask_predictor.set_image(annotated_image)
-
-            pp_detections = sv.Detections.from_ultralytics(pr)
-            pp_detections = pp_detections[pp_detections.class_id == 0]
-            annotated_image = self.corner_annotator.annotate(annotated_image,
-                                                             pp_detections)
-
-            for box in pr.boxes:
-                input_box = np.array(box.xyxy.tolist()[0])
-                masks, _, _ = self.mask_predictor.predict(
-                    point_coords=None,
-                    point_labels=None,
-                    box=input_box[None, :],
-                    multimask_output=False,
-                )
-
-                pp_detections = sv.Detections(
-                    xyxy=sv.mask_to_xyxy(masks=masks),
-                    mask=masks,
-                    class_id=np.array(box.cls.tolist()),
-                    confidence=np.array(box.conf.tolist())
-                ).with_nms(threshold=0.1)
-                pp_detections = pp_detections[pp_detections.class_id == 0]
-                annotated_image = self.mask_annotator.annotate(
-                    scene=annotated_image, detections=pp_detections)
-
-            result = results[i]
+        segmentation = self.detect(image, imgsz)
+        annotated_image = self.annotator.annotate(segmentation.image,
+                                                  segmentation)
+        return annotated_image, segmentation.labels
+
+    def detect(self, image, imgsz: int = 480) -> Segmentation:
+        """
+        Detect the clothing items and segment the persons of the image.
+
+        Unlike :meth:`segment_image`, the annotated image is not rendered;
+        it can be rendered later with :class:`SegmentationAnnotator`. In the
+        cascade mode, see :meth:`_detect_cascade`.
+
+        :param image: The encoded image bytes, the path of the image or the
+            image itself as a BGR array.
+        :type image: bytes or str or numpy.ndarray
+        :param imgsz: The inference size of the detectors.
+        :type imgsz: int
+        :return: The segmentation of the image.
+        :rtype: Segmentation
+        """
+        image = self.decode(image)
+        if self.cascade:
+            segmentation = self._detect_cascade(image, imgsz)
+        else:
+            segmentation = self._detect_full(image, imgsz)
+        IMAGES.inc()
+        DETECTIONS.inc(len(segmentation.labels))
+        return segmentation
+
+    def _detect_full(self, image: np.ndarray,
+                     imgsz: int = 480) -> Segmentation:
+        """
+        Run both detectors and the SAM image encoder on the whole image.
+
+        :param image: The decoded image.
+        :type image: numpy.ndarray
+        :param imgsz: The inference size of the detectors.
+        :type imgsz: int
+        :return: The segmentation of the image.
+        :rtype: Segmentation
+        """
+        result, pr, embedding = self._run_stages(
+            (self._detect_garments, image, imgsz),
+            (self._detect_persons, image, imgsz),
+            (self._embed_image, image))
+
+        person_detections = self._segment_persons(pr, embedding)
+
+        detections = sv.Detections.from_ultralytics(result).with_nms(
+            threshold=0.1)
+
+        label_names: list = self._extract_labels(result, detections)
+
+        labels = [self._determine_type(label) for label in label_names]
+        return Segmentation(labels, label_names, detections,
+                            person_detections, image)
+
+    def track_sequence(self, frames, imgsz: int = 480,
+                       keyframe_interval: int = 1,
+                       max_frames: int = None,
+                       frame_rate: float = 30.0) -> list:
+        """
+        Track the persons of a video or a burst of frames and their clothes.
+
+        The person detector runs on every frame and ByteTrack follows the
+        persons from frame to frame. The garment detector only runs on the
+        keyframes, and SAM only on the frames where a new person appears,
+        for the new persons.
+
+        :param frames: The encoded video, or the encoded frames.
+        :type frames: bytes or list[bytes]
+        :param imgsz: The inference size of the detectors.
+        :type imgsz: int
+        :param keyframe_interval: The number of frames between keyframes.
+        :type keyframe_interval: int
+        :param max_frames: The number of frames of a video read at most.
+        :type max_frames: int
+        :param frame_rate: The frame rate of the burst of frames. A video
+            uses the frame rate it is encoded with.
+        :type frame_rate: float
+        :return: The tracked persons, with their clothing labels.
+        :rtype: list[models.Track]
+        """
+        keyframe_interval = max(1, keyframe_interval)
+        if isinstance(frames, bytes):
+            video = VideoKeyframes(frames, 1, max_frames,
+                                   self.decode_max_side, self.max_pixels)
+            frame_rate = video.frame_rate
+            frames = (frame for _, frame in video)
+        tracker = SequenceTracker(max(1, round(frame_rate)))
+
+        for frame_index, frame in enumerate(frames):
+            frame = self.decode(frame)
+            is_keyframe = frame_index % keyframe_interval == 0
+            if is_keyframe:
+                result, pr = self._run_stages(
+                    (self._detect_garments, frame, imgsz),
+                    (self._detect_persons, frame, imgsz))
+            else:
+                pr = self._detect_persons(frame, imgsz)
+            new_persons = tracker.update(frame_index,
+                                         self._person_detections(pr))
+            if len(new_persons):
+                tracker.set_masks(new_persons, self._predict_masks(
+                    self._embed_image(frame), new_persons.xyxy))
+            if not is_keyframe:
+                continue
+
             detections = sv.Detections.from_ultralytics(result).with_nms(
                 threshold=0.1)
+            label_names: list = self._extract_labels(result, detections)
+            tracker.assign_garments(
+                detections, label_names,
+                [self._determine_type(label) for label in label_names])
+        return tracker.tracks()
+
+    def _detect_cascade(self, image: np.ndarray,
+                        imgsz: int = 480) -> Segmentation:
+        """
+        Detect the persons first and the rest only around them.
+
+        Without any person, nothing else runs. Otherwise the garment
+        detector runs once on the batch of the padded crops of the persons,
+        and SAM encodes a
+        single crop covering all of them, so the empty parts of the frame
+        are never processed. The results are mapped back to the frame.
+
+        :param image: The decoded image.
+        :type image: numpy.ndarray
+        :param imgsz: The inference size of the detectors.
+        :type imgsz: int
+        :return: The segmentation of the image.
+        :rtype: Segmentation
+        """
+        pp_detections = self._person_detections(
+            self._detect_persons(image, imgsz))
+        if len(pp_detections) == 0:
+            return Segmentation([], [], sv.Detections.empty(), pp_detections,
+                                image)
+
+        crops = self._pad_boxes(pp_detections.xyxy, image.shape)
+        x0, y0 = crops[:, :2].min(axis=0)
+        x1, y1 = crops[:, 2:].max(axis=0)
+        results, embedding = self._run_stages(
+            (self._detect_garment_crops,
+             [np.ascontiguousarray(image[cy0:cy1, cx0:cx1])
+              for cx0, cy0, cx1, cy1 in crops], imgsz),
+            (self._embed_image, np.ascontiguousarray(image[y0:y1, x0:x1])))
 
-            labels: list = self._extract_labels(result, detections)
+        crop_masks = self._predict_masks(
+            embedding, pp_detections.xyxy - np.array([x0, y0, x0, y0]))
+        masks = np.zeros((len(crop_masks), *image.shape[:2]), dtype=bool)
+        masks[:, y0:y1, x0:x1] = crop_masks
+        pp_detections.mask = masks
 
-            all_labels += [self._determine_type(label) for label in labels]
-            annotated_image = self.box_annotator.annotate(
-                scene=annotated_image, detections=detections)
-            annotated_image = self.label_annotator.annotate(
-                scene=annotated_image, detections=detections,
-                labels=[str(label) for label in labels])
+        detections = sv.Detections.merge([
+            self._to_frame(sv.Detections.from_ultralytics(result), crop,
+                           image.shape)
+            for result, crop in zip(results, crops)]).with_nms(threshold=0.1)
 
-        return annotated_image, all_labels
+        label_names: list = self._extract_labels(results[0], detections)
+
+        labels = [self._determine_type(label) for label in label_names]
+        return Segmentation(labels, label_names, detections, pp_detections,
+                            image)
+
+    def _pad_boxes(self, boxes: np.ndarray, shape: tuple) -> np.ndarray:
+        """
+        Pad the boxes by the cascade padding, within the image.
+
+        :param boxes: The boxes in xyxy format, with shape (N, 4).
+        :type boxes: numpy.ndarray
+        :param shape: The shape of the image.
+        :type shape: tuple
+        :return: The padded boxes, as integer pixel coordinates.
+        :rtype: numpy.ndarray
+        """
+        sizes = boxes[:, 2:] - boxes[:, :2]
+        padding = np.tile(sizes * self.cascade_padding, 2)
+        padded = boxes + padding * np.array([-1, -1, 1, 1])
+        height, width = shape[:2]
+        padded = np.clip(padded, 0, [width, height, width, height])
+        return np.concatenate([np.floor(padded[:, :2]),
+                               np.ceil(padded[:, 2:])], axis=1).astype(int)
+
+    def _to_frame(self, detections: sv.Detections, crop: np.ndarray,
+                  shape: tuple) -> sv.Detections:
+        """
+        Map the detections of a crop back to the coordinates of the image.
+
+        :param detections: The detections in the crop.
+        :type detections: sv.Detections
+        :param crop: The crop in xyxy format.
+        :type crop: numpy.ndarray
+        :param shape: The shape of the image.
+        :type shape: tuple
+        :return: The detections in the image.
+        :rtype: sv.Detections
+        """
+        x0, y0, x1, y1 = crop
+        detections.xyxy = detections.xyxy + np.array([x0, y0, x0, y0])
+        if detections.mask is not None:
+            masks = np.zeros((len(detections), *shape[:2]), dtype=bool)
+            masks[:, y0:y1, x0:x1] = detections.mask
+            detections.mask = masks
+        return detections
+
+    def _detect_garments(self, image: np.ndarray, imgsz: int = 480):
+        """
+        Run the garment detector on the image.
+
+        :param image: The decoded image.
+        :type image: numpy.ndarray
+        :param imgsz: The inference size of the detector.
+        :type imgsz: int
+        :return: The YOLO result of the garment detector.
+        :rtype: YOLO.Results
+        """
+        with time_stage("garment_detection"):
+            return self.detector.predict(image, imgsz)
+
+    def _detect_garment_crops(self, crops: list, imgsz: int = 480) -> list:
+        """
+        Run the garment detector on the crops in a single batched call.
+
+        :param crops: The cropped images.
+        :type crops: list[numpy.ndarray]
+        :param imgsz: The inference size of the detector.
+        :type imgsz: int
+        :return: The YOLO result of every crop.
+        :rtype: list[YOLO.Results]
+        """
+        with time_stage("garment_detection"):
+            return self.detector.predict_batch(crops, imgsz)
+
+    def _detect_persons(self, image: np.ndarray, imgsz: int = 480):
+        """
+        Run the person detector on the image.
+
+        :param image: The decoded image.
+        :type image: numpy.ndarray
+        :param imgsz: The inference size of the detector.
+        :type imgsz: int
+        :return: The YOLO result of the person detector.
+        :rtype: YOLO.Results
+        """
+        with time_stage("person_detection"):
+            return self.pp_detector.predict(image, imgsz)
+
+    def _run_stages(self, *stages) -> list:
+        """
+        Run independent stages, concurrently when a stage pool is available.
+
+        :param stages: The stages as tuples of a function and its arguments.
+        :type stages: tuple
+        :return: The results of the stages, in the order they were given.
+        :rtype: list
+        """
+        if self.stage_executor is None:
+            return [function(*args) for function, *args in stages]
+        futures = [self.stage_executor.submit(function, *args)
+                   for function, *args in stages]
+        return [future.result() for future in futures]
+
+    def _embed_image(self, image: np.ndarray) -> SamEmbedding:
+        """
+        Run the SAM image encoder on the image, unless it is cached.
+
+        :param image: The image to encode.
+        :type image: numpy.ndarray
+        :return: The image embedding and the sizes needed to decode masks.
+        :rtype: SamEmbedding
+        """
+        key = None
+        if self.embedding_cache is not None:
+            key = self.embedding_cache.key(
+                image, self.sam.image_encoder.img_size,
+                "int8" if self.quantize_sam else "fp32")
+            embedding = self.embedding_cache.get(key)
+            if embedding is not None:
+                return embedding
+
+        with self._sam_lock, time_stage("sam_embedding"):
+            self.mask_predictor.set_image(image)
+            embedding = SamEmbedding(self.mask_predictor.features,
+                                     self.mask_predictor.original_size,
+                                     self.mask_predictor.input_size)
+        if key is not None:
+            self.embedding_cache.put(key, embedding)
+        return embedding
+
+    def _segment_persons(self, pr,
+                         embedding: SamEmbedding) -> sv.Detections:
+        """
+        Segment the detected persons with SAM.
+
+        :param pr: The YOLO result of the person detector.
+        :type pr: YOLO.Results
+        :param embedding: The SAM embedding of the image.
+        :type embedding: SamEmbedding
+        :return: The person detections, with their masks.
+        :rtype: supervision.Detections
+        """
+        pp_detections = self._person_detections(pr)
+        if len(pp_detections) == 0:
+            return pp_detections
+
+        pp_detections.mask = self._predict_masks(embedding,
+                                                 pp_detections.xyxy)
+        return pp_detections
+
+    def _person_detections(self, pr) -> sv.Detections:
+        """
+        Get the person detections of the person detector.
+
+        :param pr: The YOLO result of the person detector.
+        :type pr: YOLO.Results
+        :return: The detections of the person class.
+        :rtype: supervision.Detections
+        """
+        pp_detections = sv.Detections.from_ultralytics(pr)
+        return pp_detections[pp_detections.class_id == 0]
+
+    def _predict_masks(self, embedding: SamEmbedding,
+                       boxes: np.ndarray) -> np.ndarray:
+        """
+        Predict a SAM mask for every box of an image in one call.
+
+        The boxes are transformed to the input frame of SAM and decoded as a
+        single batch, instead of running the mask decoder once per box.
+
+        :param embedding: The SAM embedding of the image.
+        :type embedding: SamEmbedding
+        :param boxes: The boxes in xyxy format, with shape (N, 4).
+        :type boxes: numpy.ndarray
+        :return: The masks of the boxes, with shape (N, H, W).
+        :rtype: numpy.ndarray
+        """
+        SAM_BOXES.inc(len(boxes))
+        with self._sam_lock, time_stage("sam_decoding"):
+            predictor = self.mask_predictor
+            predictor.features = embedding.features
+            predictor.original_size = embedding.original_size
+            predictor.input_size = embedding.input_size
+            predictor.is_image_set = True
+            input_boxes = torch.as_tensor(boxes, dtype=torch.float,
+                                          device=predictor.device)
+            transformed_boxes = predictor.transform.apply_boxes_torch(
+                input_boxes, embedding.original_size)
+            masks, _, _ = predictor.predict_torch(
+                point_coords=None,
+                point_labels=None,
+                boxes=transformed_boxes,
+                multimask_output=False,
+            )
+        return masks[:, 0].cpu().numpy()
 
     def _extract_labels(self, result,
                         detections: sv.Detections) -> list:
@@ -0,0 +1,380 @@
+"""The module containing the pool of inference worker processes."""
+import itertools
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from models.ModelRegistry import get_model_registry
+from utils.cpu_scheduler import apply_cpu_slot, set_torch_threads
+from utils.metrics import get_metrics_registry
+
+
+class InferenceTimeoutError(Exception):
+    """Raised when an inference job does not start or finish in time."""
+
+
+# The queue where a worker reports the jobs it starts, set by the initializer.
+_started_jobs = None
+
+
+def _initialize_worker(labels_only: bool, cpu_scheduler: dict,
+                       started_jobs=None) -> None:
+    """Load and warm up the models owned by an inference worker."""
+    global _started_jobs
+    _started_jobs = started_jobs
+    if cpu_scheduler:
+        from django.conf import settings
+        apply_cpu_slot(**cpu_scheduler)
+        # A forked worker may inherit a torch set up for the whole host.
+        set_torch_threads(settings.IMAGE_SEGMENTATION["stage_threads"],
+                          settings.IMAGE_SEGMENTATION["torch_threads"])
+    get_model_registry().warm_up(labels_only)
+    # The timings of the warm-up would skew the metrics of the first job.
+    get_metrics_registry().drain()
+
+
+def _run_job(job_id: int, start_deadline: float, function, *args) -> tuple:
+    """
+    Run a job and send the metrics it recorded back with its result.
+
+    The worker reports the job when it starts, so the caller times the job
+    from there. A job picked up after its start deadline was already given
+    up by the caller and is skipped.
+    """
+    if start_deadline is not None and time.time() > start_deadline:
+        return None, {}
+    if _started_jobs is not None:
+        _started_jobs.put((job_id, os.getpid()))
+    return function(*args), get_metrics_registry().drain()
+
+
+class _Job:
+    """A job sent to the workers, waiting for a worker to start it."""
+
+    __slots__ = ("started", "pid", "started_at")
+
+    def __init__(self):
+        """Initialize the _Job class."""
+        self.started = threading.Event()
+        self.pid = None
+        self.started_at = None
+
+
+def _ping() -> bool:
+    """Return once the worker running this job is ready."""
+    return True
+
+
+def _detect_labels(image, imgsz: int = 480) -> list:
+    """Detect the clothing labels with the models of the current worker."""
+    segmentation = get_model_registry().get_segmentation()
+    return segmentation.detect_labels(image, imgsz)
+
+
+def _detect(image, imgsz: int = 480):
+    """Segment the image with the models of the current worker."""
+    segmentation = get_model_registry().get_segmentation()
+    return segmentation.detect(image, imgsz)
+
+
+def _segment_image(image, imgsz: int = 480) -> tuple:
+    """Segment the image with the models of the current worker."""
+    segmentation = get_model_registry().get_segmentation()
+    return segmentation.segment_image(image, imgsz)
+
+
+def _track_sequence(frames, imgsz: int = 480, keyframe_interval: int = 1,
+                    max_frames: int = None, frame_rate: float = 30.0) -> list:
+    """Track a frame sequence with the models of the current worker."""
+    segmentation = get_model_registry().get_segmentation()
+    return segmentation.track_sequence(frames, imgsz, keyframe_interval,
+                                       max_frames, frame_rate)
+
+
+def _predict_comfort_level(labels: list, local_temp: float,
+                           local_humid: float) -> list:
+    """Predict the comfort level with the classifier of the worker."""
+    classifier = get_model_registry().get_classifier()
+    return classifier.predict_comfort_level(labels, local_temp, local_humid)
+
+
+class InferencePool:
+    """
+    A pool of long-lived processes that run the inference models.
+
+    Every worker process owns its own ImageSegmentation and
+    ComfortClassifier, loaded once when the worker starts. Jobs are sent to
+    the workers over the pool's local queues and the caller waits for the
+    result with a timeout, so the number of HTTP workers and the number of
+    inference workers can be sized separately.
+
+    The timeout counts from the moment a worker starts the job, so a job
+    waiting behind busy workers is not timed out; it waits at most
+    ``queue_timeout`` for a free worker instead. Only the worker running a
+    job that overruns its timeout is stopped, and the pool replaces it.
+
+    A pool of size 0 runs the inference in the calling process with the
+    models of the process-wide registry.
+    """
+
+    def __init__(self, size: int = 0, timeout: float = None,
+                 start_method: str = "fork", labels_only: bool = False,
+                 cpu_scheduler: dict = None, queue_timeout: float = None):
+        """
+        Initialize the InferencePool class.
+
+        :param size: The number of worker processes, 0 to run in-process.
+        :type size: int
+        :param timeout: The seconds a job may run, None to wait forever.
+        :type timeout: float
+        :param start_method: The multiprocessing start method of the workers.
+        :type start_method: str
+        :param labels_only: Whether the workers only warm up the models used
+            by labels-only predictions.
+        :type labels_only: bool
+        :param cpu_scheduler: The options of utils.apply_cpu_slot giving
+            every worker its own slot of CPU cores, or None to share all
+            the cores.
+        :type cpu_scheduler: dict
+        :param queue_timeout: The seconds a job waits for a free worker, by
+            default the timeout.
+        :type queue_timeout: float
+        """
+        self.size = size
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout if queue_timeout is not None \
+            else timeout
+        self.start_method = start_method
+        self.labels_only = labels_only
+        self.cpu_scheduler = cpu_scheduler
+        self._lock = threading.Lock()
+        self._pool = None
+        self._started_jobs = None
+        self._jobs = {}
+        self._job_ids = itertools.count()
+
+    def detect_labels(self, image, imgsz: int = 480) -> list:
+        """
+        Detect the clothing labels of the image in an inference worker.
+
+        :param image: The encoded image bytes, the path of the image or the
+            decoded image.
+        :type image: bytes or str or numpy.ndarray
+        :param imgsz: The inference size of the detectors.
+        :type imgsz: int
+        :return: The upper and lower labels of every detected item.
+        :rtype: list[tuple]
+        """
+        return self._run(_detect_labels, image, imgsz)
+
+    def detect(self, image, imgsz: int = 480):
+        """
+        Segment the image in an inference worker without rendering it.
+
+        :param image: The encoded image bytes, the path of the image or the
+            decoded image.
+        :type image: bytes or str or numpy.ndarray
+        :param imgsz: The inference size of the detectors.
+        :type imgsz: int
+        :return: The segmentation of the image.
+        :rtype: models.Segmentation
+        """
+        return self._run(_detect, image, imgsz)
+
+    def segment_image(self, image, imgsz: int = 480) -> tuple:
+        """
+        Segment the image in an inference worker.
+
+        :param image: The encoded image bytes, the path of the image or the
+            decoded image. Sending the encoded bytes keeps the job small.
+        :type image: bytes or str or numpy.ndarray
+        :param imgsz: The inference size of the detectors.
+        :type imgsz: int
+        :return: The annotated image and labels.
+        :rtype: tuple(numpy.ndarray, list)
+        """
+        return self._run(_segment_image, image, imgsz)
+
+    def track_sequence(self, frames, imgsz: int = 480,
+                       keyframe_interval: int = 1,
+                       max_frames: int = None,
+                       frame_rate: float = 30.0) -> list:
+        """
+        Track the persons of a frame sequence in an inference worker.
+
+        :param frames: The encoded video, or the encoded frames.
+        :type frames: bytes or list[bytes]
+        :param imgsz: The inference size of the detectors.
+        :type imgsz: int
+        :param keyframe_interval: The number of frames between keyframes.
+        :type keyframe_interval: int
+        :param max_frames: The number of frames of a video read at most.
+        :type max_frames: int
+        :param frame_rate: The frame rate of the burst of frames. A video
+            uses the frame rate it is encoded with.
+        :type frame_rate: float
+        :return: The tracked persons, with their clothing labels.
+        :rtype: list[models.Track]
+        """
+        return self._run(_track_sequence, frames, imgsz, keyframe_interval,
+                         max_frames, frame_rate)
+
+    def predict_comfort_level(self, labels: list, local_temp: float,
+                              local_humid: float) -> list:
+        """
+        Predict the comfort level in an inference worker.
+
+        :param labels: A list of tuples containing the upper and lower labels.
+        :type labels: list[tuple]
+        :param local_temp: The local temperature.
+        :type local_temp: float
+        :param local_humid: The local humidity.
+        :type local_humid: float
+        :return: The predicted comfort levels.
+        :rtype: list
+        """
+        return self._run(_predict_comfort_level, labels, local_temp,
+                         local_humid)
+
+    def warm_up(self) -> None:
+        """Start the workers and wait until they have loaded their models."""
+        if not self.size:
+            get_model_registry().warm_up(self.labels_only)
+            return
+        pool = self._get_pool()
+        results = [pool.apply_async(_ping) for _ in range(self.size)]
+        for result in results:
+            result.get()
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            started_jobs, self._started_jobs = self._started_jobs, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+            # Stop the thread following the started jobs.
+            started_jobs.put(None)
+
+    def _run(self, function, *args):
+        """
+        Run the function in a worker and wait for its result.
+
+        The metrics the worker recorded while running the function are
+        merged into the metrics of the current process. A job that does not
+        start within the queue timeout is given up, and the worker skips it
+        once it gets to it. A job that runs longer than the timeout cannot
+        be cancelled, so the worker running it is stopped and replaced; the
+        jobs of the other workers keep running.
+
+        :param function: The module-level function to run.
+        :type function: callable
+        :return: The result of the function.
+        :raises InferenceTimeoutError: If no worker starts the job within
+            the queue timeout, or the job takes longer than the timeout.
+        """
+        if not self.size:
+            return function(*args)
+        pool = self._get_pool()
+        job_id = next(self._job_ids)
+        job = _Job()
+        self._jobs[job_id] = job
+        try:
+            start_deadline = None
+            if self.queue_timeout is not None:
+                start_deadline = time.time() + self.queue_timeout
+            result = pool.apply_async(
+                _run_job, (job_id, start_deadline, function, *args))
+            if not job.started.wait(self.queue_timeout):
+                raise InferenceTimeoutError(
+                    "No inference worker was free within "
+                    f"{self.queue_timeout} seconds.")
+            remaining = None
+            if self.timeout is not None:
+                remaining = max(
+                    0, job.started_at + self.timeout - time.monotonic())
+            try:
+                output, metrics = result.get(remaining)
+            except multiprocessing.TimeoutError:
+                self._stop_worker(job.pid)
+                raise InferenceTimeoutError(
+                    f"Inference did not finish within {self.timeout} "
+                    "seconds.")
+        finally:
+            self._jobs.pop(job_id, None)
+        get_metrics_registry().merge(metrics)
+        return output
+
+    def _get_pool(self):
+        """Get the process pool, creating it if necessary."""
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context(self.start_method)
+                self._started_jobs = context.SimpleQueue()
+                self._pool = context.Pool(
+                    self.size, initializer=_initialize_worker,
+                    initargs=(self.labels_only, self.cpu_scheduler,
+                              self._started_jobs))
+                threading.Thread(target=self._follow_started_jobs,
+                                 args=(self._started_jobs,),
+                                 name="inference-started-jobs",
+                                 daemon=True).start()
+            return self._pool
+
+    def _follow_started_jobs(self, started_jobs) -> None:
+        """
+        Record when and where the workers start the jobs.
+
+        :param started_jobs: The queue the workers report their jobs to.
+        :type started_jobs: multiprocessing.SimpleQueue
+        """
+        while (started := started_jobs.get()) is not None:
+            job_id, pid = started
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.pid = pid
+                job.started_at = time.monotonic()
+                job.started.set()
+
+    def _stop_worker(self, pid: int) -> None:
+        """
+        Stop a worker process; the pool starts a new one in its place.
+
+        :param pid: The process id of the worker.
+        :type pid: int
+        """
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            # The worker already exited.
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_inference_pool() -> InferencePool:
+    """
+    Get the process-wide inference pool configured from the settings.
+
+    :return: The inference pool shared by the whole process.
+    :rtype: InferencePool
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from django.conf import settings
+                _pool = InferencePool(
+                    size=settings.INFERENCE_POOL_SIZE,
+                    timeout=settings.INFERENCE_TIMEOUT,
+                    start_method=settings.INFERENCE_POOL_START_METHOD,
+                    labels_only=settings.MODEL_WARMUP_MODE == "labels",
+                    cpu_scheduler=settings.CPU_SCHEDULER
+                    if settings.CPU_SCHEDULER["slots"] else None,
+                    queue_timeout=settings.INFERENCE_QUEUE_TIMEOUT)
+    return _pool
@@ -0,0 +1,133 @@
+"""The module containing the process-wide registry of loaded models."""
+import threading
+
+import numpy as np
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of loaded inference models.
+
+    Loading the YOLO, SAM and comfort classifier weights takes seconds, so
+    the models are loaded once per process and the same instances are shared
+    by every request thread. Use :func:`get_model_registry` to obtain the
+    registry instead of constructing the models directly.
+    """
+
+    def __init__(self):
+        """Initialize the ModelRegistry class."""
+        # Reentrant, so a warm-up holding it can load the models.
+        self._lock = threading.RLock()
+        self._segmentation = None
+        self._classifier = None
+        # The modes already warmed up: "labels" and "full".
+        self._warmed_up = set()
+
+    def get_segmentation(self):
+        """
+        Get the shared ImageSegmentation instance, loading it if necessary.
+
+        :return: The shared image segmentation model.
+        :rtype: models.ImageSegmentation
+        """
+        if self._segmentation is None:
+            with self._lock:
+                if self._segmentation is None:
+                    from django.conf import settings
+                    from models.ImageSegmentation import ImageSegmentation
+                    self._segmentation = ImageSegmentation(
+                        **settings.IMAGE_SEGMENTATION)
+        return self._segmentation
+
+    def get_classifier(self):
+        """
+        Get the shared ComfortClassifier instance, loading it if necessary.
+
+        :return: The shared comfort classifier.
+        :rtype: models.ComfortClassifier
+        """
+        if self._classifier is None:
+            with self._lock:
+                if self._classifier is None:
+                    from models.ComfortClassifier import ComfortClassifier
+                    self._classifier = ComfortClassifier()
+        return self._classifier
+
+    def preload(self, labels_only: bool = False) -> None:
+        """
+        Load the weights of the models without running any inference.
+
+        This is meant for the master process of a preloading server, which
+        forks the web workers after loading the models so they share the
+        pages of the weights. No inference runs here, because the threads
+        of the detection batchers, the stage executor and the OpenMP pools
+        do not survive a fork; every worker warms up after it is forked.
+
+        :param labels_only: Whether to only load the models used by
+            labels-only predictions, leaving the person detector and SAM
+            unloaded.
+        :type labels_only: bool
+        """
+        segmentation = self.get_segmentation()
+        self.get_classifier()
+        if not labels_only:
+            segmentation.pp_detector
+            segmentation.mask_predictor
+
+    def warm_up(self, labels_only: bool = False) -> None:
+        """
+        Load the models and run a dummy inference through each of them.
+
+        The first inference after loading is slower than the following ones
+        (lazy allocations, kernel selection), so a small blank image and a
+        single classifier row are pushed through the models before any real
+        request arrives. Every mode is warmed up once; a full warm-up also
+        covers the labels-only models. Concurrent callers wait for the
+        first one instead of warming up again.
+
+        :param labels_only: Whether to only warm up the models used by
+            labels-only predictions, leaving the person detector and SAM
+            unloaded.
+        :type labels_only: bool
+        """
+        mode = "labels" if labels_only else "full"
+        with self._lock:
+            if mode in self._warmed_up or "full" in self._warmed_up:
+                return
+            self._warm_up(labels_only)
+            self._warmed_up.add(mode)
+
+    def _warm_up(self, labels_only: bool) -> None:
+        """Run the dummy inference of the warm-up."""
+        segmentation = self.get_segmentation()
+        classifier = self.get_classifier()
+        dummy_image = np.zeros((480, 480, 3), dtype=np.uint8)
+        if labels_only:
+            segmentation.detect_labels(dummy_image)
+        else:
+            segmentation.segment_image(dummy_image)
+            if segmentation.cascade:
+                # The blank image has no person, so the cascade stopped
+                # before the garment detector and SAM.
+                segmentation.detect_labels(dummy_image)
+                segmentation._embed_image(dummy_image)
+        classifier.predict_comfort_level([("short sleeve top", "shorts")],
+                                         25.0, 60.0)
+
+    @property
+    def is_warmed_up(self) -> bool:
+        """Return whether the registry has already been warmed up."""
+        return bool(self._warmed_up)
+
+
+_registry = ModelRegistry()
+
+
+def get_model_registry() -> ModelRegistry:
+    """
+    Get the process-wide model registry.
+
+    :return: The model registry shared by the whole process.
+    :rtype: ModelRegistry
+    """
+    return _registry
@@ -0,0 +1,77 @@
+"""The module containing the rendering of segmentation results."""
+from collections import namedtuple
+
+import numpy as np
+import supervision as sv
+
+from utils.metrics import time_stage
+
+Segmentation = namedtuple("Segmentation", [
+    "labels", "label_names", "detections", "person_detections", "image"])
+Segmentation.__doc__ = """
+The result of segmenting an image, without the rendered image.
+
+:param labels: The upper and lower labels of every detected item.
+:param label_names: The class name of every garment detection.
+:param detections: The garment detections.
+:param person_detections: The person detections, with their SAM masks.
+:param image: The decoded image the detections refer to, which the
+    annotated image is rendered from.
+"""
+
+
+class SegmentationAnnotator:
+    """
+    Render the detections and masks of a segmentation onto its image.
+
+    The annotators do not need any model, so the annotated image can be
+    rendered in a different process or thread than the one that segmented
+    the image.
+    """
+
+    def __init__(self):
+        """Initialize the SegmentationAnnotator class."""
+        self.box_annotator = sv.BoundingBoxAnnotator(
+            color=sv.Color.YELLOW,
+            color_lookup=sv.ColorLookup.INDEX)
+        self.mask_annotator = sv.MaskAnnotator(
+            color_lookup=sv.ColorLookup.INDEX)
+        self.label_annotator = sv.LabelAnnotator(
+            text_position=sv.Position.CENTER,
+            color_lookup=sv.ColorLookup.INDEX)
+        self.corner_annotator = sv.BoxCornerAnnotator(color=sv.Color.GREEN)
+
+    def annotate(self, image: np.ndarray,
+                 segmentation: Segmentation) -> np.ndarray:
+        """
+        Render the segmentation onto a copy of the image.
+
+        :param image: The segmented image.
+        :type image: numpy.ndarray
+        :param segmentation: The segmentation of the image.
+        :type segmentation: Segmentation
+        :return: The annotated image.
+        :rtype: numpy.ndarray
+        """
+        with time_stage("annotation"):
+            return self._annotate(image, segmentation)
+
+    def _annotate(self, image: np.ndarray,
+                  segmentation: Segmentation) -> np.ndarray:
+        """Render the segmentation onto a copy of the image."""
+        annotated_image = image.copy()
+        person_detections = segmentation.person_detections
+        annotated_image = self.corner_annotator.annotate(annotated_image,
+                                                         person_detections)
+        if len(person_detections) and person_detections.mask is not None:
+            annotated_image = self.mask_annotator.annotate(
+                scene=annotated_image, detections=person_detections,
+                custom_color_lookup=np.zeros(len(person_detections),
+                                             dtype=int))
+
+        annotated_image = self.box_annotator.annotate(
+            scene=annotated_image, detections=segmentation.detections)
+        annotated_image = self.label_annotator.annotate(
+            scene=annotated_image, detections=segmentation.detections,
+            labels=[str(label) for label in segmentation.label_names])
+        return annotated_image
@@ -0,0 +1,166 @@
+"""The module containing the tracking of persons across a frame sequence."""
+from collections import Counter, namedtuple
+
+import numpy as np
+import supervision as sv
+
+Track = namedtuple("Track", [
+    "track_id", "label", "label_names", "first_frame", "last_frame",
+    "box", "mask_area"])
+Track.__doc__ = """
+A person tracked across the frames of a sequence.
+
+:param track_id: The id of the track, starting at 1.
+:param label: The most frequent upper and lower labels of the person.
+:param label_names: The class names of the garments seen on the person.
+:param first_frame: The index of the first frame the person is seen in.
+:param last_frame: The index of the last frame the person is seen in.
+:param box: The last box of the person, in xyxy format.
+:param mask_area: The pixels of the SAM mask of the person when first seen.
+"""
+
+
+class _TrackState:
+    """The observations of a track collected so far."""
+
+    def __init__(self, frame_index: int):
+        """Initialize the _TrackState class."""
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+        self.box = None
+        self.mask_area = 0
+        self.label_names = Counter()
+        self.upper = Counter()
+        self.lower = Counter()
+
+
+class SequenceTracker:
+    """
+    Track the persons of a frame sequence and vote on their garments.
+
+    The persons are tracked with ByteTrack across every frame. The
+    garments detected on a keyframe are given to the tracked person whose
+    box covers most of them. A track's label is the most frequent upper and
+    lower garment over its keyframes.
+    """
+
+    def __init__(self, frame_rate: int = 30):
+        """
+        Initialize the SequenceTracker class.
+
+        :param frame_rate: The frame rate of the sequence, which sets how
+            long a lost person is kept before its track ends.
+        :type frame_rate: int
+        """
+        self.tracker = sv.ByteTrack(frame_rate=frame_rate)
+        self._tracks = {}
+        self._tracked = sv.Detections.empty()
+
+    def update(self, frame_index: int,
+               person_detections: sv.Detections) -> sv.Detections:
+        """
+        Track the persons of a frame.
+
+        :param frame_index: The index of the frame in the sequence.
+        :type frame_index: int
+        :param person_detections: The person detections of the frame.
+        :type person_detections: supervision.Detections
+        :return: The tracked persons that are seen for the first time.
+        :rtype: supervision.Detections
+        """
+        tracked = self.tracker.update_with_detections(person_detections)
+        is_new = np.array([tracker_id not in self._tracks
+                           for tracker_id in tracked.tracker_id], dtype=bool)
+        for tracker_id, box in zip(tracked.tracker_id, tracked.xyxy):
+            state = self._tracks.setdefault(tracker_id,
+                                            _TrackState(frame_index))
+            state.last_frame = frame_index
+            state.box = box
+        self._tracked = tracked
+        return tracked[is_new]
+
+    def set_masks(self, new_persons: sv.Detections,
+                  masks: np.ndarray) -> None:
+        """
+        Record the SAM masks of the persons seen for the first time.
+
+        :param new_persons: The new tracked persons.
+        :type new_persons: supervision.Detections
+        :param masks: The masks of the persons, with shape (N, H, W).
+        :type masks: numpy.ndarray
+        """
+        for tracker_id, mask in zip(new_persons.tracker_id, masks):
+            self._tracks[tracker_id].mask_area = int(mask.sum())
+
+    def assign_garments(self, detections: sv.Detections, label_names: list,
+                        labels: list) -> None:
+        """
+        Give the garments of the last keyframe to the tracked persons.
+
+        :param detections: The garment detections of the keyframe.
+        :type detections: supervision.Detections
+        :param label_names: The class name of every garment detection.
+        :type label_names: list
+        :param labels: The upper and lower labels of every detection.
+        :type labels: list[tuple]
+        """
+        if len(self._tracked) == 0 or len(detections) == 0:
+            return
+        coverage = self._coverage(detections.xyxy, self._tracked.xyxy)
+        for index, (upper, lower) in enumerate(labels):
+            person = coverage[index].argmax()
+            if coverage[index, person] < 0.5:
+                continue
+            state = self._tracks[self._tracked.tracker_id[person]]
+            state.label_names[label_names[index]] += 1
+            if upper:
+                state.upper[upper] += 1
+            if lower:
+                state.lower[lower] += 1
+
+    def tracks(self) -> list:
+        """
+        Get the tracks of the sequence.
+
+        :return: The tracks, numbered from 1 in order of appearance.
+        :rtype: list[Track]
+        """
+        tracks = []
+        states = sorted(self._tracks.values(),
+                        key=lambda state: state.first_frame)
+        for track_id, state in enumerate(states, start=1):
+            tracks.append(Track(
+                track_id,
+                (self._most_common(state.upper),
+                 self._most_common(state.lower)),
+                sorted(state.label_names),
+                state.first_frame,
+                state.last_frame,
+                [float(value) for value in state.box],
+                state.mask_area))
+        return tracks
+
+    def _coverage(self, boxes: np.ndarray,
+                  person_boxes: np.ndarray) -> np.ndarray:
+        """
+        Compute the fraction of every box that lies inside every person box.
+
+        :param boxes: The garment boxes, with shape (N, 4).
+        :type boxes: numpy.ndarray
+        :param person_boxes: The person boxes, with shape (M, 4).
+        :type person_boxes: numpy.ndarray
+        :return: The covered fractions, with shape (N, M).
+        :rtype: numpy.ndarray
+        """
+        top_left = np.maximum(boxes[:, None, :2], person_boxes[None, :, :2])
+        bottom_right = np.minimum(boxes[:, None, 2:],
+                                  person_boxes[None, :, 2:])
+        intersection = np.prod(np.clip(bottom_right - top_left, 0, None),
+                               axis=2)
+        areas = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)
+        return intersection / np.maximum(areas, 1e-6)[:, None]
+
+    @staticmethod
+    def _most_common(counter: Counter):
+        """Get the most common value of a counter, or None if empty."""
+        return counter.most_common(1)[0][0] if counter else None
@@ -1,3 +1,41 @@
-"""A module that defines the URL configuration for the app."""
-from models.ImageSegmentation import ImageSegmentation  # noqa: F401
-from models.ComfortClassifier import ComfortClassifier  # noqa: F401
+"""
+The inference models of the app.
+
+The models depend on torch, ultralytics, segment_anything, supervision and
+cv2, which take seconds to import. The names below are therefore imported
+from their submodules on first access, so that importing the package, the
+URL configuration or the management commands stays light and the heavy
+libraries are only loaded by the first inference call.
+
+Once a submodule is imported, its name on the package is the submodule,
+so the classes named like their submodule (e.g. ``ImageSegmentation``)
+are imported from the submodule itself inside the project.
+"""
+import importlib
+
+_SUBMODULES = {
+    "ImageSegmentation": "models.ImageSegmentation",
+    "load_detector": "models.ImageSegmentation",
+    "load_sam": "models.ImageSegmentation",
+    "Segmentation": "models.SegmentationAnnotator",
+    "SegmentationAnnotator": "models.SegmentationAnnotator",
+    "SequenceTracker": "models.SequenceTracking",
+    "Track": "models.SequenceTracking",
+    "ComfortClassifier": "models.ComfortClassifier",
+    "ModelRegistry": "models.ModelRegistry",
+    "get_model_registry": "models.ModelRegistry",
+    "InferencePool": "models.InferencePool",
+    "InferenceTimeoutError": "models.InferencePool",
+    "get_inference_pool": "models.InferencePool",
+}
+
+__all__ = list(_SUBMODULES)
+
+
+def __getattr__(name: str):
+    """Import a name of the package from its submodule on first access."""
+    if name not in _SUBMODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_SUBMODULES[name]), name)
+    globals()[name] = value
+    return value
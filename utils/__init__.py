@@ -1,2 +1,10 @@
 from .abstract_model import AbstractModel
 from .download_weights import check_and_download_files
+from .image_decoding import ImageDecodeError, ImageTooLargeError, \
+    decode_image, read_image_size, reduction_factor
+from .image_encoding import EncodedImage, encode_image
+from .video_decoding import VideoKeyframes
+from .single_flight import SingleFlight
+from .metrics import get_metrics_registry, time_stage
+from .cpu_scheduler import CpuSlot, apply_cpu_slot, available_cores, \
+    get_cpu_slot, partition_cores, set_torch_threads
@@ -0,0 +1,184 @@
+"""Partitioning of the CPU cores between the inference processes."""
+import fcntl
+import logging
+import os
+import sys
+import tempfile
+from collections import namedtuple
+
+CpuSlot = namedtuple("CpuSlot", ["index", "slots", "cores",
+                                 "intra_op_threads", "inter_op_threads",
+                                 "pinned"])
+
+logger = logging.getLogger(__name__)
+
+_current_slot = None
+_slot_lock_file = None
+
+
+def available_cores() -> list:
+    """
+    Get the CPU cores the current process may run its inference on.
+
+    Returns:
+    list: The cores of the slot applied to the process, or else the cores of
+        its CPU affinity.
+    """
+    if _current_slot is not None:
+        return list(_current_slot.cores)
+    return _affinity()
+
+
+def _affinity() -> list:
+    """Get the cores of the CPU affinity of the current process."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(slots: int, cores: list = None) -> list:
+    """
+    Split the cores into contiguous, evenly sized groups.
+
+    When there are fewer cores than slots, the slots share the cores round
+    robin so every slot gets one core.
+
+    Parameters:
+    slots (int): The number of groups.
+    cores (list): The cores to split, by default the CPU affinity of the
+        process.
+
+    Returns:
+    list: The cores of each group.
+    """
+    cores = sorted(cores if cores is not None else _affinity())
+    if slots >= len(cores):
+        return [[cores[index % len(cores)]] for index in range(slots)]
+    size, remainder = divmod(len(cores), slots)
+    partitions = []
+    start = 0
+    for index in range(slots):
+        end = start + size + (1 if index < remainder else 0)
+        partitions.append(cores[start:end])
+        start = end
+    return partitions
+
+
+def claim_cpu_slot(slots: int, lock_dir: str = None) -> int:
+    """
+    Claim a slot that no other live process of the host holds.
+
+    The slot is held with an exclusive lock on a file in the lock directory
+    for the lifetime of the process, so a restarted worker takes over the
+    slot of the worker it replaces.
+
+    Parameters:
+    slots (int): The number of slots.
+    lock_dir (str): The directory of the lock files, by default the
+        temporary directory.
+
+    Returns:
+    int: The claimed slot, or the slot picked from the process id when all
+        the slots are held.
+    """
+    global _slot_lock_file
+    lock_dir = lock_dir or tempfile.gettempdir()
+    for index in range(slots):
+        lock_file = open(os.path.join(lock_dir,
+                                      f"comfywear-cpu-slot-{index}.lock"),
+                         "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        if _slot_lock_file is not None:
+            _slot_lock_file.close()
+        _slot_lock_file = lock_file
+        return index
+    return os.getpid() % slots
+
+
+def apply_cpu_slot(slots: int, index: int = None, pin: bool = False,
+                   inter_op_threads: int = 1, lock_dir: str = None):
+    """
+    Restrict the inference of the current process to one slot of cores.
+
+    The OpenMP and MKL thread counts are set in the environment, so a torch
+    imported afterwards picks them up. The intra-op threads of a torch that
+    is already imported are left to :func:`set_torch_threads`, which splits
+    the slot between the segmentation stages. The layout is logged so it
+    shows up in the startup logs.
+
+    Parameters:
+    slots (int): The number of slots the cores are split into.
+    index (int): The slot of the process, by default the first free one.
+    pin (bool): Whether to pin the process to the cores of its slot.
+    inter_op_threads (int): The inter-op threads of torch.
+    lock_dir (str): The directory of the slot lock files.
+
+    Returns:
+    CpuSlot: The applied slot.
+    """
+    global _current_slot
+    if index is None:
+        index = claim_cpu_slot(slots, lock_dir)
+    cores = partition_cores(slots)[index % slots]
+    intra_op_threads = len(cores)
+
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[variable] = str(intra_op_threads)
+    if pin and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # The inter-op pool cannot be resized once it has started.
+            pass
+
+    _current_slot = CpuSlot(index % slots, slots, cores, intra_op_threads,
+                            inter_op_threads, pin)
+    logger.info("CPU slot %d/%d (pid %d): cores %s, %d intra-op and %d "
+                "inter-op threads%s.", _current_slot.index + 1, slots,
+                os.getpid(), cores, intra_op_threads, inter_op_threads,
+                ", pinned" if pin else "")
+    return _current_slot
+
+
+def set_torch_threads(stage_threads: int = 1, torch_threads: int = None):
+    """
+    Set the intra-op threads of torch for the cores of the process.
+
+    The cores of the applied slot, or else of the CPU affinity, are split
+    between the segmentation stages running concurrently. Call it again
+    after applying a slot, so a model loaded before the fork of a worker
+    does not keep the thread count of the whole host.
+
+    Parameters:
+    stage_threads (int): The number of stages running concurrently.
+    torch_threads (int): The intra-op threads, by default the cores split
+        between the stages.
+
+    Returns:
+    int: The intra-op threads, or None when torch keeps its default.
+    """
+    if torch_threads is None:
+        if stage_threads <= 1 and _current_slot is None:
+            return None
+        torch_threads = max(1, len(available_cores()) // max(1, stage_threads))
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(torch_threads)
+    return torch_threads
+
+
+def get_cpu_slot():
+    """
+    Get the slot applied to the current process.
+
+    Returns:
+    CpuSlot: The applied slot, or None if the cores are not partitioned.
+    """
+    return _current_slot
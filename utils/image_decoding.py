@@ -0,0 +1,116 @@
+"""Helpers for decoding uploaded images in memory."""
+import io
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+# The names of the cv2 flags decoding a JPEG at 1/2, 1/4 and 1/8 of its
+# size. cv2 is only imported when an image is decoded, so the flags are
+# looked up by name.
+_REDUCED_DECODE_FLAGS = {
+    2: "IMREAD_REDUCED_COLOR_2",
+    4: "IMREAD_REDUCED_COLOR_4",
+    8: "IMREAD_REDUCED_COLOR_8",
+}
+
+
+class ImageDecodeError(ValueError):
+    """Raised when an uploaded image cannot be decoded."""
+
+
+class ImageTooLargeError(ImageDecodeError):
+    """Raised when an uploaded image has more pixels than allowed."""
+
+
+def read_image_size(image) -> tuple:
+    """
+    Read the size of an encoded image from its header.
+
+    Parameters:
+    image (bytes | str): The encoded image bytes or the path of the image.
+
+    Returns:
+    tuple: The width and height of the image, or None if the header cannot
+        be read.
+    """
+    source = image if isinstance(image, str) else io.BytesIO(image)
+    try:
+        with Image.open(source) as header:
+            return header.size
+    except Image.DecompressionBombError:
+        raise ImageTooLargeError("The image has too many pixels.")
+    except (UnidentifiedImageError, OSError):
+        return None
+
+
+def reduction_factor(width: int, height: int, max_side: int = None) -> int:
+    """
+    Get the largest reduction of an image that keeps its long side.
+
+    Parameters:
+    width (int): The width of the image.
+    height (int): The height of the image.
+    max_side (int): The smallest long side to keep, or None for no
+        reduction.
+
+    Returns:
+    int: 8, 4 or 2 if the image reduced by that factor is still at least
+        ``max_side`` long, otherwise 1.
+    """
+    if max_side:
+        for factor in (8, 4, 2):
+            if max(width, height) // factor >= max_side:
+                return factor
+    return 1
+
+
+def decode_image(image, max_side: int = None,
+                 max_pixels: int = None) -> np.ndarray:
+    """
+    Decode an image into a BGR array.
+
+    The size is read from the header before decoding, so images above the
+    pixel limit are rejected without allocating them. When the image is at
+    least twice as large as ``max_side`` on its long side, it is decoded at
+    1/2, 1/4 or 1/8 of its size, keeping the long side at ``max_side`` or
+    more. JPEGs are then decoded directly at the reduced size.
+
+    Parameters:
+    image (bytes | str | numpy.ndarray): The encoded image bytes, the path of
+        the image file or an already decoded image, which is returned as is.
+    max_side (int): The smallest long side the image is decoded at, or None
+        to decode it at full size.
+    max_pixels (int): The largest number of pixels accepted, or None for no
+        limit.
+
+    Returns:
+    numpy.ndarray: The decoded image.
+
+    Raises:
+    ImageDecodeError: If the image cannot be decoded.
+    ImageTooLargeError: If the image has more than ``max_pixels`` pixels.
+    """
+    if isinstance(image, np.ndarray):
+        return image
+
+    import cv2
+
+    flags = cv2.IMREAD_COLOR
+    size = read_image_size(image) if max_side or max_pixels else None
+    if size is not None:
+        width, height = size
+        if max_pixels and width * height > max_pixels:
+            raise ImageTooLargeError(
+                f"The image has {width * height} pixels, the limit is "
+                f"{max_pixels}.")
+        factor = reduction_factor(width, height, max_side)
+        if factor in _REDUCED_DECODE_FLAGS:
+            flags = getattr(cv2, _REDUCED_DECODE_FLAGS[factor])
+
+    if isinstance(image, str):
+        decoded = cv2.imread(image, flags)
+    else:
+        decoded = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), flags)
+    if decoded is None:
+        raise ImageDecodeError("The image cannot be decoded.")
+    return decoded
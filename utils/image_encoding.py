@@ -0,0 +1,53 @@
+"""Helpers for encoding the images produced by the app."""
+from collections import namedtuple
+
+import numpy as np
+
+EncodedImage = namedtuple("EncodedImage", ["content", "extension"])
+
+# The file extension and the name of the cv2 quality flag of every format.
+# cv2 is only imported when an image is encoded, so the flags are looked up
+# by name. PNG is lossless and has no quality.
+_FORMATS = {
+    "webp": (".webp", "IMWRITE_WEBP_QUALITY"),
+    "jpeg": (".jpg", "IMWRITE_JPEG_QUALITY"),
+    "png": (".png", None),
+}
+
+
+def encode_image(image: np.ndarray, format: str = "webp", quality: int = 80,
+                 max_side: int = None) -> EncodedImage:
+    """
+    Encode a BGR array into an image file.
+
+    Parameters:
+    image (numpy.ndarray): The BGR image to encode.
+    format (str): The format of the file, "webp", "jpeg" or "png".
+    quality (int): The quality of a WebP or JPEG file, from 0 to 100.
+    max_side (int): The largest long side of the file, or None to keep the
+        size of the image. Larger images are reduced before the encoding.
+
+    Returns:
+    EncodedImage: The content of the file and its extension, with the dot.
+
+    Raises:
+    ValueError: If the format is unknown or the image cannot be encoded.
+    """
+    if format not in _FORMATS:
+        raise ValueError(f"Unknown image format {format!r}, use one of "
+                         f"{', '.join(_FORMATS)}.")
+    import cv2
+
+    height, width = image.shape[:2]
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        image = cv2.resize(image, (max(1, round(width * scale)),
+                                   max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+    extension, quality_flag = _FORMATS[format]
+    params = [getattr(cv2, quality_flag), quality] if quality_flag else []
+    ok, content = cv2.imencode(extension, image, params)
+    if not ok:
+        raise ValueError(f"The image cannot be encoded as {format}.")
+    return EncodedImage(content.tobytes(), extension)
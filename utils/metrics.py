@@ -0,0 +1,401 @@
+"""Process-wide inference metrics, exposed in the Prometheus text format."""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+# The upper bounds, in seconds, of the buckets of the stage histograms.
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsRegistry:
+    """
+    The metrics of the current process.
+
+    The metrics recorded by an inference worker are drained after every
+    job and merged into the registry of the process that sent the job, so
+    the process serving the metrics endpoint sees the whole inference.
+
+    Web processes served by several workers save their totals to a shared
+    directory with :meth:`write`, and :meth:`render_directory` renders the
+    sum of the totals of every process that saved them.
+    """
+
+    def __init__(self):
+        """Initialize the MetricsRegistry class."""
+        self._metrics = {}
+        self._file_pid = None
+        self._file_name = None
+        self._written = None
+
+    def register(self, metric) -> None:
+        """
+        Add a metric to the registry.
+
+        Parameters:
+        metric (Counter | Histogram): The metric to add.
+        """
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        Returns:
+        str: The exposition of every metric.
+        """
+        return "".join(metric.render() for metric in self._metrics.values())
+
+    def drain(self) -> dict:
+        """
+        Take the values recorded since the last drain.
+
+        The metrics keep their totals, so a drained registry can still be
+        rendered.
+
+        Returns:
+        dict: The recorded values of every metric, by name.
+        """
+        return {name: values for name, metric in self._metrics.items()
+                if (values := metric.drain())}
+
+    def merge(self, drained: dict) -> None:
+        """
+        Add values drained from the registry of another process.
+
+        Parameters:
+        drained (dict): The values returned by :meth:`drain`.
+        """
+        for name, values in drained.items():
+            if name in self._metrics:
+                self._metrics[name].merge(values)
+
+    def collect(self) -> dict:
+        """
+        Take a copy of the totals of every metric.
+
+        Returns:
+        dict: The totals of every metric that recorded a value, by name.
+        """
+        return {name: values for name, metric in self._metrics.items()
+                if (values := metric.collect())}
+
+    def write(self, directory: str) -> None:
+        """
+        Save the totals of the process in the shared directory.
+
+        Every process writes its own file, named after its process id and a
+        random token so a later process reusing the id does not overwrite
+        it. The files of the processes that exited are kept, so the counters
+        never go down; empty the directory when the server starts. Nothing
+        is written when the totals did not change.
+
+        Parameters:
+        directory (str): The directory shared by the processes.
+        """
+        totals = self.collect()
+        if os.getpid() != self._file_pid:
+            # A forked process starts a file of its own.
+            self._file_pid = os.getpid()
+            self._file_name = f"{self._file_pid}-{uuid.uuid4().hex}.json"
+            self._written = None
+        if (directory, totals) == self._written:
+            return
+        content = json.dumps({name: [[list(key), value]
+                                     for key, value in values.items()]
+                              for name, values in totals.items()})
+        descriptor, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w") as file:
+            file.write(content)
+        os.replace(path, os.path.join(directory, self._file_name))
+        self._written = (directory, totals)
+
+    def render_directory(self, directory: str) -> str:
+        """
+        Render the sum of the totals saved in the shared directory.
+
+        Parameters:
+        directory (str): The directory shared by the processes.
+
+        Returns:
+        str: The exposition of the metrics of every process.
+        """
+        aggregate = MetricsRegistry()
+        for metric in self._metrics.values():
+            metric.clone(aggregate)
+        for file_name in sorted(os.listdir(directory)):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, file_name)) as file:
+                    saved = json.load(file)
+            except (OSError, ValueError):
+                # The file of a process being replaced, or a foreign one.
+                continue
+            aggregate.merge({name: {tuple(key): value for key, value in values}
+                             for name, values in saved.items()})
+        return aggregate.render()
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Get the metrics registry of the current process.
+
+    Returns:
+    MetricsRegistry: The registry shared by the whole process.
+    """
+    return _registry
+
+
+def _format_labels(labelnames: tuple, values: tuple, **extra) -> str:
+    """Format the labels of a sample, escaping their values."""
+    pairs = list(zip(labelnames, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace(
+            '"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple = (), registry: MetricsRegistry = None):
+        """
+        Initialize the Counter class.
+
+        Parameters:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (tuple): The names of the labels of the metric.
+        registry (MetricsRegistry): The registry of the metric, by default
+            the registry of the process.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._drained = {}
+        (registry or _registry).register(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increase the counter.
+
+        Parameters:
+        amount (float): The amount to add.
+        **labels: The value of every label of the metric.
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> str:
+        """Render the counter in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        if not values and not self.labelnames:
+            values[()] = 0
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}"
+                         f"{_format_labels(self.labelnames, key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def clone(self, registry: MetricsRegistry) -> "Counter":
+        """Create an empty counter like this one in the registry."""
+        return Counter(self.name, self.documentation, self.labelnames,
+                       registry=registry)
+
+    def collect(self) -> dict:
+        """Take a copy of the totals of the counter."""
+        with self._lock:
+            return dict(self._values)
+
+    def drain(self) -> dict:
+        """Take the increments since the last drain."""
+        with self._lock:
+            drained = {key: value - self._drained.get(key, 0)
+                       for key, value in self._values.items()
+                       if value != self._drained.get(key, 0)}
+            self._drained = dict(self._values)
+        return drained
+
+    def merge(self, values: dict) -> None:
+        """Add the increments drained from another process."""
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, split by labels."""
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple = (), buckets: tuple = STAGE_BUCKETS,
+                 registry: MetricsRegistry = None):
+        """
+        Initialize the Histogram class.
+
+        Parameters:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (tuple): The names of the labels of the metric.
+        buckets (tuple): The sorted upper bounds of the buckets; the +Inf
+            bucket is added.
+        registry (MetricsRegistry): The registry of the metric, by default
+            the registry of the process.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # Every label key holds its per-bucket counts, with the +Inf bucket
+        # last, and the sum of its observations.
+        self._values = {}
+        self._drained = {}
+        (registry or _registry).register(self)
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Record an observation.
+
+        Parameters:
+        value (float): The observed value.
+        **labels: The value of every label of the metric.
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or (
+                [0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels) -> "_Timer":
+        """
+        Observe the seconds spent in a block.
+
+        Parameters:
+        **labels: The value of every label of the metric.
+
+        Returns:
+        _Timer: A context manager timing its block.
+        """
+        return _Timer(self, labels)
+
+    def render(self) -> str:
+        """Render the histogram in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = {key: (list(counts), total)
+                      for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, le=bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def clone(self, registry: MetricsRegistry) -> "Histogram":
+        """Create an empty histogram like this one in the registry."""
+        return Histogram(self.name, self.documentation, self.labelnames,
+                         self.buckets, registry=registry)
+
+    def collect(self) -> dict:
+        """Take a copy of the totals of the histogram."""
+        with self._lock:
+            return {key: (list(counts), total)
+                    for key, (counts, total) in self._values.items()}
+
+    def drain(self) -> dict:
+        """Take the observations since the last drain."""
+        drained = {}
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                previous_counts, previous_total = self._drained.get(key) or (
+                    [0] * len(counts), 0.0)
+                if counts != previous_counts:
+                    drained[key] = ([count - previous for count, previous
+                                     in zip(counts, previous_counts)],
+                                    total - previous_total)
+            self._drained = {key: (list(counts), total)
+                             for key, (counts, total) in self._values.items()}
+        return drained
+
+    def merge(self, values: dict) -> None:
+        """Add the observations drained from another process."""
+        with self._lock:
+            for key, (counts, total) in values.items():
+                current_counts, current_total = self._values.get(key) or (
+                    [0] * len(counts), 0.0)
+                self._values[key] = ([current + count for current, count
+                                      in zip(current_counts, counts)],
+                                     current_total + total)
+
+
+class _Timer:
+    """A context manager observing the seconds spent in its block."""
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        """Initialize the _Timer class."""
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        """Start the timer."""
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Observe the elapsed seconds, also when the block raised."""
+        self.histogram.observe(time.perf_counter() - self.start,
+                               **self.labels)
+
+
+STAGE_SECONDS = Histogram(
+    "comfywear_stage_seconds",
+    "Seconds spent in every stage of the prediction pipeline.",
+    ("stage",))
+IMAGES = Counter("comfywear_images_total", "Images segmented.")
+DETECTIONS = Counter("comfywear_detections_total",
+                     "Garments detected in the segmented images.")
+SAM_BOXES = Counter("comfywear_sam_boxes_total",
+                    "Person boxes sent to SAM for a mask.")
+EMBEDDING_CACHE = Counter(
+    "comfywear_embedding_cache_total",
+    "Lookups of the SAM embedding cache, by result: hit, disk_hit or miss.",
+    ("result",))
+
+
+def time_stage(stage: str):
+    """
+    Time a stage of the prediction pipeline.
+
+    Parameters:
+    stage (str): The name of the stage.
+
+    Returns:
+    _Timer: A context manager observing the seconds spent in the stage.
+    """
+    return STAGE_SECONDS.time(stage=stage)
@@ -0,0 +1,62 @@
+"""Coalescing of concurrent calls that compute the same value."""
+import threading
+
+
+class _Call:
+    """A call whose result is shared by every caller of its key."""
+
+    def __init__(self):
+        """Initialize the _Call class."""
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Run a function at most once at a time per key.
+
+    The first caller of a key runs the function; callers that arrive with
+    the same key while it is running wait for it and receive its result, or
+    its exception, instead of running the function again.
+    """
+
+    def __init__(self):
+        """Initialize the SingleFlight class."""
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        """
+        Run the function, or wait for the running call with the same key.
+
+        Parameters:
+        key (Hashable): The key identifying the value being computed.
+        function (Callable): The function computing the value.
+
+        Returns:
+        Any: The value returned by the function.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
@@ -0,0 +1,94 @@
+"""Helpers for reading the keyframes of uploaded videos."""
+import os
+import tempfile
+
+from .image_decoding import ImageDecodeError, ImageTooLargeError, \
+    reduction_factor
+
+
+class VideoKeyframes:
+    """
+    The keyframes of an encoded video, decoded one at a time.
+
+    OpenCV can only open videos from a file, so the video is written to a
+    temporary file while it is read. Only every ``interval``-th frame is
+    decoded; the frames in between are skipped without being converted.
+    """
+
+    def __init__(self, video: bytes, interval: int = 1,
+                 max_frames: int = None, max_side: int = None,
+                 max_pixels: int = None):
+        """
+        Initialize the VideoKeyframes class.
+
+        Parameters:
+        video (bytes): The encoded video.
+        interval (int): The number of frames between two keyframes.
+        max_frames (int): The number of frames read at most, or None to
+            read the whole video.
+        max_side (int): The smallest long side the keyframes are reduced
+            to, or None to keep them at full size.
+        max_pixels (int): The largest number of pixels of a frame, or None
+            for no limit.
+
+        Raises:
+        ImageDecodeError: If the video cannot be opened.
+        ImageTooLargeError: If the frames have more than ``max_pixels``
+            pixels.
+        """
+        import cv2
+
+        self.interval = max(1, interval)
+        self.max_frames = max_frames
+        file = tempfile.NamedTemporaryFile(suffix=".video", delete=False)
+        with file:
+            file.write(video)
+        self.path = file.name
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            self.close()
+            raise ImageDecodeError("The video cannot be decoded.")
+
+        width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if max_pixels and width * height > max_pixels:
+            self.close()
+            raise ImageTooLargeError(
+                f"The video frames have {width * height} pixels, the limit "
+                f"is {max_pixels}.")
+        self.factor = reduction_factor(width, height, max_side)
+        self.frame_rate = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def __iter__(self):
+        """
+        Decode the keyframes, closing the video once they are read.
+
+        Returns:
+        Iterator[tuple]: The index and the BGR array of every keyframe.
+        """
+        import cv2
+
+        try:
+            index = 0
+            while self.max_frames is None or index < self.max_frames:
+                if not self.capture.grab():
+                    break
+                if index % self.interval == 0:
+                    ok, frame = self.capture.retrieve()
+                    if not ok:
+                        break
+                    if self.factor > 1:
+                        frame = cv2.resize(
+                            frame, (frame.shape[1] // self.factor,
+                                    frame.shape[0] // self.factor),
+                            interpolation=cv2.INTER_AREA)
+                    yield index, frame
+                index += 1
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Release the video and delete its temporary file."""
+        self.capture.release()
+        if os.path.exists(self.path):
+            os.remove(self.path)